@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+"""
+Compare the stability and speed of the forward, backward and Crank-Nicolson
+schemes that are used to compute synthetic hydrographs on the sample
+weather and water level datasets.
+
+Usage:
+
+    python benchmarks/bench_hydrograph_schemes.py [--mrc A B] [--nmodels M]
+
+The stability of each scheme is assessed by comparing the hydrographs it
+produces for increasing values of the MRC coefficient A (in 1/day) with a
+reference solution computed with the same scheme and 1000 sub-steps per
+day. The speed is measured for a batch of models, for the tangent-linear
+kernel that is used to optimize Sy, and for a complete GLUE evaluation.
+"""
+
+# ---- Standard imports
+import argparse
+import os.path as osp
+from time import perf_counter
+
+# ---- Third party imports
+import numpy as np
+
+# ---- Local imports
+from gwhat import __rootdir__
+from gwhat.meteo.weather_reader import WXDataFrame
+from gwhat.projet.reader_waterlvl import WLDataset
+from gwhat.hydrocalc.recession.recession_calc import calculate_mrc
+from gwhat.utils.math import resample_daily
+from gwhat.gwrecharge.gwrecharge_calc2 import RechgEvalWorker
+from gwhat.gwrecharge.gwrecharge_calculs import (
+    calcul_surf_water_budget_batch, calc_hydrograph_forward,
+    calc_hydrograph_backward, calc_hydrograph_cn, calc_hydrograph_batch,
+    calc_hydrograph_tl, HYDROGRAPH_SCHEMES)
+
+DATADIR = osp.join(__rootdir__, 'tests', 'data')
+WXFILENAME = osp.join(DATADIR, "MARIEVILLE (7024627)_2000-2015.out")
+WLFILENAME = osp.join(DATADIR, 'sample_water_level_datafile.csv')
+
+SCHEME_FUNCS = {'forward': calc_hydrograph_forward,
+                'backward': calc_hydrograph_backward,
+                'crank-nicolson': calc_hydrograph_cn}
+
+
+class SampleWLDataset(WLDataset):
+    """A water level dataset read from a file with a given MRC."""
+
+    def __init__(self, filename, A, B):
+        super().__init__(filename)
+        self._mrc = {'params': (A, B), 'peak_indx': [],
+                     'time': np.array([]), 'recess': np.array([])}
+
+    def get_mrc(self):
+        return self._mrc
+
+
+def estimate_mrc(wldset, min_length=15):
+    """
+    Estimate the coefficients A and B of the MRC of the water level dataset
+    from all the periods of at least min_length days during which the
+    water levels, in meters below the ground surface, are increasing.
+    """
+    t, h = resample_daily(wldset.xldates, wldset['WL'], policy='last')
+    dh = np.diff(h) > 0
+    periods = []
+    istart = None
+    for i, is_receding in enumerate(np.append(dh, False)):
+        if is_receding and istart is None:
+            istart = i
+        elif not is_receding and istart is not None:
+            if i - istart >= min_length:
+                periods.append((t[istart], t[i]))
+            istart = None
+    coeffs = calculate_mrc(t, h, periods)[0]
+    return coeffs.A, coeffs.B
+
+
+def timeit(func, *args, repeat=5, **kwargs):
+    """Return the best time in seconds of repeat calls to func."""
+    times = []
+    for i in range(repeat):
+        ts = perf_counter()
+        func(*args, **kwargs)
+        times.append(perf_counter() - ts)
+    return min(times)
+
+
+def calc_hydrograph_python(rechg, wlobs, Sy, A, B):
+    """
+    The pure Python backward scheme that was used before the compiled
+    kernels, used as a baseline for the speed benchmark.
+    """
+    wlpre = np.zeros(len(wlobs))
+    wlpre[-1] = wlobs[-1]
+    for i in reversed(range(len(wlobs) - 1)):
+        recess = max((B - A * wlpre[i+1] / 1000.) * 1000, 0)
+        wlpre[i] = wlpre[i+1] + (rechg[i] / Sy) - recess
+    return wlpre
+
+
+def calc_reference(nscheme, rechg, wlobs, Sy, A, B, nsubsteps=1000):
+    """
+    Compute a reference hydrograph with the scheme using nsubsteps
+    sub-steps per day, over which the daily recharge is evenly spread.
+    """
+    N = len(wlobs)
+    rechg_sub = np.repeat(rechg[:N - 1] / nsubsteps, nsubsteps)
+    wlobs_sub = np.full(len(rechg_sub) + 1, np.nan)
+    wlobs_sub[0] = wlobs[0]
+    wlobs_sub[-1] = wlobs[-1]
+    wlpre_sub = SCHEME_FUNCS[nscheme](
+        rechg_sub, wlobs_sub, Sy, A / nsubsteps, B / nsubsteps)
+    return wlpre_sub[::nsubsteps]
+
+
+def bench_stability(rechg, wlobs, Sy, B_over_A):
+    """
+    Print the maximum difference between the hydrographs of each scheme
+    and the reference solution for increasing values of A, where B is set
+    so that the equilibrium water level of the recession remains the same.
+    """
+    print('Stability: max abs difference with the reference solution (mm)')
+    print('{:>8}'.format('A (1/d)') + ''.join(
+        '{:>18}'.format(nscheme) for nscheme in HYDROGRAPH_SCHEMES))
+    with np.errstate(all='ignore'):
+        for A in [0.001, 0.01, 0.1, 0.5, 1, 1.5, 2, 2.5, 4]:
+            B = B_over_A * A
+            row = '{:>8}'.format(A)
+            for nscheme, func in SCHEME_FUNCS.items():
+                wlpre = func(rechg, wlobs, Sy, A, B)
+                wlref = calc_reference(nscheme, rechg, wlobs, Sy, A, B)
+                err = np.max(np.abs(wlpre - wlref))
+                row += '{:>18}'.format(
+                    '{:0.3g}'.format(err) if np.isfinite(err) and err < 1e9
+                    else 'unstable')
+            print(row)
+
+
+def bench_speed(rechg, wlobs, SY, A, B):
+    """
+    Print the time required to compute the hydrographs of a batch of
+    models and to compute a single hydrograph with its derivative.
+    """
+    M = len(SY)
+    wlpre = np.empty((M, len(wlobs)))
+    print('Speed: time per model (microseconds)')
+    print('{:>16}{:>14}{:>14}{:>14}'.format(
+        'scheme', 'single', 'batch', 'tl'))
+    for nscheme, func in SCHEME_FUNCS.items():
+        t_single = timeit(func, rechg[0], wlobs, SY[0], A, B, repeat=50)
+        t_batch = timeit(calc_hydrograph_batch, rechg, wlobs, SY, A, B,
+                         wlpre, nscheme=nscheme) / M
+        t_tl = timeit(calc_hydrograph_tl, rechg[0], wlobs, SY[0], A, B,
+                      nscheme, repeat=50)
+        print('{:>16}{:>14.2f}{:>14.2f}{:>14.2f}'.format(
+            nscheme, t_single * 1e6, t_batch * 1e6, t_tl * 1e6))
+    t_python = timeit(calc_hydrograph_python, rechg[0], wlobs, SY[0], A, B)
+    print('{:>16}{:>14.2f}'.format('backward (py)', t_python * 1e6))
+
+
+def bench_glue(wxdset, wldset):
+    """
+    Print the time required to evaluate GLUE with each scheme, along with
+    the number of behavioural models and the RMSE of the best one.
+    """
+    print('GLUE: rough grid, Sy in [0.01, 0.5]')
+    print('{:>16}{:>10}{:>10}{:>12}{:>10}'.format(
+        'scheme', 'time (s)', 'count', 'best RMSE', 'best Sy'))
+    for nscheme in HYDROGRAPH_SCHEMES:
+        rechg_worker = RechgEvalWorker()
+        rechg_worker.Sy = (0.01, 0.5)
+        rechg_worker.Cro = (0.1, 0.3)
+        rechg_worker.RASmax = (5, 40)
+        rechg_worker.glue_pardist_res = 'rough'
+        rechg_worker.checkpoint_interval = None
+        rechg_worker.nscheme = nscheme
+        rechg_worker.load_data(wxdset, wldset)
+        ts = perf_counter()
+        gluedf = rechg_worker.eval_recharge()
+        elapsed = perf_counter() - ts
+        if gluedf is None:
+            print('{:>16}{:>10.2f}{:>10}'.format(nscheme, elapsed, 0))
+            continue
+        best = np.argmin(gluedf['RMSE'])
+        print('{:>16}{:>10.2f}{:>10}{:>12.1f}{:>10.3f}'.format(
+            nscheme, elapsed, gluedf['count'], gluedf['RMSE'][best],
+            gluedf['params']['Sy'][best]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--mrc', nargs=2, type=float, default=None,
+                        metavar=('A', 'B'),
+                        help="The MRC coefficients to use instead of those "
+                             "estimated from the sample water levels.")
+    parser.add_argument('--nmodels', type=int, default=1000,
+                        help="The number of models in a batch.")
+    args = parser.parse_args(argv)
+
+    wxdset = WXDataFrame(WXFILENAME)
+    wldset = WLDataset(WLFILENAME)
+    A, B = estimate_mrc(wldset) if args.mrc is None else args.mrc
+    wldset = SampleWLDataset(WLFILENAME, A, B)
+    print('\nMRC: A = {:0.5f} 1/d, B = {:0.5f} m/d\n'.format(A, B))
+
+    rechg_worker = RechgEvalWorker()
+    rechg_worker.load_data(wxdset, wldset)
+    ts = np.where(rechg_worker.twlvl[0] == rechg_worker.tweatr)[0][0]
+    wlobs = rechg_worker.wlobs * 1000
+
+    rng = np.random.RandomState(0)
+    M = args.nmodels
+    CRU = rng.uniform(0.1, 0.3, M)
+    RASMAX = rng.uniform(5, 40, M)
+    SY = rng.uniform(0.05, 0.2, M)
+    buffers = tuple(np.empty((M, len(rechg_worker.ETP))) for i in range(5))
+    calcul_surf_water_budget_batch(
+        rechg_worker.ETP, rechg_worker.PTOT, rechg_worker.TAVG,
+        rechg_worker.TMELT, rechg_worker.CM, CRU, RASMAX, *buffers)
+    rechg = np.ascontiguousarray(buffers[0][:, ts:])
+
+    bench_stability(rechg[0], wlobs, SY[0], B / A if A > 0 else 0)
+    print()
+    bench_speed(rechg, wlobs, SY, A, B)
+    print()
+    bench_glue(wxdset, wldset)
+
+
+if __name__ == "__main__":
+    main()
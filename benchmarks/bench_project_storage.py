@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+"""
+Compare the size of the project files and the throughput at which the
+water level, weather and GLUE data are written to and read from them for
+the contiguous uncompressed layout and several chunked and compressed
+layouts.
+
+Usage:
+
+    python benchmarks/bench_project_storage.py [--years N] [--nglue N]
+
+The water level dataset is a synthetic high-frequency dataset with a
+reading every 15 minutes and a resolution of 1 mm, the weather dataset is
+read from the sample data and the GLUE results are evaluated with a rough
+grid on the sample water level and weather datasets.
+"""
+
+# ---- Standard imports
+import argparse
+import os
+import os.path as osp
+import tempfile
+from time import perf_counter
+
+# ---- Third party imports
+import numpy as np
+import pandas as pd
+
+# ---- Local imports
+from gwhat import __rootdir__
+from gwhat.config.main import CONF
+from gwhat.meteo.weather_reader import WXDataFrame
+from gwhat.projet.reader_projet import ProjetReader, load_dict_from_h5grp
+from gwhat.projet.reader_waterlvl import (
+    WLDataset, WLDatasetBase, WLDataFrame, HEADER, COLUMNS, INDEX)
+from gwhat.gwrecharge.gwrecharge_calc2 import RechgEvalWorker
+from bench_hydrograph_schemes import SampleWLDataset, estimate_mrc
+
+DATADIR = osp.join(__rootdir__, 'tests', 'data')
+WXFILENAME = osp.join(DATADIR, "MARIEVILLE (7024627)_2000-2015.out")
+WLFILENAME = osp.join(DATADIR, 'sample_water_level_datafile.csv')
+
+# The storage options of each layout, as saved in the 'project' section
+# of the configs.
+LAYOUTS = {
+    'contiguous': {'hdf5_compression': None},
+    'gzip 1': {'hdf5_compression': 'gzip', 'hdf5_shuffle': False},
+    'shuffle+gzip 1': {'hdf5_compression': 'gzip', 'hdf5_shuffle': True},
+    'lzf': {'hdf5_compression': 'lzf', 'hdf5_shuffle': False},
+    'shuffle+lzf': {'hdf5_compression': 'lzf', 'hdf5_shuffle': True},
+    }
+
+
+class SyntheticWLDataset(WLDatasetBase):
+    """
+    A synthetic water level dataset with a reading every 15 minutes, as
+    produced by a datalogger.
+    """
+
+    def __init__(self, nyears, seed=0):
+        super().__init__()
+        rng = np.random.RandomState(seed)
+        index = pd.date_range('2000-01-01', periods=nyears * 365 * 96,
+                              freq='15min')
+        t = np.arange(len(index)) / 96
+        wl = (3 + 0.8 * np.sin(2 * np.pi * t / 365) +
+              np.cumsum(rng.normal(0, 0.002, len(t))))
+        bp = 10.3 + 0.05 * np.sin(2 * np.pi * t / 3) + rng.normal(
+            0, 0.005, len(t))
+        et = 0.01 * np.sin(2 * np.pi * t * 1.93)
+        self._dataf = WLDataFrame(
+            {'Time': index, 'WL': np.round(wl, 3), 'BP': np.round(bp, 3),
+             'ET': np.round(et, 4)},
+            ('Time', 'WL', 'BP', 'ET'),
+            metadata={'Well': 'Synthetic', 'Well ID': '0000000'})
+        self._dataf.filename = ''
+
+    def __getitem__(self, key):
+        if key == INDEX:
+            return self.strftime
+        elif key in COLUMNS:
+            return self.data[key].values
+        elif key in HEADER.keys():
+            return self._dataf.attrs[key]
+        elif key == 'filename':
+            return self._dataf.filename
+
+
+def eval_sample_glue():
+    """Evaluate GLUE with a rough grid on the sample datasets."""
+    rechg_worker = RechgEvalWorker()
+    rechg_worker.Sy = (0.01, 0.5)
+    rechg_worker.Cro = (0.1, 0.3)
+    rechg_worker.RASmax = (5, 40)
+    rechg_worker.glue_pardist_res = 'rough'
+    rechg_worker.checkpoint_interval = None
+    A, B = estimate_mrc(WLDataset(WLFILENAME))
+    rechg_worker.load_data(
+        WXDataFrame(WXFILENAME), SampleWLDataset(WLFILENAME, A, B))
+    return rechg_worker.eval_recharge()
+
+
+def set_layout(name):
+    """Set the storage options of the projects to those of the layout."""
+    CONF.reset_to_defaults()
+    for option, value in LAYOUTS[name].items():
+        CONF.set('project', option, value)
+
+
+def bench_layout(dirname, name, wldset, wxdset, gluedf, nglue, repeat):
+    """
+    Return the size of the project file in MB and the best write and
+    read times in seconds of the datasets for the layout.
+    """
+    set_layout(name)
+    filename = osp.join(dirname, name.replace(' ', '_') + '.gwt')
+    write_times = []
+    read_times = []
+    for i in range(repeat):
+        if osp.exists(filename):
+            os.remove(filename)
+
+        ts = perf_counter()
+        project = ProjetReader(filename)
+        project.add_wldset('wldset', wldset)
+        project.add_wxdset('wxdset', wxdset)
+        hdf5wldset = project.get_wldset('wldset')
+        for j in range(nglue):
+            hdf5wldset.save_glue(gluedf)
+        project.close()
+        write_times.append(perf_counter() - ts)
+
+        ts = perf_counter()
+        project = ProjetReader(filename)
+        hdf5wldset = project.get_wldset('wldset')
+        hdf5wldset.xldates
+        project.get_wxdset('wxdset')
+        for idnum in hdf5wldset.glue_idnums():
+            load_dict_from_h5grp(hdf5wldset.dset['glue'][idnum])
+        project.close()
+        read_times.append(perf_counter() - ts)
+    return osp.getsize(filename) / 1024**2, min(write_times), min(read_times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--years', type=int, default=10,
+                        help="The number of years of the synthetic water "
+                             "level dataset.")
+    parser.add_argument('--nglue', type=int, default=5,
+                        help="The number of GLUE results saved in the "
+                             "project.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="The number of times each layout is timed.")
+    args = parser.parse_args(argv)
+
+    wldset = SyntheticWLDataset(args.years)
+    wxdset = WXDataFrame(WXFILENAME)
+    gluedf = eval_sample_glue()
+    nbytes = (wldset.data[['WL', 'BP', 'ET']].values.nbytes +
+              len(wldset) * 8 + wxdset.data.values.nbytes)
+
+    print('\n{} water levels, {} weather days, {} GLUE results'.format(
+        len(wldset), len(wxdset.data), args.nglue))
+    print('{:>16}{:>12}{:>14}{:>14}{:>14}{:>14}'.format(
+        'layout', 'size (MB)', 'write (s)', 'read (s)',
+        'write (MB/s)', 'read (MB/s)'))
+    with tempfile.TemporaryDirectory() as dirname:
+        try:
+            for name in LAYOUTS:
+                size, t_write, t_read = bench_layout(
+                    dirname, name, wldset, wxdset, gluedf,
+                    args.nglue, args.repeat)
+                print('{:>16}{:>12.2f}{:>14.3f}{:>14.3f}{:>14.1f}{:>14.1f}'
+                      .format(name, size, t_write, t_read,
+                              nbytes / 1024**2 / t_write,
+                              nbytes / 1024**2 / t_read))
+        finally:
+            CONF.reset_to_defaults()
+    print('\nThe throughputs are computed from the size of the uncompressed '
+          'water level and weather data only.')
+
+
+if __name__ == "__main__":
+    main()
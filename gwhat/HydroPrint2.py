@@ -850,7 +850,8 @@ class HydroprintGUI(QWidget):
 
         # Save the layout :
 
-        self.wldset.save_layout(layout)
+        with self.dmngr.transaction():
+            self.wldset.save_layout(layout)
         msg = 'Layout saved successfully for well %s.' % self.wldset['Well']
         self.ConsoleSignal.emit('<font color=black>%s</font>' % msg)
         print("done")
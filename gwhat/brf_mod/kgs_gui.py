@@ -807,8 +807,9 @@ class BRFViewer(QDialog):
         reply = QMessageBox.question(self, 'Delete all BRF results', msg, btn)
 
         if reply == QMessageBox.Yes:
-            for name in self.wldset.saved_brf():
-                self.wldset.del_brf(name)
+            with self.wldset.transaction():
+                for name in self.wldset.saved_brf():
+                    self.wldset.del_brf(name)
             self.update_brfnavigate_state()
 
     def new_brf_added(self):
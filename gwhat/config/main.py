@@ -46,6 +46,21 @@ DEFAULTS = [
     ('weather_normals_viewer',
         {'graphs_labels_language': 'english'}
      ),
+    ('project',
+        {'hdf5_compression': 'gzip',
+         'hdf5_compression_level': 1,
+         'hdf5_shuffle': False,
+         'hdf5_chunk_size': 64}
+     ),
+    ('recharge',
+        {'glue_nworkers': 1,
+         'glue_streaming': False,
+         'glue_sampling': 'grid',
+         'glue_model_budget': 1000,
+         'glue_traversal': 'rowmajor',
+         'glue_retain_models': True,
+         'glue_cache_size': 5}
+     ),
 ]
 
 
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+"""
+Command line interface to evaluate groundwater recharge with GLUE, or the
+sensitivity of the recharge model to its parameters, for the water level
+datasets of a project without the graphical interface.
+
+Usage examples:
+
+    python -m gwhat.gwrecharge run project.gwt --processes 4
+    python -m gwhat.gwrecharge sensitivity project.gwt --method morris
+"""
+
+# ---- Standard imports
+import argparse
+import os
+import os.path as osp
+import sys
+
+
+def get_parser():
+    """Return the parser for the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='python -m gwhat.gwrecharge',
+        description="Evaluate groundwater recharge with GLUE, or the "
+                    "sensitivity of the recharge model to its parameters, "
+                    "for the water level datasets of a GWHAT project.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser(
+        'run',
+        help="Evaluate GLUE for the water level datasets of a project and "
+             "save the results in the project.")
+    run_parser.add_argument(
+        'filename', help="The path of the project file (*.gwt).")
+    run_parser.add_argument(
+        '--wells', nargs='+', default=None, metavar='NAME',
+        help="The names of the water level datasets to evaluate. All the "
+             "water level datasets of the project are evaluated if omitted.")
+    run_parser.add_argument(
+        '--processes', type=int, default=os.cpu_count() or 1,
+        help="The number of processes across which the water level "
+             "datasets are evaluated.")
+    run_parser.add_argument(
+        '--sampling', choices=['grid', 'lhs', 'adaptive'], default=None,
+        help="The strategy used to sample the parameter space.")
+    run_parser.add_argument(
+        '--budget', type=int, default=None,
+        help="The number of models to evaluate with the lhs and adaptive "
+             "sampling strategies.")
+    run_parser.add_argument(
+        '--traversal', choices=['rowmajor', 'serpentine', 'hilbert'],
+        default=None,
+        help="The order in which the models are evaluated. The 'serpentine' "
+             "and 'hilbert' orders require less iterations to optimize Sy, "
+             "but give slightly different results than the default "
+             "'rowmajor' order.")
+    for name, dest in [('--sy', 'Sy'), ('--cro', 'Cro'),
+                       ('--rasmax', 'RASmax')]:
+        run_parser.add_argument(
+            name, dest=dest, nargs=2, type=float, default=None,
+            metavar=('MIN', 'MAX'),
+            help="The range of values of {}.".format(dest))
+    run_parser.add_argument(
+        '--tmelt', dest='TMELT', type=float, default=None,
+        help="The air temperature threshold for snowmelt in °C.")
+    run_parser.add_argument(
+        '--cm', dest='CM', type=float, default=None,
+        help="The daily snowmelt coefficient in mm/°C.")
+    run_parser.add_argument(
+        '--deltat', type=int, default=None,
+        help="The delay in days between the recharge and the water level "
+             "response.")
+    run_parser.add_argument(
+        '--deltat-sweep', dest='deltat_sweep', nargs='+', type=int,
+        default=None, metavar='DELTAT',
+        help="Evaluate several delays in days in a single sweep and keep "
+             "the one that fits the observed water levels best, instead "
+             "of --deltat.")
+    run_parser.add_argument(
+        '--rmse-cutoff', dest='rmse_cutoff', type=float, default=None,
+        help="Only keep the models with a RMSE below this value (in mm).")
+    run_parser.add_argument(
+        '--append', action='store_true',
+        help="Continue the last GLUE results of each water level dataset "
+             "over the data that were appended since they were produced, "
+             "when possible, instead of evaluating GLUE from the start.")
+    run_parser.add_argument(
+        '--summary', default=None, metavar='FILENAME',
+        help="Save the summary of the evaluation to a csv, tsv, xls or xlsx "
+             "file.")
+
+    sensitivity_parser = subparsers.add_parser(
+        'sensitivity',
+        help="Run a sensitivity analysis of the recharge model for the "
+             "water level datasets of a project and save the results in "
+             "the project.")
+    sensitivity_parser.add_argument(
+        'filename', help="The path of the project file (*.gwt).")
+    sensitivity_parser.add_argument(
+        '--wells', nargs='+', default=None, metavar='NAME',
+        help="The names of the water level datasets to analyse. All the "
+             "water level datasets of the project are analysed if omitted.")
+    sensitivity_parser.add_argument(
+        '--processes', type=int, default=os.cpu_count() or 1,
+        help="The number of processes across which the models are "
+             "evaluated.")
+    sensitivity_parser.add_argument(
+        '--method', choices=['sobol', 'morris'], default='sobol',
+        help="The sensitivity analysis method.")
+    sensitivity_parser.add_argument(
+        '--samples', type=int, default=None,
+        help="The number of base samples (sobol) or trajectories (morris). "
+             "The number of base samples is rounded up to the next power "
+             "of two.")
+    sensitivity_parser.add_argument(
+        '--seed', type=int, default=None,
+        help="The seed used to sample the parameters.")
+    sensitivity_parser.add_argument(
+        '--summary', default=None, metavar='FILENAME',
+        help="Save the summary of the analysis to a csv, tsv, xls or xlsx "
+             "file.")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if not osp.exists(args.filename):
+        print("Project file '{}' does not exist.".format(args.filename))
+        return 1
+
+    from gwhat.gwrecharge.gwrecharge_batch import (
+        run_project_recharge, run_project_sensitivity, print_summary,
+        save_summary_to_file)
+    if args.command == 'sensitivity':
+        summary = run_project_sensitivity(
+            osp.abspath(args.filename), wldset_names=args.wells,
+            nprocesses=args.processes, method=args.method,
+            nsamples=args.samples, seed=args.seed)
+        print()
+        print_summary(summary, count_label='Models')
+        if args.summary is not None:
+            save_summary_to_file(summary, args.summary, count_label='Models')
+        return 0
+
+    kwargs = {key: getattr(args, key) for key in
+              ['Sy', 'Cro', 'RASmax', 'TMELT', 'CM', 'deltat',
+               'deltat_sweep', 'rmse_cutoff']}
+    if args.rmse_cutoff is not None:
+        kwargs['rmse_cutoff_enabled'] = 1
+    if args.sampling is not None:
+        kwargs['glue_sampling'] = args.sampling
+    if args.budget is not None:
+        kwargs['glue_model_budget'] = args.budget
+    if args.traversal is not None:
+        kwargs['glue_traversal'] = args.traversal
+
+    summary = run_project_recharge(
+        osp.abspath(args.filename), wldset_names=args.wells,
+        nprocesses=args.processes, append=args.append, **kwargs)
+    print()
+    print_summary(summary)
+    if args.summary is not None:
+        save_summary_to_file(summary, args.summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,7 +8,6 @@
 
 
 # ---- Stantard imports
-from calendar import monthrange
 from collections.abc import Mapping
 from abc import abstractmethod
 from time import strftime
@@ -16,11 +15,10 @@ from time import strftime
 
 # ---- Third party imports
 import numpy as np
-from xlrd import xldate_as_tuple
 
 # ---- Local imports
 from gwhat.common.utils import save_content_to_file
-from gwhat.utils.math import nan_as_text_tolist
+from gwhat.utils.math import nan_as_text_tolist, weighted_quantiles_blocked
 from gwhat import __namever__
 
 
@@ -247,6 +245,23 @@ class GLUEDataFrame(GLUEDataFrameBase):
         self.store['params'] = data['params']
         self.store['ranges'] = data['ranges']
         self.store['cutoff'] = data['cutoff']
+        if 'inputs key' in data:
+            # The key of the inputs used to produce these results
+            # (see RechgEvalWorker.get_inputs_key).
+            self.store['inputs key'] = data['inputs key']
+        if 'models table' in data:
+            # The parameters, optimal Sy and RMSE of all the models that
+            # were evaluated (see RechgEvalWorker.retain_models_table).
+            self.store['models table'] = data['models table']
+        if 'lags' in data:
+            # The number of behavioural models and the lowest RMSE obtained
+            # for each time lag that was evaluated in a single sweep
+            # (see RechgEvalWorker.deltat_sweep).
+            self.store['lags'] = data['lags']
+        if 'end state' in data:
+            # The state of the behavioural models on the day of the last
+            # observed water level (see RechgEvalWorker.append_recharge).
+            self.store['end state'] = data['end state']
 
         # Store the piezometric and weather stations info.
         self.store['wlinfo'] = data['wlinfo']
@@ -284,23 +299,31 @@ def calcul_glue(data, glue_limits, varname='recharge'):
     if varname not in ['recharge', 'etr', 'ru', 'hydrograph']:
         raise ValueError("varname value must be",
                          ['recharge', 'etr', 'ru', 'hydrograph'])
-    x = np.array(data[varname])
-    _, ntime = np.shape(x)
-
-    rmse = 1/np.array(data['RMSE'])
+    if varname in data.get('glue', {}):
+        # The GLUE values were already computed for this variable while
+        # streaming the behavioural models (see RechgEvalWorker), so we
+        # only need to select the requested uncertainty limits.
+        indexes = [list(data['glue']['GLUE limits']).index(limit) for
+                   limit in glue_limits]
+        return np.asarray(data['glue'][varname])[:, indexes]
+    return calcul_glue_quantiles(
+        np.array(data[varname]), data['RMSE'], glue_limits)
+
+
+def calcul_glue_quantiles(x, rmse, glue_limits):
+    """
+    Calcul the values of x for the provided GLUE uncertainty limits, where
+    x is a 2D array of shape (nmodels, ntime) containing the predicted
+    values of a set of behavioural models and rmse is the RMSE of
+    these models.
+    """
+    rmse = 1/np.array(rmse)
     # Rescale the RMSE so the sum of all values equal 1.
     rmse = rmse/np.sum(rmse)
 
-    glue = np.zeros((ntime, len(glue_limits)))
-    for i in range(ntime):
-        # Sort predicted values.
-        isort = np.argsort(x[:, i])
-        # Compute the Cumulative Density Function.
-        cdf = np.cumsum(rmse[isort])
-        # Get GLUE values for the p confidence intervals.
-        glue[i, :] = np.interp(glue_limits, cdf, x[isort, i])
-
-    return glue
+    # Get GLUE values for the p confidence intervals from the Cumulative
+    # Density Function of the predicted values of each day.
+    return weighted_quantiles_blocked(x, rmse, glue_limits)
 
 
 def calcul_dly_budget(data, glue_limits):
@@ -331,14 +354,10 @@ def calcul_dly_budget(data, glue_limits):
 
         # We extend the time and date arrays.
         times2add = np.arange(deltat) + times[-1] + 1
-        years2add = []
-        months2add = []
-        days2add = []
-        for time_ in times2add:
-            date = xldate_as_tuple(time_, 0)
-            years2add.append(date[0])
-            months2add.append(date[1])
-            days2add.append(date[2])
+        dates2add = (np.datetime64('1899-12-30') +
+                     np.floor(times2add).astype('timedelta64[D]'))
+        years2add = dates2add.astype('datetime64[Y]').astype(int) + 1970
+        months2add = dates2add.astype('datetime64[M]').astype(int) % 12 + 1
         times = np.hstack([times, times2add])
         years = np.hstack([years, years2add])
         months = np.hstack([months, months2add])
@@ -360,31 +379,47 @@ def calcul_mly_budget(glue_dly):
     calculated with the GLUE method from a set of behavioural models for a
     given set of p confidence intervals.
     """
-    years = glue_dly['years']
-    months = glue_dly['months']
-
-    year_range = np.unique(years)
-    month_range = range(1, 13)
+    years = np.asarray(glue_dly['years']).astype(int)
+    months = np.asarray(glue_dly['months']).astype(int)
+
+    year_range, year_indexes = np.unique(years, return_inverse=True)
+    nyear = len(year_range)
+    nlim = len(glue_dly['GLUE limits'])
+
+    # Compute the index of the month of each day in the (year, month)
+    # arrays of the results, so that the monthly values can be computed
+    # from the daily values in a single pass.
+    month_indexes = year_indexes * 12 + months - 1
+    nmonths = nyear * 12
+
+    # Determine which months are complete from the number of days in
+    # each month.
+    first_days = (np.repeat(year_range - 1970, 12) * 12 +
+                  np.tile(np.arange(12), nyear)).astype('datetime64[M]')
+    days_in_month = (
+        (first_days + 1).astype('datetime64[D]') -
+        first_days.astype('datetime64[D]')).astype(int)
+    ndays = np.bincount(month_indexes, minlength=nmonths)
+    incomplete = ndays < days_in_month
 
     # Initialize a dict where the results will be saved.
     glue_mly = {'years': year_range,
                 'GLUE limits': glue_dly['GLUE limits']}
+
+    # Compute monthly values from daily time series. Incomplete months
+    # are set to nan.
     for var in ['recharge', 'evapo', 'runoff']:
-        glue_mly[var] = np.zeros(
-            (len(year_range), 12, len(glue_dly['GLUE limits']))) * np.nan
-    glue_mly['precip'] = np.zeros((len(year_range), 12)) * np.nan
-
-    # Compute monthly values from daily time series.
-    for i, year in enumerate(year_range):
-        for j, month in enumerate(month_range):
-            indexes = np.where((years == year) & (months == month))[0]
-            if len(indexes) < monthrange(year, month)[1]:
-                # This month is not complete, so we keep its value a nan.
-                continue
-            for var in ['recharge', 'evapo', 'runoff']:
-                glue_mly[var][i, j, :] = np.sum(
-                    glue_dly[var][indexes, :], axis=0)
-            glue_mly['precip'][i, j] = np.sum(glue_dly['precip'][indexes])
+        values = np.asarray(glue_dly[var])
+        mly_values = np.empty((nmonths, nlim))
+        for k in range(nlim):
+            mly_values[:, k] = np.bincount(
+                month_indexes, weights=values[:, k], minlength=nmonths)
+        mly_values[incomplete] = np.nan
+        glue_mly[var] = mly_values.reshape(nyear, 12, nlim)
+    mly_precip = np.bincount(
+        month_indexes, weights=glue_dly['precip'], minlength=nmonths)
+    mly_precip[incomplete] = np.nan
+    glue_mly['precip'] = mly_precip.reshape(nyear, 12)
 
     return glue_mly
 
@@ -425,27 +460,52 @@ def calcul_hydro_yrly_budget(glue_dly):
     year_range = np.arange(np.min(years), np.max(years)).astype('int')
 
     # Convert daily to hydrological year. An hydrological year is defined from
-    # October 1 to September 30 of the next year.
-
-    nyear, nlim = len(year_range), len(glue_dly['GLUE limits'])
-    glue_rechg_yly = np.zeros((nyear, nlim))
-    glue_evapo_yly = np.zeros((nyear, nlim))
-    glue_runof_yly = np.zeros((nyear, nlim))
-    precip_yly = np.zeros(nyear)
-    for i in range(nyear):
-        yr0 = year_range[i]
-        yr1 = yr0 + 1
-
-        indexes = np.where((years == yr0) & (months == 10))[0]
-        indx0 = 0 if len(indexes) == 0 else indexes[0]
-
-        indexes = np.where((years == yr1) & (months == 9))[0]
-        indx1 = len(years-1) if len(indexes) == 0 else indexes[-1]
-
-        glue_rechg_yly[i, :] = np.sum(glue_rechg_dly[indx0:indx1+1, :], axis=0)
-        glue_evapo_yly[i, :] = np.sum(glue_evapo_dly[indx0:indx1+1, :], axis=0)
-        glue_runof_yly[i, :] = np.sum(glue_runof_dly[indx0:indx1+1, :], axis=0)
-        precip_yly[i] = np.sum(precip_dly[indx0:indx1+1])
+    # October 1 to September 30 of the next year. If October of the first
+    # year is missing, the hydrological year starts at the beginning of
+    # the data. If September of the next year is missing, it ends at the
+    # end of the data.
+    ndays = len(years)
+    keys = np.asarray(years).astype(int) * 12 + np.asarray(months) - 1
+
+    # Find the index of the first day of October of each year and of the
+    # last day of September of the next year from the boundaries of the
+    # months in the daily time series, which is sorted in time.
+    first_indexes = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1))
+    last_indexes = np.append(first_indexes[1:], ndays) - 1
+    unique_keys = keys[first_indexes]
+
+    pos = np.searchsorted(unique_keys, year_range * 12 + 9)
+    pos = np.minimum(pos, len(unique_keys) - 1)
+    indx0 = np.where(unique_keys[pos] == year_range * 12 + 9,
+                     first_indexes[pos], 0)
+
+    pos = np.searchsorted(unique_keys, (year_range + 1) * 12 + 8)
+    pos = np.minimum(pos, len(unique_keys) - 1)
+    indx1 = np.where(unique_keys[pos] == (year_range + 1) * 12 + 8,
+                     last_indexes[pos] + 1, ndays)
+    indx1 = np.maximum(indx1, indx0)
+
+    # Sum the daily values of each hydrological year with a single call
+    # to np.add.reduceat over the interleaved first and last indexes of the
+    # years, so that a missing daily value only affects the sum of its own
+    # year. The values are padded with a row of zeros, so that the indexes
+    # that are at the end of the data are valid, and the sums of the years
+    # without any day are set to 0 afterwards.
+    indexes = np.column_stack((indx0, indx1)).ravel()
+    empty = indx1 == indx0
+
+    def sum_hydro_years(values):
+        values = np.asarray(values, dtype=float)
+        values = np.concatenate(
+            (values, np.zeros((1,) + values.shape[1:])), axis=0)
+        sums = np.add.reduceat(values, indexes, axis=0)[::2]
+        sums[empty] = 0
+        return sums
+
+    glue_rechg_yly = sum_hydro_years(glue_rechg_dly)
+    glue_evapo_yly = sum_hydro_years(glue_evapo_dly)
+    glue_runof_yly = sum_hydro_years(glue_runof_dly)
+    precip_yly = sum_hydro_years(precip_dly)
 
     return {'years': year_range,
             'recharge': glue_rechg_yly,
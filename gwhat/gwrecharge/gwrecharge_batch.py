@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+"""
+Headless evaluation of groundwater recharge with GLUE for all the water
+level datasets of a project, without the graphical interface.
+"""
+
+# ---- Standard imports
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os.path as osp
+from time import perf_counter
+
+# ---- Third party imports
+import numpy as np
+
+# ---- Local imports
+from gwhat.config.main import CONF
+from gwhat.common.utils import calc_dist_from_coord, save_content_to_file
+from gwhat.gwrecharge.gwrecharge_calc2 import RechgEvalWorker
+from gwhat.gwrecharge.sensitivity import RechgSensitivityAnalysis
+from gwhat.meteo.weather_reader import WXDataFrameBase
+
+# The values of the GLUE settings that are used when no value was used
+# previously for a water level dataset. These are the same as the default
+# values in the recharge widget.
+DEFAULT_SETTINGS = {
+    'Sy': (0.05, 0.2),
+    'Cro': (0.1, 0.3),
+    'RASmax': (5, 40),
+    'TMELT': 0,
+    'CM': 4,
+    'deltat': 0,
+    'rmse_cutoff': 0,
+    'rmse_cutoff_enabled': 0}
+
+# The keys of the metadata of the water level datasets that are saved
+# with the GLUE results.
+WLINFO_KEYS = ['Well', 'Well ID', 'Province', 'Latitude', 'Longitude',
+               'Elevation', 'Municipality']
+
+
+class WXDatasetSnapshot(WXDataFrameBase):
+    """
+    An in-memory copy of a weather dataset that can be sent to another
+    process.
+    """
+
+    def __init__(self, wxdset, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__load_dataset__(wxdset)
+
+    def __getitem__(self, key):
+        raise NotImplementedError
+
+    def __setitem__(self, key, value):
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.data)
+
+    def __load_dataset__(self, wxdset):
+        self.data = wxdset.data.copy()
+        self.metadata = dict(wxdset.metadata)
+
+
+class WLDatasetSnapshot(dict):
+    """
+    An in-memory copy of the water level data, metadata and MRC of a water
+    level dataset that can be sent to another process.
+    """
+
+    def __init__(self, wldset):
+        super().__init__()
+        self.update({key: wldset[key] for key in WLINFO_KEYS})
+        self['WL'] = np.array(wldset['WL'])
+        self.xldates = np.array(wldset.xldates)
+
+        # We store the MRC coefficients in a tuple because the named tuple
+        # returned by the water level dataset cannot be pickled.
+        self._mrc = dict(wldset.get_mrc())
+        self._mrc['params'] = tuple(self._mrc['params'])
+
+    def get_mrc(self):
+        return dict(self._mrc)
+
+
+def get_closest_wxdset_name(project, wldset):
+    """
+    Return the name of the weather dataset of the project whose station is
+    the closest to the observation well of the water level dataset, or None
+    if there is no weather dataset in the project.
+    """
+    if len(project.wxdsets) == 0:
+        return None
+    dist = calc_dist_from_coord(wldset['Latitude'],
+                                wldset['Longitude'],
+                                project.get_wxdsets_lat(),
+                                project.get_wxdsets_lon())
+    return project.wxdsets[np.argmin(dist)]
+
+
+def get_glue_settings(wldset, **kwargs):
+    """
+    Return the GLUE settings to use for the water level dataset.
+
+    The settings are those that were used to produce the last GLUE results
+    saved for the water level dataset, if any, or DEFAULT_SETTINGS
+    otherwise. They are overridden by the settings passed in kwargs that
+    are not None.
+    """
+    settings = DEFAULT_SETTINGS.copy()
+    gluedf = wldset.get_glue_at(-1)
+    if gluedf is not None:
+        for key, (grpname, name) in {
+                'Sy': ('ranges', 'Sy'),
+                'Cro': ('ranges', 'Cro'),
+                'RASmax': ('ranges', 'RASmax'),
+                'TMELT': ('params', 'tmelt'),
+                'CM': ('params', 'CM'),
+                'deltat': ('params', 'deltat'),
+                'rmse_cutoff': ('cutoff', 'rmse_cutoff'),
+                'rmse_cutoff_enabled': ('cutoff', 'rmse_cutoff_enabled')
+                }.items():
+            try:
+                value = gluedf[grpname][name]
+            except KeyError:
+                continue
+            if grpname == 'ranges':
+                value = (float(min(value)), float(max(value)))
+            settings[key] = value
+    settings['deltat'] = int(settings['deltat'])
+    settings.update({key: value for key, value in kwargs.items() if
+                     value is not None})
+    return settings
+
+
+def setup_rechg_worker(wxdset, wldset, settings):
+    """
+    Return a recharge evaluation worker that is set up to evaluate GLUE
+    for the weather and water level datasets with the provided settings,
+    along with the error message returned when loading the data, if any.
+    """
+    rechg_worker = RechgEvalWorker()
+    for key, value in settings.items():
+        setattr(rechg_worker, key, value)
+    error = rechg_worker.load_data(wxdset, wldset)
+    return rechg_worker, error
+
+
+def eval_wldset_recharge(wxdset, wldset, settings, gluedf=None):
+    """
+    Evaluate groundwater recharge with GLUE for the weather and water level
+    datasets with the provided settings.
+
+    If gluedf is not None, the GLUE results in gluedf are continued over
+    the data that were appended to the datasets since they were produced
+    instead (see RechgEvalWorker.append_recharge).
+
+    Return the GLUE results, or None if no behavioural model was found,
+    and the time that was required to compute them. This is meant to be
+    run in a separate process.
+    """
+    time_start = perf_counter()
+    rechg_worker, error = setup_rechg_worker(wxdset, wldset, settings)
+    if error is not None:
+        raise ValueError(error)
+    if gluedf is not None:
+        gluedf = rechg_worker.append_recharge(gluedf)
+    else:
+        gluedf = rechg_worker.eval_recharge()
+    return gluedf, perf_counter() - time_start
+
+
+def run_project_recharge(filename, wldset_names=None, nprocesses=1,
+                         append=False, **kwargs):
+    """
+    Evaluate groundwater recharge with GLUE for the water level datasets
+    of the project saved in filename and save the results in the project.
+
+    Each water level dataset is paired with the weather dataset of the
+    closest station and the datasets are evaluated across a pool of
+    nprocesses processes. All the water level datasets of the project are
+    evaluated if wldset_names is None. The GLUE settings used for each
+    water level dataset are those returned by get_glue_settings, where
+    the settings passed in kwargs override those saved in the project.
+
+    The GLUE results that are already saved in the project for the same
+    inputs are reused instead of being computed again. If append is True,
+    the last GLUE results of each water level dataset are continued over
+    the data that were appended to the datasets since they were produced,
+    when possible, instead of being computed again from the start. Return
+    a list with a summary of the evaluation of each water level dataset.
+    """
+    from gwhat.projet.reader_projet import ProjetReader
+    project = ProjetReader(filename)
+
+    # Set the options that are set in the preferences of the recharge
+    # widget, as it is done in the graphical interface.
+    kwargs.setdefault('glue_sampling', CONF.get('recharge', 'glue_sampling'))
+    kwargs.setdefault(
+        'glue_model_budget', CONF.get('recharge', 'glue_model_budget'))
+    kwargs.setdefault(
+        'glue_traversal', CONF.get('recharge', 'glue_traversal'))
+    kwargs.setdefault('glue_accumulator', (
+        'streaming' if CONF.get('recharge', 'glue_streaming') else 'memory'))
+    kwargs.setdefault('retain_models_table', CONF.get(
+        'recharge', 'glue_retain_models'))
+    cache_size = CONF.get('recharge', 'glue_cache_size', 5)
+
+    summary = []
+    jobs = {}
+    try:
+        for name in (project.wldsets if wldset_names is None else
+                     wldset_names):
+            item = {'wldset': name, 'wxdset': None, 'status': '',
+                    'count': None, 'time': 0}
+            summary.append(item)
+            wldset = project.get_wldset(name)
+            if wldset is None:
+                item['status'] = 'water level dataset not found'
+                continue
+            item['wxdset'] = get_closest_wxdset_name(project, wldset)
+            if item['wxdset'] is None:
+                item['status'] = 'no weather dataset'
+                continue
+            wxdset = project.get_wxdset(item['wxdset'])
+
+            settings = get_glue_settings(wldset, **kwargs)
+            rechg_worker, error = setup_rechg_worker(
+                wxdset, wldset, settings)
+            if error is not None:
+                item['status'] = error
+                continue
+            idnum = wldset.find_glue(rechg_worker.get_inputs_key())
+            if idnum is not None:
+                wldset.set_glue_as_latest(idnum)
+                item['status'] = 'loaded from project'
+                item['count'] = wldset.get_glue_at(-1)['count']
+                continue
+            gluedf = wldset.get_glue_at(-1)
+            if not append or gluedf is None or 'end state' not in gluedf:
+                gluedf = None
+            jobs[name] = (WXDatasetSnapshot(wxdset),
+                          WLDatasetSnapshot(wldset),
+                          settings, gluedf)
+
+        # Evaluate the water level datasets across a pool of processes and
+        # save the results in the project as soon as they are available.
+        with ProcessPoolExecutor(
+                max_workers=max(1, min(nprocesses, len(jobs))),
+                mp_context=multiprocessing.get_context('spawn')
+                ) as executor:
+            futures = {executor.submit(eval_wldset_recharge, *job): name for
+                       name, job in jobs.items()}
+            for future in as_completed(futures):
+                item = next(item for item in summary if
+                            item['wldset'] == futures[future])
+                try:
+                    gluedf, item['time'] = future.result()
+                    appended = jobs[item['wldset']][-1] is not None
+                except Exception as error:
+                    item['status'] = 'failed: {}'.format(error)
+                    continue
+                if gluedf is None:
+                    item['status'] = 'no behavioural model'
+                    item['count'] = 0
+                    continue
+                wldset = project.get_wldset(item['wldset'])
+                with wldset.transaction():
+                    wldset.save_glue(gluedf)
+                    wldset.clear_glue(keep=cache_size)
+                item['status'] = 'appended' if appended else 'computed'
+                item['count'] = gluedf['count']
+    finally:
+        project.close()
+    return summary
+
+
+def run_project_sensitivity(filename, wldset_names=None, nprocesses=1,
+                            **kwargs):
+    """
+    Run a sensitivity analysis of the recharge model for the water level
+    datasets of the project saved in filename and save the results in the
+    project.
+
+    Each water level dataset is paired with the weather dataset of the
+    closest station and the models are evaluated across a pool of
+    nprocesses processes. The attributes of the RechgSensitivityAnalysis
+    are set from kwargs. Return a list with a summary of the analysis of
+    each water level dataset.
+    """
+    from gwhat.projet.reader_projet import ProjetReader
+    project = ProjetReader(filename)
+
+    summary = []
+    try:
+        for name in (project.wldsets if wldset_names is None else
+                     wldset_names):
+            item = {'wldset': name, 'wxdset': None, 'status': '',
+                    'count': None, 'time': 0}
+            summary.append(item)
+            wldset = project.get_wldset(name)
+            if wldset is None:
+                item['status'] = 'water level dataset not found'
+                continue
+            item['wxdset'] = get_closest_wxdset_name(project, wldset)
+            if item['wxdset'] is None:
+                item['status'] = 'no weather dataset'
+                continue
+            wxdset = project.get_wxdset(item['wxdset'])
+
+            time_start = perf_counter()
+            analysis = RechgSensitivityAnalysis()
+            analysis.nworkers = nprocesses
+            for key, value in kwargs.items():
+                if value is not None:
+                    setattr(analysis, key, value)
+            error = analysis.load_data(wxdset, wldset)
+            if error is not None:
+                item['status'] = error
+                continue
+            try:
+                results = analysis.run()
+            except ValueError as error:
+                item['status'] = 'failed: {}'.format(error)
+                continue
+            wldset.save_sensitivity(results)
+            item['status'] = 'computed'
+            item['count'] = results['nmodels']
+            item['time'] = perf_counter() - time_start
+    finally:
+        project.close()
+    return summary
+
+
+def format_summary(summary, count_label='Behavioural models'):
+    """
+    Format the summary returned by run_project_recharge or
+    run_project_sensitivity in a table that can be printed or saved to
+    a file.
+    """
+    fcontent = [['Water level dataset', 'Weather dataset', 'Status',
+                 count_label, 'Time (sec)']]
+    for item in summary:
+        fcontent.append([
+            item['wldset'],
+            '' if item['wxdset'] is None else item['wxdset'],
+            item['status'],
+            '' if item['count'] is None else int(item['count']),
+            round(item['time'], 1)])
+    return fcontent
+
+
+def print_summary(summary, count_label='Behavioural models'):
+    """
+    Print the summary returned by run_project_recharge or
+    run_project_sensitivity.
+    """
+    fcontent = format_summary(summary, count_label)
+    widths = [max(len(str(row[i])) for row in fcontent) for
+              i in range(len(fcontent[0]))]
+    for row in fcontent:
+        print('  '.join(str(value).ljust(width) for
+                        value, width in zip(row, widths)))
+
+
+def save_summary_to_file(summary, filename,
+                         count_label='Behavioural models'):
+    """
+    Save the summary returned by run_project_recharge or
+    run_project_sensitivity to a file. The extension of the file determine
+    in which file type the summary will be saved (xls or xlsx for Excel,
+    csv for coma-separated values text file, or tsv for tab-separated
+    values text file).
+    """
+    save_content_to_file(
+        osp.abspath(filename), format_summary(summary, count_label))
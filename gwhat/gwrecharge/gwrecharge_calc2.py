@@ -10,26 +10,65 @@
 import os
 import os.path as osp
 import datetime
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from itertools import product
+import multiprocessing
 from time import perf_counter
+import warnings
 
 # ---- Third party imports
 import numpy as np
 import pandas as pd
+from scipy.stats import qmc
 from PyQt5.QtCore import QObject
 from PyQt5.QtCore import pyqtSignal as QSignal
 
 # ---- Local imports
-from gwhat.utils.math import clip_time_series, calcul_rmse
-from gwhat.gwrecharge.glue import GLUEDataFrame
-from gwhat.gwrecharge.gwrecharge_calculs import (calcul_surf_water_budget,
-                                                 calc_hydrograph_forward)
+from gwhat.utils.math import clip_time_series, calcul_rmse, resample_daily
+from gwhat.gwrecharge.glue import GLUEDataFrame, calcul_glue_quantiles
+from gwhat.gwrecharge.gwrecharge_calculs import (
+    calcul_surf_water_budget, calcul_surf_water_budget_batch,
+    calc_hydrograph_forward, calc_hydrograph_backward, calc_hydrograph_cn,
+    calc_hydrograph_batch, calc_hydrograph_tl, calc_hydrograph_sse_bound,
+    HYDROGRAPH_SCHEMES)
 
 
 class RechgEvalWorker(QObject):
 
     sig_glue_progress = QSignal(float)
     sig_glue_finished = QSignal(object)
+    sig_glue_cancelled = QSignal()
+
+    # The keys of the dict used to store the results of the
+    # behavioural models. Note that the keys in EVALUATED_KEYS hold values
+    # for every model that was evaluated, behavioural or not, in the order
+    # in which they were evaluated, while 'index' holds the position of
+    # each behavioural model in that order. 'niter' is the number of
+    # iterations that were required to optimize Sy. The optimal Sy and
+    # the RMSE of the models for which Sy was not optimized are nan.
+    MODELS_KEYS = ['RMSE', 'Sy', 'RASmax', 'Cru',
+                   'hydrograph', 'recharge', 'etr', 'ru', 'index',
+                   'niter', 'evaluated_Cru', 'evaluated_RASmax',
+                   'evaluated_Sy', 'evaluated_RMSE']
+    EVALUATED_KEYS = ['niter', 'evaluated_Cru', 'evaluated_RASmax',
+                      'evaluated_Sy', 'evaluated_RMSE']
+
+    # The orders in which the parameter combinations can be evaluated.
+    TRAVERSAL_METHODS = ['rowmajor', 'serpentine', 'hilbert']
+
+    # The strategies that can be used to sample the (Cro, RASmax)
+    # parameter space.
+    SAMPLING_METHODS = ['grid', 'sobol', 'lhs', 'adaptive']
+
+    # The fraction of the model budget that is used to explore the whole
+    # parameter space in the first stage of the 'adaptive' sampling.
+    ADAPTIVE_EXPLORE_FRACTION = 0.5
+
+    # The number of intervals in which the range of behavioural Sy values
+    # is split to compute the lower bound of the sum of squared errors
+    # of the models when the RMSE cutoff is enabled.
+    PRESCREEN_NINTERVALS = 8
 
     def __init__(self):
         super(RechgEvalWorker, self).__init__()
@@ -45,15 +84,119 @@ class RechgEvalWorker(QObject):
         self.CM = 4
         self.deltat = 0
 
+        # The numerical scheme used to compute the synthetic hydrographs.
+        # With 'forward', the hydrographs are computed forward in time from
+        # the first observed water level with an explicit scheme. With
+        # 'crank-nicolson', the recession is averaged between the start and
+        # the end of each day. With 'backward', the hydrographs are computed
+        # backward in time from the last observed water level, which is not
+        # supported in the 'streaming' accumulation mode.
+        self.nscheme = 'forward'
+
+        # A list of time lags, in days, that are evaluated in a single sweep
+        # instead of deltat. When set, the surface water budget of each
+        # model is computed only once and Sy is optimized for every lag.
+        # The GLUE results are then produced with the behavioural models of
+        # the lag whose best model has the lowest RMSE. The water levels are
+        # clipped to the period for which every lag can be applied.
+        self.deltat_sweep = None
+
         # Models parameters space.
         self.Sy = (0, 1)
         self.Cro = (0, 1)
         self.RASmax = (0, 150)
         self.glue_pardist_res = 'fine'
 
+        # How the (Cro, RASmax) parameter space is sampled. With 'grid', all
+        # the combinations of a regular grid whose resolution is set with
+        # glue_pardist_res are evaluated. With 'sobol', 'lhs' and 'adaptive',
+        # glue_model_budget models are sampled with a scrambled Sobol
+        # sequence, a Latin hypercube or an adaptive Sobol scheme that
+        # refines the sampling where behavioural models were found.
+        self.glue_sampling = 'grid'
+        self.glue_model_budget = 1000
+        self.sampling_seed = None
+
+        # The order in which the parameter combinations are evaluated. Since
+        # the optimal Sy of the previous model is used as the initial guess
+        # for the next one, an order that keeps neighbouring parameter
+        # combinations adjacent reduces the number of iterations required
+        # to optimize Sy. With 'serpentine', the combinations are evaluated
+        # row by row along Cro, reversing the direction along RASmax from
+        # one row to the next. With 'hilbert', they are evaluated along a
+        # Hilbert curve. With 'rowmajor', they are evaluated in the order
+        # in which they were produced. Since the order affects the optimal
+        # Sy and RMSE of the models, 'rowmajor' is used by default so that
+        # the results are the same as those of previous versions.
+        self.glue_traversal = 'rowmajor'
+
+        # The number of iterations that were required to optimize Sy for
+        # each model evaluated in the last call to eval_recharge.
+        self.niter = np.array([], dtype=int)
+
+        # The minimum time, in seconds, between two checkpoints of the
+        # progress of eval_recharge that are saved in the water level
+        # dataset, so that an interrupted run can be resumed later with
+        # the same inputs. Checkpoints are disabled when this is None or
+        # when the water level dataset does not support them.
+        self.checkpoint_interval = 60
+        self._checkpoint_key = None
+        self._resume = None
+        self._sweep_offset = 0
+
+        # The minimum time, in seconds, between two emissions of
+        # sig_glue_progress, so that the UI is not flooded with signals.
+        self.progress_interval = 0.1
+        self._last_progress_time = None
+
+        # Whether the cancellation of the current call to eval_recharge was
+        # requested with cancel. This is checked between batches of models.
+        self._cancel_requested = False
+
         self.rmse_cutoff = 0
         self.rmse_cutoff_enabled = 0
 
+        # Whether a table of the parameters, optimal Sy and RMSE of every
+        # model that was evaluated is saved with the GLUE results. When
+        # models_table is set to such a table and it was produced with the
+        # same inputs, the behavioural models are selected again from the
+        # table with the current Sy range and RMSE cutoff in eval_recharge
+        # instead of evaluating all the models again.
+        self.retain_models_table = False
+        self.models_table = None
+        self._last_models = None
+
+        # The number of models for which the surface water budget is
+        # computed at once in eval_recharge.
+        self.batch_size = 256
+        self._swb_buffers = None
+
+        # The number of processes used to evaluate the models. Models are
+        # evaluated serially in the current process when this is 1.
+        self.nworkers = 1
+
+        # The number of consecutive models in the order of evaluation whose
+        # optimization of Sy is chained, each model starting from the
+        # optimal Sy of the previous one. The chain restarts from the middle
+        # of the range of Sy at every multiple of chunk_size, both when the
+        # models are evaluated serially and in parallel, where each chunk is
+        # evaluated by a single process, so that the results do not depend
+        # on the number of processes.
+        self.chunk_size = 128
+
+        # The number of OpenMP threads used by the compiled kernels to
+        # compute a batch of models. This is left to OpenMP when set to 0.
+        self.nthreads = 0
+
+        # How the results of the behavioural models are accumulated to
+        # compute GLUE. In the 'memory' mode, the time series of all the
+        # behavioural models are kept in memory. In the 'streaming' mode,
+        # only their parameters are kept during the sweep and the models are
+        # simulated again afterwards by blocks of time whose size is set so
+        # that their outputs fit in glue_stream_memory bytes.
+        self.glue_accumulator = 'memory'
+        self.glue_stream_memory = 64 * 1024**2
+
     @property
     def language(self):
         return self.__language
@@ -84,6 +227,19 @@ class RechgEvalWorker(QObject):
     def TMELT(self, x):
         self.__TMELT = x
 
+    def get_deltats(self):
+        """
+        Return the sorted list of the time lags, in days, that are
+        evaluated in eval_recharge.
+        """
+        if self.deltat_sweep is None:
+            return [int(self.deltat)]
+        deltats = sorted(set(int(deltat) for deltat in self.deltat_sweep))
+        if len(deltats) == 0 or deltats[0] < 0:
+            raise ValueError(
+                "deltat_sweep must contain time lags greater or equal to 0.")
+        return deltats
+
     def load_data(self, wxdset, wldset):
         # Setup weather data.
 
@@ -91,7 +247,8 @@ class RechgEvalWorker(QObject):
         self.ETP = self.wxdset.data['PET'].values
         self.PTOT = self.wxdset.data['Ptot'].values
         self.TAVG = self.wxdset.data['Tavg'].values
-        self.tweatr = self.wxdset.get_xldates() + self.deltat
+        deltats = self.get_deltats()
+        self.tweatr = self.wxdset.get_xldates() + min(deltats)
         # We introduce a time lag here to take into account the travel time
         # through the unsaturated zone.
 
@@ -99,8 +256,10 @@ class RechgEvalWorker(QObject):
 
         self.wldset = wldset
         self.A, self.B = wldset.get_mrc()['params']
-        self.twlvl, self.wlobs = self.make_data_daily(
-            wldset.xldates, wldset['WL'])
+        # Only the last water level measurement made on a given day is kept
+        # in the daily time series.
+        self.twlvl, self.wlobs = resample_daily(
+            wldset.xldates, wldset['WL'], policy='last')
 
         if pd.isnull(self.A) and pd.isnull(self.B):
             error = ("Groundwater recharge cannot be computed because a"
@@ -108,11 +267,15 @@ class RechgEvalWorker(QObject):
             return error
 
         # Clip the observed water level time series to the weather data.
+        # When several lags are evaluated, the water levels are clipped to
+        # the period for which the recharge can be shifted by every lag.
         self.twlvl, self.wlobs = clip_time_series(
-            self.tweatr, self.twlvl, self.wlobs)
+            self.tweatr[max(deltats) - min(deltats):],
+            self.twlvl, self.wlobs)
 
         # We need to remove nan values at the start and the end of the series
         # to avoid problems when computing synthetic hydrographs.
+        istart = iend = 0
         for istart in range(len(self.wlobs)):
             if not np.isnan(self.wlobs[istart]):
                 break
@@ -131,25 +294,6 @@ class RechgEvalWorker(QObject):
         else:
             return None
 
-    def make_data_daily(self, t, h):
-        """
-        Convert a given time series to a daily basis. Only the last water level
-        measurements made on a given day is kept in the daily time series.
-        If there is no measurement at all for a given day, the default nan
-        value is kept instead in the daily time series.
-        """
-        argsort = np.argsort(t)
-        t = np.floor(t[argsort])
-        h = h[argsort]
-
-        td = np.arange(np.min(t), np.max(t)+1, 1).astype(int)
-        hd = np.ones(len(td)) * np.nan
-        for i in range(len(td)):
-            indx = np.where(t == td[i])[0]
-            if len(indx) > 0:
-                hd[i] = h[indx[-1]]
-        return td, hd
-
     def produce_params_combinations(self):
         """
         Produce a set of parameter combinations (RASmax + Cro) from the ranges
@@ -163,6 +307,33 @@ class RechgEvalWorker(QObject):
 
         return U_RAS, U_Cro
 
+    def produce_params_samples(self, n, bounds=None, seed=None):
+        """
+        Produce n (Cro, RASmax) parameter combinations that are sampled
+        with the glue_sampling method within the provided bounds.
+
+        The bounds are given as [(Cro_min, Cro_max), (RASmax_min, RASmax_max)]
+        and default to the ranges provided by the user. A scrambled Sobol
+        sequence is used for the 'sobol' and 'adaptive' sampling methods and
+        a Latin hypercube for the 'lhs' method.
+        """
+        if bounds is None:
+            bounds = [self.Cro, self.RASmax]
+        if self.glue_sampling == 'lhs':
+            sampler = qmc.LatinHypercube(d=2, seed=seed)
+            samples = sampler.random(n)
+        else:
+            sampler = qmc.Sobol(d=2, scramble=True, seed=seed)
+            with warnings.catch_warnings():
+                # Scipy warns that the balance properties of Sobol' points
+                # require n to be a power of 2, but we want to respect
+                # the model budget exactly.
+                warnings.simplefilter('ignore', UserWarning)
+                samples = sampler.random(n)
+        samples = qmc.scale(
+            samples, [b[0] for b in bounds], [b[1] for b in bounds])
+        return [tuple(sample) for sample in samples]
+
     def eval_recharge(self):
         """
         Produce a set of behavioural models that all represent the observed
@@ -170,97 +341,140 @@ class RechgEvalWorker(QObject):
         GLUE uncertainty limits.
         """
 
-        U_RAS, U_Cro = self.produce_params_combinations()
-
         # Find the indexes to align the water level with the weather data
         # daily time series.
 
         ts = np.where(self.twlvl[0] == self.tweatr)[0][0]
         te = np.where(self.twlvl[-1] == self.tweatr)[0][0]
 
-        # ---- Produce realizations
-        set_RMSE = []
-
-        set_Sy = []
-        set_RASmax = []
-        set_Cru = []
-
-        sets_waterlevels = []
-        set_recharge = []
-        set_runoff = []
-        set_evapo = []
+        if self.nscheme not in HYDROGRAPH_SCHEMES:
+            raise ValueError("Unknown hydrograph scheme '{}'.".format(
+                self.nscheme))
+        if self.nscheme == 'backward' and self.glue_accumulator == 'streaming':
+            raise ValueError("The 'backward' hydrograph scheme is not "
+                             "supported in the 'streaming' mode.")
+        if self.deltat_sweep is not None and self.glue_sampling == 'adaptive':
+            raise ValueError("The 'adaptive' sampling is not supported when "
+                             "sweeping several time lags.")
+
+        self._cancel_requested = False
+        self._last_progress_time = None
+        refilter = (self.deltat_sweep is None and
+                    self.models_table is not None and
+                    self.can_refilter_models_table(self.models_table))
+
+        # Resume from the checkpoint saved by a previous run with the same
+        # inputs, if any.
+        self._sweep_offset = 0
+        self._checkpoint_key = None
+        self._resume = None
+        if (self.checkpoint_interval is not None and not refilter and
+                self.deltat_sweep is None and
+                hasattr(self.wldset, 'save_glue_checkpoint')):
+            # The models saved in the checkpoint depend on how their
+            # results are accumulated.
+            self._checkpoint_key = '{}-{}'.format(
+                self.get_inputs_key(), self.glue_accumulator)
+            self._resume = self.wldset.get_glue_checkpoint(
+                self._checkpoint_key)
+            if self._resume is not None:
+                print("Resuming GLUE from a checkpoint ({} models already "
+                      "evaluated)".format(self._resume.get('ndone', 0)))
 
-        Sy0 = np.mean(self.Sy)
+        # ---- Produce realizations
         time_start = perf_counter()
-        N = sum(1 for p in product(U_Cro, U_RAS))
-        self.sig_glue_progress.emit(0)
-        for it, (cro, rasmax) in enumerate(product(U_Cro, U_RAS)):
-            rechg, ru, etr, ras, pacc = self.surf_water_budget(cro, rasmax)
-            SyOpt, RMSE, wlvlest = self.optimize_specific_yield(
-                Sy0, self.wlobs*1000, rechg[ts:te])
-            if SyOpt is not None:
-                Sy0 = SyOpt
-
-                # Check if the model respected the cutoff criteria if any.
-                rmse_cutoff_value = (
-                    self.rmse_cutoff if self.rmse_cutoff_enabled else RMSE)
-                if (SyOpt >= self.Sy[0] and
-                        SyOpt <= self.Sy[1] and
-                        RMSE <= rmse_cutoff_value):
-                    set_RMSE.append(RMSE)
-                    set_recharge.append(rechg)
-                    sets_waterlevels.append(wlvlest)
-                    set_Sy.append(SyOpt)
-                    set_RASmax.append(rasmax)
-                    set_Cru.append(cro)
-                    set_evapo.append(etr)
-                    set_runoff.append(ru)
-
-            self.sig_glue_progress.emit((it+1)/N*100)
+        self._emit_progress(0)
+        deltat = self.get_deltats()[0]
+        lags_table = None
+        if self.deltat_sweep is not None:
+            models, lags_table = self._eval_deltat_sweep(ts, te)
+            # The water levels must be aligned with the recharge shifted by
+            # the best lag instead of the smallest one.
+            deltat = lags_table['best deltat']
+            ts -= deltat - lags_table['deltat'][0]
+            te -= deltat - lags_table['deltat'][0]
+        elif refilter:
+            models = self._refilter_models_table(self.models_table, ts, te)
+        elif self.glue_sampling == 'grid':
+            U_RAS, U_Cro = self.produce_params_combinations()
+            params = list(product(U_Cro, U_RAS))
+            models = self._eval_params(
+                params, ts, te, self._emit_progress)
+        elif self.glue_sampling == 'adaptive':
+            models = self._eval_models_adaptive(ts, te)
+        elif self.glue_sampling in self.SAMPLING_METHODS:
+            params = self.produce_params_samples(
+                self.glue_model_budget, seed=self.sampling_seed)
+            models = self._eval_params(
+                params, ts, te, self._emit_progress)
+        else:
+            raise ValueError("glue_sampling value must be one of",
+                             self.SAMPLING_METHODS)
+        self._resume = None
+        if self._cancel_requested:
+            return self._cancel_glue()
         print("GLUE computed in {:0.1f} sec".format(perf_counter()-time_start))
-        self._print_model_params_summary(set_Sy, set_Cru, set_RASmax, set_RMSE)
+        self.niter = np.array(models['niter'], dtype=int)
+        print("{} models evaluated with {} Gauss-Newton iterations".format(
+            len(self.niter), np.sum(self.niter)))
+        self._print_model_params_summary(
+            models['Sy'], models['Cru'], models['RASmax'], models['RMSE'])
+        if (self.retain_models_table and self.glue_accumulator == 'memory' and
+                self.deltat_sweep is None):
+            # We keep the results of the behavioural models, so that they
+            # do not need to be simulated again if the table of the models
+            # is filtered again in a next call to eval_recharge.
+            self._last_models = models
+            self._last_models['key'] = self.get_inputs_key(filters=False)
+        else:
+            self._last_models = None
 
         # ---- Format results
         glue_rawdata = {}
-        glue_rawdata['count'] = len(set_RMSE)
-        glue_rawdata['RMSE'] = np.array(set_RMSE)
-        glue_rawdata['params'] = {'Sy': np.array(set_Sy),
-                                  'RASmax': np.array(set_RASmax),
-                                  'Cru': np.array(set_Cru),
+        glue_rawdata['count'] = len(models['RMSE'])
+        glue_rawdata['RMSE'] = np.array(models['RMSE'])
+        glue_rawdata['params'] = {'Sy': np.array(models['Sy']),
+                                  'RASmax': np.array(models['RASmax']),
+                                  'Cru': np.array(models['Cru']),
                                   'tmelt': self.TMELT,
                                   'CM': self.CM,
-                                  'deltat': self.deltat}
+                                  'deltat': deltat}
         glue_rawdata['ranges'] = {'Sy': self.Sy,
                                   'Cro': self.Cro,
                                   'RASmax': self.RASmax}
         glue_rawdata['cutoff'] = {
             'rmse_cutoff': self.rmse_cutoff,
             'rmse_cutoff_enabled': self.rmse_cutoff_enabled}
+        glue_rawdata['inputs key'] = self.get_inputs_key()
+        if lags_table is not None:
+            glue_rawdata['lags'] = lags_table
+        if self.retain_models_table:
+            glue_rawdata['models table'] = self._produce_models_table(
+                models, refilter)
 
         glue_rawdata['water levels'] = {}
         glue_rawdata['water levels']['time'] = self.twlvl
         glue_rawdata['water levels']['observed'] = self.wlobs
 
-        glue_rawdata['Weather'] = {'Tmax': self.wxdset.data['Tmax'].values,
-                                   'Tmin': self.wxdset.data['Tmin'].values,
-                                   'Tavg': self.wxdset.data['Tavg'].values,
-                                   'Ptot': self.wxdset.data['Ptot'].values,
-                                   'Rain': self.wxdset.data['Rain'].values,
-                                   'PET': self.wxdset.data['PET'].values}
+        self._format_weather_rawdata(glue_rawdata)
 
         # Save the water levels simulated with the mrc, as well as and values
         # of the parameters that characterized this mrc.
         glue_rawdata['mrc'] = self.wldset.get_mrc()
 
         # Store the models output that will need to be processed with GLUE.
-        glue_rawdata['hydrograph'] = sets_waterlevels
-        glue_rawdata['recharge'] = set_recharge
-        glue_rawdata['etr'] = set_evapo
-        glue_rawdata['ru'] = set_runoff
-        glue_rawdata['Time'] = self.wxdset.get_xldates()
-        glue_rawdata['Year'] = self.wxdset.data.index.year.values
-        glue_rawdata['Month'] = self.wxdset.data.index.month.values
-        glue_rawdata['Day'] = self.wxdset.data.index.day.values
+        glue_rawdata['hydrograph'] = models['hydrograph']
+        glue_rawdata['recharge'] = models['recharge']
+        glue_rawdata['etr'] = models['etr']
+        glue_rawdata['ru'] = models['ru']
+        if self.glue_accumulator == 'streaming' and glue_rawdata['count']:
+            glue_rawdata['glue'] = self._calcul_glue_streaming(models, ts, te)
+            if self._cancel_requested:
+                return self._cancel_glue()
+        if glue_rawdata['count'] and self.nscheme != 'backward':
+            # The hydrographs computed backward in time cannot be continued
+            # when new data are appended (see append_recharge).
+            glue_rawdata['end state'] = self._calcul_end_state(models, ts, te)
 
         # Save infos about the piezometric station.
 
@@ -282,10 +496,1015 @@ class RechgEvalWorker(QObject):
             # self._save_glue_to_npy(glue_rawdata)
         else:
             glue_dataf = None
+        if self._checkpoint_key is not None:
+            self.wldset.del_glue_checkpoint()
         self.sig_glue_finished.emit(glue_dataf)
 
         return glue_dataf
 
+    def append_recharge(self, gluedf):
+        """
+        Continue the GLUE results in gluedf over the days of weather and
+        water level data that were appended to the datasets since these
+        results were produced and return the updated GLUE results.
+
+        The behavioural models and their likelihood weights are kept as
+        they are. The soil moisture balance and the hydrograph of each
+        behavioural model are continued from the end state saved with the
+        GLUE results for the new days only and the GLUE values of the
+        previous days are reused. The data loaded with load_data must
+        extend the period of the previous results, with the same time lag,
+        and must not have been modified over that period.
+        """
+        if 'end state' not in gluedf:
+            raise ValueError("The GLUE results were produced without the "
+                             "end state of the behavioural models.")
+        if self.nscheme == 'backward':
+            raise ValueError("The 'backward' hydrograph scheme is not "
+                             "supported when appending data.")
+        deltat = int(gluedf['params']['deltat'])
+        if self.get_deltats() != [deltat]:
+            raise ValueError("The time lag must be the same as the one of "
+                             "the GLUE results.")
+
+        # Find the day of the last observed water level of the previous
+        # results in the weather and water level data.
+        end_state = gluedf['end state']
+        prev_twlvl = np.asarray(gluedf['water levels']['time'])
+        xldates = self.wxdset.get_xldates()
+        t0 = np.where(xldates == end_state['time'])[0]
+        k0 = np.where(self.twlvl == prev_twlvl[-1])[0]
+        if (len(t0) == 0 or len(k0) == 0 or k0[0] != len(prev_twlvl) - 1 or
+                self.twlvl[0] != prev_twlvl[0]):
+            raise ValueError("The weather and water level data do not extend "
+                             "the period of the GLUE results.")
+        t0, k0 = t0[0], k0[0]
+
+        params = gluedf['params']
+        cru = np.asarray(params['Cru'], dtype=float)
+        rasmax = np.asarray(params['RASmax'], dtype=float)
+        sy = np.asarray(params['Sy'], dtype=float)
+        rmse = np.asarray(gluedf['RMSE'], dtype=float)
+        A, B = gluedf['mrc']['params']
+        M = len(sy)
+        N = len(self.ETP) - t0
+        wlobs = self.wlobs[k0:] * 1000
+
+        # Continue the water budget and the hydrographs of the behavioural
+        # models from the day of the last observed water level.
+        rechg, ru, etr, ras, pacc = (np.empty((M, N)) for i in range(5))
+        calcul_surf_water_budget_batch(
+            self.ETP[t0:], self.PTOT[t0:], self.TAVG[t0:],
+            float(params['tmelt']), float(params['CM']), cru, rasmax,
+            rechg, ru, etr, ras, pacc, num_threads=self.nthreads,
+            RAS0=np.asarray(end_state['RAS'], dtype=float),
+            PACC0=np.asarray(end_state['PACC'], dtype=float))
+        wlpre = np.empty((M, len(wlobs)))
+        calc_hydrograph_batch(
+            rechg, wlobs, sy, float(A), float(B), wlpre,
+            num_threads=self.nthreads,
+            wl0=np.asarray(end_state['wl'], dtype=float),
+            nscheme=self.nscheme)
+
+        # Compute the GLUE values of the new days and add them to those
+        # of the previous days. Note that the daily budget of the previous
+        # results is padded with zeros to account for the time lag.
+        glue_limits = GLUEDataFrame.GLUE_LIMITS
+        dly = gluedf['daily budget']
+        nprev = len(dly['time']) - deltat
+        glue = {'GLUE limits': glue_limits}
+        for var, values, prev_values in [
+                ('recharge', rechg, np.asarray(dly['recharge'])[deltat:]),
+                ('etr', etr, np.asarray(dly['evapo'])[:nprev]),
+                ('ru', ru, np.asarray(dly['runoff'])[:nprev])]:
+            glue[var] = np.vstack([
+                prev_values[:t0],
+                calcul_glue_quantiles(values, rmse, glue_limits)])
+
+        # Only some of the GLUE limits are kept for the water levels, so
+        # the other ones are left to nan for the previous days.
+        indexes = [glue_limits.index(limit) for limit in
+                   gluedf['water levels']['GLUE limits']]
+        glue['hydrograph'] = np.full((len(self.wlobs), len(glue_limits)),
+                                     np.nan)
+        glue['hydrograph'][:k0, indexes] = np.asarray(
+            gluedf['water levels']['predicted'])[:k0]
+        glue['hydrograph'][k0:] = calcul_glue_quantiles(
+            wlpre, rmse, glue_limits)
+
+        glue_rawdata = {key: gluedf[key] for key in
+                        ['count', 'RMSE', 'params', 'ranges', 'cutoff', 'mrc',
+                         'wlinfo', 'wxinfo']}
+        if 'lags' in gluedf:
+            glue_rawdata['lags'] = gluedf['lags']
+        glue_rawdata['water levels'] = {'time': self.twlvl,
+                                        'observed': self.wlobs}
+        self._format_weather_rawdata(glue_rawdata)
+        glue_rawdata['hydrograph'] = []
+        glue_rawdata['recharge'] = []
+        glue_rawdata['etr'] = []
+        glue_rawdata['ru'] = []
+        glue_rawdata['glue'] = glue
+        glue_rawdata['end state'] = {
+            'time': xldates[t0 + len(wlobs) - 1],
+            'RAS': ras[:, len(wlobs) - 1].copy(),
+            'PACC': pacc[:, len(wlobs) - 1].copy(),
+            'wl': wlpre[:, -1].copy()}
+        print("GLUE results continued over {} new days".format(
+            len(wlobs) - 1))
+
+        glue_dataf = GLUEDataFrame(glue_rawdata)
+        self.sig_glue_finished.emit(glue_dataf)
+        return glue_dataf
+
+    def _calcul_end_state(self, models, ts, te):
+        """
+        Return the state of the soil moisture balance (RAS and PACC) of
+        each behavioural model at the start of the day of the last observed
+        water level, along with the water level simulated for that day,
+        so that the models can be continued from there when new data are
+        appended to the datasets (see append_recharge).
+        """
+        cru = np.array(models['Cru'], dtype=float)
+        rasmax = np.array(models['RASmax'], dtype=float)
+        sy = np.array(models['Sy'], dtype=float)
+        wlobs = self.wlobs * 1000
+        M = len(sy)
+        end_state = {'time': self.wxdset.get_xldates()[te],
+                     'RAS': np.empty(M),
+                     'PACC': np.empty(M),
+                     'wl': np.empty(M)}
+        for istart in range(0, M, self.batch_size):
+            iend = min(istart + self.batch_size, M)
+            rechg, ru, etr, ras, pacc = (
+                np.empty((iend - istart, te + 1)) for i in range(5))
+            calcul_surf_water_budget_batch(
+                self.ETP[:te + 1], self.PTOT[:te + 1], self.TAVG[:te + 1],
+                self.TMELT, self.CM, cru[istart:iend], rasmax[istart:iend],
+                rechg, ru, etr, ras, pacc, num_threads=self.nthreads)
+            wlpre = np.empty((iend - istart, len(wlobs)))
+            calc_hydrograph_batch(
+                rechg[:, ts:te], wlobs, sy[istart:iend], self.A, self.B,
+                wlpre, num_threads=self.nthreads, nscheme=self.nscheme)
+            end_state['RAS'][istart:iend] = ras[:, te]
+            end_state['PACC'][istart:iend] = pacc[:, te]
+            end_state['wl'][istart:iend] = wlpre[:, -1]
+        return end_state
+
+    def _format_weather_rawdata(self, glue_rawdata):
+        """
+        Add the weather data and the dates of the weather dataset to the
+        raw GLUE data.
+        """
+        glue_rawdata['Weather'] = {'Tmax': self.wxdset.data['Tmax'].values,
+                                   'Tmin': self.wxdset.data['Tmin'].values,
+                                   'Tavg': self.wxdset.data['Tavg'].values,
+                                   'Ptot': self.wxdset.data['Ptot'].values,
+                                   'Rain': self.wxdset.data['Rain'].values,
+                                   'PET': self.wxdset.data['PET'].values}
+        glue_rawdata['Time'] = self.wxdset.get_xldates()
+        glue_rawdata['Year'] = self.wxdset.data.index.year.values
+        glue_rawdata['Month'] = self.wxdset.data.index.month.values
+        glue_rawdata['Day'] = self.wxdset.data.index.day.values
+
+    def cancel(self):
+        """
+        Request the cancellation of the current call to eval_recharge.
+
+        This is meant to be called from another thread than the one in
+        which eval_recharge is running. The evaluation of the models stops
+        at the end of the current batch of models, the progress is saved
+        in a checkpoint if checkpoints are enabled, and sig_glue_cancelled
+        is emitted instead of sig_glue_finished.
+        """
+        self._cancel_requested = True
+
+    def _cancel_glue(self):
+        """Handle the cancellation of the current call to eval_recharge."""
+        print("GLUE computation cancelled.")
+        self.sig_glue_cancelled.emit()
+        return None
+
+    def _emit_progress(self, progress):
+        """
+        Emit sig_glue_progress with the progress value if at least
+        progress_interval seconds elapsed since it was last emitted, or if
+        the computation is starting or completed.
+        """
+        now = perf_counter()
+        if (self._last_progress_time is None or progress <= 0 or
+                progress >= 100 or
+                now - self._last_progress_time >= self.progress_interval):
+            self._last_progress_time = now
+            self.sig_glue_progress.emit(progress)
+
+    def _eval_params(self, params, ts, te, progress_callback=None):
+        """
+        Evaluate the models for the list of (Cro, RASmax) parameter
+        combinations in params, either in the current process or across a
+        pool of processes, and return the behavioural ones.
+
+        The parameter combinations are evaluated in the order set with
+        glue_traversal. The progress is saved periodically in a checkpoint
+        and the models that were already evaluated in a previous run with
+        the same inputs are restored from its checkpoint instead of being
+        evaluated again.
+        """
+        params = [params[i] for i in self.get_traversal_order(params)]
+        N = len(params)
+        index0 = self._sweep_offset
+        self._sweep_offset += N
+
+        resume = self._resume
+        if resume is not None and len(resume.get('params', [])) >= index0 + N:
+            # We use the parameter combinations saved in the checkpoint,
+            # since they may have been sampled randomly.
+            params = [tuple(p) for p in resume['params'][index0:index0 + N]]
+            ndone = int(np.clip(resume.get('ndone', 0) - index0, 0, N))
+            Sy0 = resume.get('Sy0')
+            index = resume.get('index', np.array([], dtype=int))
+            mask = (index >= index0) & (index < index0 + ndone)
+            models = {key: list(resume[key][mask]) if key in resume else []
+                      for key in self.MODELS_KEYS}
+            for key in self.EVALUATED_KEYS:
+                models[key] = list(
+                    resume.get(key, [])[index0:index0 + ndone])
+        else:
+            ndone = 0
+            Sy0 = None
+            models = {key: [] for key in self.MODELS_KEYS}
+            self._save_checkpoint({'params': np.array(params, dtype=float)})
+        if ndone == N:
+            return models
+
+        saved = {'nmodels': 0, 'nevaluated': 0, 'time': perf_counter()}
+
+        def checkpoint_callback(new_models, Sy0, force=False):
+            # Save the models that were evaluated since the last checkpoint.
+            if (not force and
+                    perf_counter() - saved['time'] < self.checkpoint_interval):
+                return
+            nevaluated = len(new_models['niter'])
+            data = {key: new_models[key][saved['nmodels']:] for
+                    key in self.MODELS_KEYS}
+            for key in self.EVALUATED_KEYS:
+                data[key] = new_models[key][saved['nevaluated']:]
+            data['ndone'] = index0 + ndone + nevaluated
+            if Sy0 is not None:
+                data['Sy0'] = Sy0
+            self._save_checkpoint(data)
+            saved.update(nmodels=len(new_models['RMSE']),
+                         nevaluated=nevaluated,
+                         time=perf_counter())
+
+        def stage_progress_callback(p):
+            progress_callback((ndone + p / 100 * (N - ndone)) / N * 100)
+
+        if self._checkpoint_key is None:
+            checkpoint_callback = None
+        if progress_callback is None:
+            stage_progress_callback = None
+        if self.nworkers > 1:
+            new_models = self._eval_models_parallel(
+                params[ndone:], ts, te, stage_progress_callback,
+                Sy0, index0 + ndone, checkpoint_callback)
+        else:
+            new_models = self._eval_models(
+                params[ndone:], ts, te, stage_progress_callback,
+                Sy0, index0 + ndone, checkpoint_callback)
+        for key in self.MODELS_KEYS:
+            models[key].extend(new_models[key])
+        return models
+
+    def get_inputs_key(self, filters=True):
+        """
+        Return a key that uniquely identifies the data and parameters that
+        are used to produce the set of behavioural models.
+
+        If filters is False, the Sy range and RMSE cutoff that are used to
+        select the behavioural models are left out of the key, so that it
+        only identifies the models that are evaluated.
+        """
+        hasher = hashlib.sha256()
+        for values in [self.ETP, self.PTOT, self.TAVG, self.tweatr,
+                       self.twlvl, self.wlobs]:
+            hasher.update(np.ascontiguousarray(values, dtype=float).tobytes())
+        params = [
+            float(self.TMELT), float(self.CM), self.deltat if
+            self.deltat_sweep is None else self.get_deltats(), float(self.A),
+            float(self.B), self.Cro, self.RASmax, self.glue_pardist_res,
+            self.glue_sampling, self.glue_model_budget, self.sampling_seed,
+            self.glue_traversal, self.chunk_size]
+        if self.nscheme != 'forward':
+            # We add the scheme only when it is not the default one, so that
+            # the keys of the results produced before it could be selected
+            # remain valid.
+            params.append(self.nscheme)
+        if filters:
+            params += [self.Sy, self.rmse_cutoff, self.rmse_cutoff_enabled]
+        hasher.update(repr(params).encode('utf8'))
+        return hasher.hexdigest()
+
+    def _produce_models_table(self, models, refilter=False):
+        """
+        Return a dict with the parameters, optimal Sy and RMSE of all the
+        models that were evaluated, along with what is needed to check
+        whether the behavioural models can be selected again from it.
+        """
+        if refilter:
+            # We keep the validity range of the table from which the
+            # models were selected.
+            prescreen_cutoff = self.models_table['prescreen rmse cutoff']
+            prescreen_sy = self.models_table['prescreen Sy']
+        elif self._is_prescreen_enabled():
+            prescreen_cutoff = self.rmse_cutoff
+            prescreen_sy = self.Sy
+        else:
+            prescreen_cutoff = np.inf
+            prescreen_sy = (-np.inf, np.inf)
+        return {'Cru': np.array(models['evaluated_Cru'], dtype=float),
+                'RASmax': np.array(models['evaluated_RASmax'], dtype=float),
+                'Sy': np.array(models['evaluated_Sy'], dtype=float),
+                'RMSE': np.array(models['evaluated_RMSE'], dtype=float),
+                'inputs key': self.get_inputs_key(filters=False),
+                'prescreen rmse cutoff': float(prescreen_cutoff),
+                'prescreen Sy': np.array(prescreen_sy, dtype=float)}
+
+    def can_refilter_models_table(self, models_table):
+        """
+        Return whether the behavioural models can be selected from the
+        table of the models that were evaluated in a previous call to
+        eval_recharge (see retain_models_table) with the current inputs.
+
+        The table must have been produced with the same data and
+        parameters, except for the Sy range and RMSE cutoff. Moreover, if
+        models were rejected without optimizing Sy in that previous call
+        because the RMSE cutoff was enabled, the current RMSE cutoff must
+        be enabled and lower or equal and the current Sy range must be
+        within the previous one.
+        """
+        inputs_key = models_table['inputs key']
+        if isinstance(inputs_key, bytes):
+            inputs_key = inputs_key.decode('utf8')
+        if inputs_key != self.get_inputs_key(filters=False):
+            return False
+        prescreen_cutoff = models_table['prescreen rmse cutoff']
+        prescreen_sy = models_table['prescreen Sy']
+        if np.isfinite(prescreen_cutoff):
+            return bool(self.rmse_cutoff_enabled and
+                        self.rmse_cutoff <= prescreen_cutoff and
+                        self.Sy[0] >= prescreen_sy[0] and
+                        self.Sy[1] <= prescreen_sy[1])
+        return True
+
+    def _refilter_models_table(self, models_table, ts, te):
+        """
+        Select the behavioural models from the table of the models that
+        were evaluated in a previous call to eval_recharge with the current
+        Sy range and RMSE cutoff.
+
+        The results of the behavioural models are only simulated again for
+        the models that were not kept from the last call to eval_recharge
+        and only if glue_accumulator is 'memory'.
+        """
+        cru = np.asarray(models_table['Cru'], dtype=float)
+        rasmax = np.asarray(models_table['RASmax'], dtype=float)
+        sy = np.asarray(models_table['Sy'], dtype=float)
+        rmse = np.asarray(models_table['RMSE'], dtype=float)
+
+        models = {key: [] for key in self.MODELS_KEYS}
+        models['niter'] = [0] * len(sy)
+        models['evaluated_Cru'] = list(cru)
+        models['evaluated_RASmax'] = list(rasmax)
+        models['evaluated_Sy'] = list(sy)
+        models['evaluated_RMSE'] = list(rmse)
+
+        rmse_cutoff = self.rmse_cutoff if self.rmse_cutoff_enabled else np.inf
+        with np.errstate(invalid='ignore'):
+            index = np.where((sy >= self.Sy[0]) & (sy <= self.Sy[1]) &
+                             (rmse <= rmse_cutoff))[0]
+        models['index'] = list(index)
+        models['RMSE'] = list(rmse[index])
+        models['Sy'] = list(sy[index])
+        models['RASmax'] = list(rasmax[index])
+        models['Cru'] = list(cru[index])
+        print("{} behavioural models selected from a table of {} "
+              "models".format(len(index), len(sy)))
+        if self.glue_accumulator != 'memory':
+            return models
+
+        # Get the results of the behavioural models that were kept from the
+        # last call to eval_recharge. Note that we need to check the values
+        # of the parameters, since the models may have been sampled randomly.
+        last_models = self._last_models
+        if (last_models is not None and
+                last_models['key'] == self.get_inputs_key(filters=False)):
+            last_indexes = {
+                idx: i for i, idx in enumerate(last_models['index']) if
+                idx < len(sy) and
+                last_models['Cru'][i] == cru[idx] and
+                last_models['RASmax'][i] == rasmax[idx]}
+        else:
+            last_indexes = {}
+        results = {key: [None] * len(index) for
+                   key in ['hydrograph', 'recharge', 'etr', 'ru']}
+        new = []
+        for i, idx in enumerate(index):
+            if idx in last_indexes:
+                for key in results:
+                    results[key][i] = last_models[key][last_indexes[idx]]
+            else:
+                new.append(i)
+
+        # Simulate the results of the other behavioural models.
+        wlobs = self.wlobs * 1000
+        for istart in range(0, len(new), self.batch_size):
+            if self._cancel_requested:
+                break
+            batch = new[istart:istart + self.batch_size]
+            batch_rechg, batch_ru, batch_etr, _, _ = (
+                self.surf_water_budget_batch(
+                    cru[index[batch]], rasmax[index[batch]]))
+            batch_wlpre = np.empty((len(batch), len(wlobs)))
+            calc_hydrograph_batch(
+                batch_rechg[:, ts:te], wlobs, sy[index[batch]],
+                self.A, self.B, batch_wlpre, num_threads=self.nthreads,
+                nscheme=self.nscheme)
+            for j, i in enumerate(batch):
+                results['recharge'][i] = batch_rechg[j].copy()
+                results['etr'][i] = batch_etr[j].copy()
+                results['ru'][i] = batch_ru[j].copy()
+                results['hydrograph'][i] = batch_wlpre[j]
+            self._emit_progress((istart + len(batch)) / len(new) * 100)
+        print("{} behavioural models were simulated again".format(len(new)))
+        models.update(results)
+        return models
+
+    def _save_checkpoint(self, data):
+        """
+        Save the lists and values in data in the checkpoint of the current
+        run in the water level dataset, if checkpoints are enabled.
+        """
+        if self._checkpoint_key is None:
+            return
+        data = {key: np.array(value) for key, value in data.items() if
+                np.ndim(value) == 0 or len(value) > 0}
+        self.wldset.save_glue_checkpoint(self._checkpoint_key, data)
+
+    def _eval_models_adaptive(self, ts, te):
+        """
+        Evaluate glue_model_budget models sampled adaptively in the
+        (Cro, RASmax) parameter space and return the behavioural ones.
+
+        A first set of models is sampled over the whole parameter space
+        with a Sobol sequence. The remaining models are then sampled with
+        a Sobol sequence within the bounding box of the behavioural models
+        found in the first stage, expanded by the average spacing of the
+        first stage samples. Since no behavioural models were found outside
+        of that box, the behavioural models are sampled uniformly, which is
+        required for the GLUE likelihood weights to remain valid.
+        """
+        n1 = max(1, int(self.glue_model_budget *
+                        self.ADAPTIVE_EXPLORE_FRACTION))
+        n2 = max(0, self.glue_model_budget - n1)
+        rng = np.random.default_rng(self.sampling_seed)
+
+        def progress_callback(istart, n):
+            # Convert the progress of a stage to the overall progress.
+            return lambda p: self._emit_progress(
+                (istart + p / 100 * n) / self.glue_model_budget * 100)
+
+        params = self.produce_params_samples(n1, seed=rng)
+        models = self._eval_params(
+            params, ts, te, progress_callback(0, n1))
+        if n2 == 0 or self._cancel_requested:
+            return models
+
+        if len(models['RMSE']):
+            # Expand the bounding box of the behavioural models by the
+            # average spacing of the first stage samples in each direction.
+            bounds = []
+            for key, prange in (('Cru', self.Cro), ('RASmax', self.RASmax)):
+                margin = (prange[1] - prange[0]) / n1**0.5
+                bounds.append((max(np.min(models[key]) - margin, prange[0]),
+                               min(np.max(models[key]) + margin, prange[1])))
+        else:
+            bounds = None
+        params = self.produce_params_samples(n2, bounds, seed=rng)
+        refined_models = self._eval_params(
+            params, ts, te, progress_callback(n1, n2))
+        for key in self.MODELS_KEYS:
+            models[key].extend(refined_models[key])
+        return models
+
+    def _eval_deltat_sweep(self, ts, te):
+        """
+        Evaluate the models for every time lag in deltat_sweep and return
+        the behavioural models of the best lag, along with a table of the
+        number of behavioural models and of the lowest RMSE for each lag.
+
+        The indexes ts and te of the first and last observed water levels
+        in the weather data are those of the smallest lag. The best lag is
+        the one whose best behavioural model has the lowest RMSE. The
+        results of its behavioural models are simulated again afterwards,
+        as when the behavioural models are selected from a table of
+        models (see _refilter_models_table).
+        """
+        deltats = self.get_deltats()
+        if self.glue_sampling == 'grid':
+            U_RAS, U_Cro = self.produce_params_combinations()
+            params = list(product(U_Cro, U_RAS))
+        elif self.glue_sampling in self.SAMPLING_METHODS:
+            params = self.produce_params_samples(
+                self.glue_model_budget, seed=self.sampling_seed)
+        else:
+            raise ValueError("glue_sampling value must be one of",
+                             self.SAMPLING_METHODS)
+        params = [params[i] for i in self.get_traversal_order(params)]
+
+        if self.nworkers > 1 and len(params) > 1:
+            sweep = self._eval_models_lags_parallel(
+                params, ts, te, deltats, self._emit_progress)
+        else:
+            sweep = self._eval_models_lags(
+                params, ts, te, deltats, self._emit_progress)
+
+        rmse_cutoff = self.rmse_cutoff if self.rmse_cutoff_enabled else np.inf
+        with np.errstate(invalid='ignore'):
+            behavioural = ((sweep['Sy'] >= self.Sy[0]) &
+                           (sweep['Sy'] <= self.Sy[1]) &
+                           (sweep['RMSE'] <= rmse_cutoff))
+        count = np.sum(behavioural, axis=1)
+        best_rmse = np.min(
+            np.where(behavioural, sweep['RMSE'], np.inf), axis=1,
+            initial=np.inf)
+        ibest = int(np.argmin(best_rmse))
+        best_rmse[~np.isfinite(best_rmse)] = np.nan
+        lags_table = {'deltat': np.array(deltats, dtype=int),
+                      'count': count,
+                      'RMSE': best_rmse,
+                      'best deltat': deltats[ibest]}
+        for deltat, n, rmse in zip(deltats, count, best_rmse):
+            print("deltat = {:d} days: {:d} behavioural models, "
+                  "best RMSE = {:0.1f}".format(deltat, n, rmse))
+
+        models_table = {
+            'Cru': np.array([p[0] for p in params], dtype=float),
+            'RASmax': np.array([p[1] for p in params], dtype=float),
+            'Sy': sweep['Sy'][ibest],
+            'RMSE': sweep['RMSE'][ibest]}
+        shift = deltats[ibest] - deltats[0]
+        models = self._refilter_models_table(
+            models_table, ts - shift, te - shift)
+        models['niter'] = list(sweep['niter'])
+        return models, lags_table
+
+    def _eval_models_lags(self, params, ts, te, deltats,
+                          progress_callback=None):
+        """
+        Evaluate the models for the list of (Cro, RASmax) parameter
+        combinations in params for every time lag in deltats.
+
+        The surface water budget of each model is computed only once and the
+        recharge is then shifted by each lag, where ts and te are the
+        indexes of the first and last observed water levels in the weather
+        data for the first lag. The optimal Sy and the RMSE of the models
+        are returned in arrays of shape (len(deltats), len(params)), where
+        the values of the models that were rejected before optimizing Sy
+        are nan, along with the total number of iterations that were
+        required to optimize Sy for each model.
+        """
+        wlobs = self.wlobs * 1000
+        prescreen = self._is_prescreen_enabled()
+        if prescreen:
+            sse_max = (self.rmse_cutoff**2 * np.sum(~np.isnan(wlobs)) *
+                       (1 + 1e-9))
+
+        N = len(params)
+        shifts = np.array(deltats, dtype=int) - deltats[0]
+        sweep = {'Sy': np.full((len(deltats), N), np.nan),
+                 'RMSE': np.full((len(deltats), N), np.nan),
+                 'niter': np.zeros(N, dtype=int)}
+
+        # The optimal Sy of the previous model is used as the initial guess
+        # for the next one separately for each lag, except at the start of
+        # each chunk (see chunk_size).
+        Sy0 = np.full(len(deltats), np.mean(self.Sy))
+        for istart in range(0, N, self.batch_size):
+            if self._cancel_requested:
+                break
+            batch_params = params[istart:istart + self.batch_size]
+            batch_rechg, _, _, _, _ = self.surf_water_budget_batch(
+                np.array([p[0] for p in batch_params], dtype=float),
+                np.array([p[1] for p in batch_params], dtype=float))
+            for j in range(len(batch_params)):
+                if (istart + j) % self.chunk_size == 0:
+                    Sy0[:] = np.mean(self.Sy)
+                for k, shift in enumerate(shifts):
+                    rechg = batch_rechg[j, ts - shift:te - shift]
+                    if prescreen and calc_hydrograph_sse_bound(
+                            rechg, wlobs, self.Sy[0], self.Sy[1],
+                            self.A, self.B, sse_max,
+                            self.PRESCREEN_NINTERVALS) > sse_max:
+                        continue
+                    SyOpt, RMSE, _, niter = self.optimize_specific_yield(
+                        Sy0[k], wlobs, rechg)
+                    sweep['niter'][istart + j] += niter
+                    if SyOpt is not None:
+                        Sy0[k] = SyOpt
+                        sweep['Sy'][k, istart + j] = SyOpt
+                        sweep['RMSE'][k, istart + j] = RMSE
+                if progress_callback is not None:
+                    progress_callback((istart + j + 1)/N*100)
+        return sweep
+
+    def _eval_models_lags_parallel(self, params, ts, te, deltats,
+                                   progress_callback=None):
+        """
+        Evaluate the models for the list of (Cro, RASmax) parameter
+        combinations in params for every time lag in deltats across a pool
+        of nworkers processes (see _eval_models_lags).
+        """
+        N = len(params)
+        bounds = self._get_chunk_bounds(N)
+        nchunks = len(bounds) - 1
+        state = self._get_sweep_state()
+
+        sweep = {'Sy': np.full((len(deltats), N), np.nan),
+                 'RMSE': np.full((len(deltats), N), np.nan),
+                 'niter': np.zeros(N, dtype=int)}
+        ndone = 0
+
+        def chunk_callback(i, chunk_sweep):
+            nonlocal ndone
+            sweep['Sy'][:, bounds[i]:bounds[i+1]] = chunk_sweep['Sy']
+            sweep['RMSE'][:, bounds[i]:bounds[i+1]] = chunk_sweep['RMSE']
+            sweep['niter'][bounds[i]:bounds[i+1]] = chunk_sweep['niter']
+            ndone += bounds[i+1] - bounds[i]
+            if progress_callback is not None:
+                progress_callback(ndone/N*100)
+
+        self._run_chunks_in_pool(
+            _eval_models_lags_in_subprocess,
+            [(state, params[bounds[i]:bounds[i+1]], ts, te, deltats)
+             for i in range(nchunks)],
+            chunk_callback)
+        return sweep
+
+    def _is_prescreen_enabled(self):
+        """
+        Return whether the models that cannot meet the RMSE cutoff are
+        rejected before optimizing Sy. This requires the RMSE cutoff to be
+        enabled, a lower bound of the range of Sy that is greater than 0,
+        A <= 1 and the forward hydrograph scheme (see
+        calc_hydrograph_sse_bound).
+        """
+        return bool(self.rmse_cutoff_enabled and self.nscheme == 'forward' and
+                    self.Sy[0] > 0 and self.A <= 1)
+
+    def _eval_models(self, params, ts, te, progress_callback=None, Sy0=None,
+                     index0=0, checkpoint_callback=None):
+        """
+        Evaluate the models for the list of (Cro, RASmax) parameter
+        combinations in params and return the behavioural ones.
+
+        The specific yield of each model is optimized using the optimal
+        value found for the previous model as initial guess. The results
+        are returned in a dict of lists that are in the same order as the
+        parameter combinations in params. In the 'streaming' accumulation
+        mode, only the parameters and RMSE of the behavioural models are
+        returned and the lists of time series are left empty.
+
+        If provided, progress_callback is called with the percentage of
+        models evaluated so far after each model, while checkpoint_callback
+        is called with the models evaluated so far and the current initial
+        guess for Sy after each batch of models.
+
+        The evaluation stops before the next batch of models when the
+        cancellation is requested.
+
+        The optimization of Sy starts from Sy0 for the first model, or from
+        the middle of the range of Sy if Sy0 is None, and restarts from the
+        middle of the range of Sy at the start of each chunk of models
+        (see chunk_size). The index of the first model in the overall order
+        of evaluation is index0.
+        """
+        models = {key: [] for key in self.MODELS_KEYS}
+        wlobs = self.wlobs * 1000
+
+        # When the RMSE cutoff is enabled, models whose hydrographs cannot
+        # meet the cutoff for any value of Sy within the range of
+        # behavioural values are rejected before optimizing Sy.
+        prescreen = self._is_prescreen_enabled()
+        if prescreen:
+            # We add a small relative tolerance to make sure that models
+            # are not rejected because of floating point rounding errors.
+            sse_max = (self.rmse_cutoff**2 * np.sum(~np.isnan(wlobs)) *
+                       (1 + 1e-9))
+
+        if Sy0 is None:
+            Sy0 = np.mean(self.Sy)
+        N = len(params)
+        for istart in range(0, N, self.batch_size):
+            if self._cancel_requested:
+                if checkpoint_callback is not None:
+                    checkpoint_callback(models, Sy0, force=True)
+                break
+            batch_params = params[istart:istart + self.batch_size]
+            batch_rechg, batch_ru, batch_etr, _, _ = (
+                self.surf_water_budget_batch(
+                    np.array([p[0] for p in batch_params], dtype=float),
+                    np.array([p[1] for p in batch_params], dtype=float)))
+            for j, (cro, rasmax) in enumerate(batch_params):
+                if (index0 + istart + j) % self.chunk_size == 0:
+                    Sy0 = np.mean(self.Sy)
+                rechg = batch_rechg[j]
+                if prescreen and calc_hydrograph_sse_bound(
+                        rechg[ts:te], wlobs, self.Sy[0], self.Sy[1],
+                        self.A, self.B, sse_max,
+                        self.PRESCREEN_NINTERVALS) > sse_max:
+                    SyOpt, niter = None, 0
+                else:
+                    SyOpt, RMSE, wlvlest, niter = (
+                        self.optimize_specific_yield(
+                            Sy0, wlobs, rechg[ts:te]))
+                models['niter'].append(niter)
+                models['evaluated_Cru'].append(cro)
+                models['evaluated_RASmax'].append(rasmax)
+                models['evaluated_Sy'].append(
+                    np.nan if SyOpt is None else SyOpt)
+                models['evaluated_RMSE'].append(
+                    np.nan if SyOpt is None else RMSE)
+                if SyOpt is not None:
+                    Sy0 = SyOpt
+
+                    # Check if the model respected the cutoff criteria if any.
+                    rmse_cutoff_value = (
+                        self.rmse_cutoff if self.rmse_cutoff_enabled else RMSE)
+                    if (SyOpt >= self.Sy[0] and
+                            SyOpt <= self.Sy[1] and
+                            RMSE <= rmse_cutoff_value):
+                        models['RMSE'].append(RMSE)
+                        models['Sy'].append(SyOpt)
+                        models['RASmax'].append(rasmax)
+                        models['Cru'].append(cro)
+                        models['index'].append(index0 + istart + j)
+                        if self.glue_accumulator == 'memory':
+                            # We need to copy the results because the batch
+                            # output buffers are reused for the next batch.
+                            models['recharge'].append(rechg.copy())
+                            models['hydrograph'].append(wlvlest)
+                            models['etr'].append(batch_etr[j].copy())
+                            models['ru'].append(batch_ru[j].copy())
+
+                if progress_callback is not None:
+                    progress_callback((istart + j + 1)/N*100)
+            if checkpoint_callback is not None:
+                checkpoint_callback(models, Sy0)
+        return models
+
+    def get_traversal_order(self, params):
+        """
+        Return the indexes of the (Cro, RASmax) parameter combinations in
+        params in the order in which they must be evaluated according to
+        glue_traversal.
+
+        For the 'serpentine' order, the rows are defined by the unique values
+        of Cro when the parameter combinations are on a grid. Otherwise, the
+        parameter combinations are split in sqrt(N) rows of equal size
+        along Cro.
+        """
+        N = len(params)
+        if self.glue_traversal == 'rowmajor' or N == 0:
+            return np.arange(N)
+        cro = np.array([p[0] for p in params], dtype=float)
+        rasmax = np.array([p[1] for p in params], dtype=float)
+        if self.glue_traversal == 'serpentine':
+            unique_cro, rows = np.unique(cro, return_inverse=True)
+            if len(unique_cro) == N:
+                rows = np.empty(N, dtype=int)
+                rows[np.argsort(cro, kind='stable')] = (
+                    np.arange(N) * int(np.ceil(N**0.5)) // N)
+            # Sort the parameter combinations by rows and then along RASmax,
+            # in ascending order for even rows and descending order for
+            # odd rows.
+            return np.lexsort((np.where(rows % 2, -rasmax, rasmax), rows))
+        elif self.glue_traversal == 'hilbert':
+            # Map the parameter combinations on a 2**16 by 2**16 grid and
+            # sort them according to their distance along a Hilbert curve
+            # that covers the whole grid.
+            n = 2**16
+            x, y = [
+                np.clip(((v - v.min()) / (np.ptp(v) or 1) * (n - 1)).round(),
+                        0, n - 1).astype(np.int64) for v in (cro, rasmax)]
+            d = np.zeros(N, dtype=np.int64)
+            s = n // 2
+            while s > 0:
+                rx = (x & s) > 0
+                ry = (y & s) > 0
+                d += s * s * ((3 * rx) ^ ry)
+                # Rotate the quadrant so that the curve is continuous.
+                flip = ~ry & rx
+                x = np.where(flip, n - 1 - x, x)
+                y = np.where(flip, n - 1 - y, y)
+                x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+                s //= 2
+            return np.argsort(d, kind='stable')
+        else:
+            raise ValueError("glue_traversal value must be one of",
+                             self.TRAVERSAL_METHODS)
+
+    def _eval_models_parallel(self, params, ts, te, progress_callback=None,
+                              Sy0=None, index0=0, checkpoint_callback=None):
+        """
+        Evaluate the models for the list of (Cro, RASmax) parameter
+        combinations in params across a pool of nworkers processes
+        and return the behavioural ones.
+
+        The parameter combinations are split in the same chunks as in the
+        serial evaluation (see chunk_size), where the optimization of Sy
+        starts from Sy0 for the first chunk, and the results of each chunk
+        are merged in the same order as in params, so that the results are
+        identical to those of the serial evaluation. If provided, checkpoint_callback is called with the
+        models of the first chunks each time they are all completed.
+
+        When the cancellation is requested, the chunks that are not started
+        yet are cancelled and only the models of the first chunks that
+        were all completed are returned, without waiting for the chunks
+        that are still running.
+        """
+        N = len(params)
+        bounds = self._get_chunk_bounds(N, index0)
+        nchunks = len(bounds) - 1
+        state = self._get_sweep_state()
+
+        chunks_models = [None] * nchunks
+        ndone = 0
+        nprefix = 0
+
+        def chunk_callback(i, chunk_models):
+            nonlocal ndone, nprefix
+            chunks_models[i] = chunk_models
+            ndone += bounds[i+1] - bounds[i]
+            if progress_callback is not None:
+                progress_callback(ndone/N*100)
+            nprefix0 = nprefix
+            while nprefix < nchunks and chunks_models[nprefix] is not None:
+                nprefix += 1
+            if checkpoint_callback is not None and nprefix > nprefix0:
+                checkpoint_callback(
+                    self._merge_models(chunks_models[:nprefix]), None)
+
+        self._run_chunks_in_pool(
+            _eval_models_in_subprocess,
+            [(state, params[bounds[i]:bounds[i+1]], ts, te,
+              index0 + bounds[i], Sy0 if i == 0 else None)
+             for i in range(nchunks)],
+            chunk_callback)
+        if self._cancel_requested and checkpoint_callback is not None:
+            checkpoint_callback(
+                self._merge_models(chunks_models[:nprefix]), None,
+                force=True)
+        return self._merge_models(chunks_models[:nprefix])
+
+    def _get_chunk_bounds(self, N, index0=0):
+        """
+        Return the bounds of the chunks of models in which N parameter
+        combinations are split, where index0 is the index of the first one
+        in the overall order of evaluation (see chunk_size).
+        """
+        return np.unique(np.r_[
+            0, np.arange(-index0 % self.chunk_size, N, self.chunk_size), N])
+
+    def _run_chunks_in_pool(self, func, chunks_args, chunk_callback):
+        """
+        Run func with each tuple of arguments in chunks_args across a pool
+        of nworkers processes and call chunk_callback with the index of
+        each chunk and its result as soon as it is completed.
+
+        When the cancellation is requested, the chunks that are not started
+        yet are cancelled and the pool is shut down without waiting for the
+        chunks that are still running.
+        """
+        pending = set()
+        executor = ProcessPoolExecutor(
+            max_workers=self.nworkers,
+            mp_context=multiprocessing.get_context('spawn'))
+        try:
+            futures = {executor.submit(func, *args): i for
+                       i, args in enumerate(chunks_args)}
+            pending = set(futures)
+            while pending and not self._cancel_requested:
+                # We wait with a timeout, so that a cancellation request is
+                # handled promptly.
+                done, pending = wait(
+                    pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=futures.get):
+                    chunk_callback(futures[future], future.result())
+        finally:
+            # We cancel the chunks that are not started yet ourselves,
+            # since the cancel_futures option of shutdown is not available
+            # before Python 3.9.
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=not self._cancel_requested)
+
+    def _merge_models(self, models_list):
+        """Merge a list of models dict in a single one."""
+        models = {key: [] for key in self.MODELS_KEYS}
+        for chunk_models in models_list:
+            for key in self.MODELS_KEYS:
+                models[key].extend(chunk_models[key])
+        return models
+
+    def _get_sweep_state(self):
+        """
+        Return a picklable dict with the data and parameters that are
+        required to evaluate models in a separate process.
+        """
+        return {key: getattr(self, key) for key in
+                ['ETP', 'PTOT', 'TAVG', 'TMELT', 'CM', 'A', 'B', 'wlobs',
+                 'Sy', 'rmse_cutoff', 'rmse_cutoff_enabled', 'batch_size',
+                 'chunk_size', 'glue_accumulator', 'nscheme']}
+
+    def _calcul_glue_streaming(self, models, ts, te):
+        """
+        Calcul the daily GLUE values of the water budget components and of
+        the water levels by simulating again the behavioural models block by
+        block in time, so that the time series of all the behavioural models
+        never need to be held in memory at once.
+
+        The state of the soil moisture balance (RAS and PACC) and of the
+        hydrograph of each model are carried from one block to the next, so
+        that the results are identical to those obtained when simulating
+        the whole period at once. None is returned if the cancellation
+        is requested before all the blocks are processed.
+        """
+        glue_limits = GLUEDataFrame.GLUE_LIMITS
+        cru = np.array(models['Cru'], dtype=float)
+        rasmax = np.array(models['RASmax'], dtype=float)
+        sy = np.array(models['Sy'], dtype=float)
+        rmse = np.array(models['RMSE'])
+        wlobs = self.wlobs * 1000
+        M = len(rmse)
+        N = len(self.ETP)
+        nwl = len(wlobs)
+
+        # There is 5 output buffers for the water budget and 1 for the
+        # hydrograph, each of shape (M, block_size + 1).
+        block_size = max(1, int(self.glue_stream_memory // (6 * 8 * M)) - 1)
+
+        glue = {var: np.empty((N, len(glue_limits))) for
+                var in ['recharge', 'etr', 'ru']}
+        glue['hydrograph'] = np.empty((nwl, len(glue_limits)))
+        glue['GLUE limits'] = glue_limits
+
+        ras0 = rasmax.copy()
+        pacc0 = np.zeros(M)
+        wl0 = np.full(M, wlobs[0])
+        for t0 in range(0, N, block_size):
+            if self._cancel_requested:
+                return None
+            t1 = min(t0 + block_size, N)
+            n = t1 - t0
+
+            # We also simulate the first day of the next block to get the
+            # fluxes of the last day of this block and the state from which
+            # the next block must start.
+            t2 = min(t1 + 1, N)
+            rechg, ru, etr, ras, pacc = (
+                np.empty((M, t2 - t0)) for i in range(5))
+            calcul_surf_water_budget_batch(
+                self.ETP[t0:t2], self.PTOT[t0:t2], self.TAVG[t0:t2],
+                self.TMELT, self.CM, cru, rasmax, rechg, ru, etr, ras, pacc,
+                num_threads=self.nthreads, RAS0=ras0, PACC0=pacc0)
+            if t2 > t1:
+                ras0 = ras[:, n].copy()
+                pacc0 = pacc[:, n].copy()
+            for var, values in [('recharge', rechg), ('etr', etr),
+                                ('ru', ru)]:
+                glue[var][t0:t1] = calcul_glue_quantiles(
+                    values[:, :n], rmse, glue_limits)
+
+            # Simulate the water levels for the days of this block that are
+            # within the period of the observed water levels.
+            k0 = max(t0, ts) - ts
+            k1 = min(t1, te + 1) - ts
+            if k1 <= k0:
+                continue
+            k2 = min(k1 + 1, nwl)
+            wlpre = np.empty((M, k2 - k0))
+            calc_hydrograph_batch(
+                rechg[:, ts + k0 - t0:], wlobs[k0:k2], sy, self.A, self.B,
+                wlpre, num_threads=self.nthreads, wl0=wl0,
+                nscheme=self.nscheme)
+            if k2 > k1:
+                wl0 = wlpre[:, k1 - k0].copy()
+            glue['hydrograph'][k0:k1] = calcul_glue_quantiles(
+                wlpre[:, :k1 - k0], rmse, glue_limits)
+
+        return glue
+
     def _print_model_params_summary(self, set_Sy, set_Cru, set_RASmax,
                                     set_rmse):
         """
@@ -321,57 +1540,67 @@ class RechgEvalWorker(QObject):
         observed and predicted ground-water hydrographs. The observed water
         level (wlobs) and simulated recharge (rechg) time series must be
         in mm and be properly align in time.
+
+        The optimization is done with a Gauss-Newton method that uses the
+        derivative of the predicted hydrograph with respect to Sy computed
+        analytically by the tangent-linear hydrograph kernel, so that a
+        single hydrograph evaluation is required per iteration. The method is
+        safeguarded with a bracket around the optimal value of Sy that is
+        updated from the sign of the gradient at each iteration. The bracket
+        is bisected whenever the Gauss-Newton step falls outside of it.
+
+        Return the optimal value of Sy, the corresponding RMSE and predicted
+        hydrograph, and the number of iterations that were done. None is
+        returned for Sy, the RMSE and the hydrograph if the optimization
+        failed.
         """
-        nonan_indx = np.where(~np.isnan(wlobs))
+        nonan_indx = np.where(~np.isnan(wlobs))[0]
+        wlobs_nonan = wlobs[nonan_indx]
 
         tolmax = 0.001
         Sy = Sy0
-        dSy = 0.01
-
-        wlpre = self.calc_hydrograph(rechg, Sy)
-        RMSE = calcul_rmse(wlobs[nonan_indx], wlpre[nonan_indx])
+        Sy_low, Sy_high = 0, np.inf
+        converged = False
 
         it = 0
         while 1:
             it += 1
             if it > 100:
                 print('Not converging.')
-                return None, None, None
-
-            # Calculating Jacobian (X) Numerically.
-            wlvl = self.calc_hydrograph(rechg, Sy * (1+dSy))
-            X = Xt = (wlvl[nonan_indx] - wlpre[nonan_indx])/(Sy*dSy)
-
-            # Solving Linear System.
-            dh = wlobs[nonan_indx] - wlpre[nonan_indx]
-            XtX = np.dot(Xt, X)
-            Xtdh = np.dot(Xt, dh)
-
-            dr = np.linalg.tensorsolve(XtX, Xtdh, axes=None)
-
-            # Storing old parameter values.
-            Syold = np.copy(Sy)
-            RMSEold = np.copy(RMSE)
-
-            # Loop for Damping (to prevent overshoot)
-            while 1:
-                # Calculating new paramter values.
-                Sy = Syold + dr
-
-                # Solving for new parameter values.
-                wlpre = self.calc_hydrograph(rechg, Sy)
-                RMSE = calcul_rmse(wlobs[nonan_indx], wlpre[nonan_indx])
-
-                # Checking overshoot.
-                if (RMSE - RMSEold) > 0.1:
-                    dr = dr * 0.5
-                else:
-                    break
-
-            # Checking tolerance.
-            tol = np.abs(Sy - Syold)
-            if tol < tolmax:
-                return Sy, RMSE, wlpre
+                return None, None, None, it - 1
+
+            # Solve the hydrograph and its Jacobian (X) analytically.
+            wlpre, dwlpre = calc_hydrograph_tl(
+                rechg, wlobs, Sy, self.A, self.B, self.nscheme)
+            if converged:
+                RMSE = calcul_rmse(wlobs_nonan, wlpre[nonan_indx])
+                return Sy, RMSE, wlpre, it
+
+            X = dwlpre[nonan_indx]
+            dh = wlobs_nonan - wlpre[nonan_indx]
+            XtX = np.dot(X, X)
+            Xtdh = np.dot(X, dh)
+            if XtX == 0:
+                # Sy has no effect on the predicted hydrograph, so it is
+                # not possible to optimize its value.
+                return None, None, None, it
+
+            # Update the bracket around the optimal value of Sy. The gradient
+            # of the sum of squared errors with respect to Sy is -2 * Xtdh.
+            if Xtdh > 0:
+                Sy_low = Sy
+            elif Xtdh < 0:
+                Sy_high = Sy
+
+            # Calculate the Gauss-Newton step and check tolerance.
+            dr = Xtdh / XtX
+            converged = abs(dr) < tolmax
+            if converged or Sy_low < Sy + dr < Sy_high:
+                Sy = Sy + dr
+            else:
+                # Fallback to a bisection of the bracket since the
+                # Gauss-Newton step falls outside of it.
+                Sy = (Sy_low + Sy_high) / 2
 
     def surf_water_budget(self, CRU, RASmax):
         """
@@ -397,55 +1626,101 @@ class RechgEvalWorker(QObject):
 
         return rechg, ru, etr, ras, pacc
 
-    def calc_hydrograph(self, RECHG, Sy, nscheme='forward'):
+    def surf_water_budget_batch(self, CRU, RASmax):
+        """
+        Compute recharge with a daily soil surface moisture balance model
+        for a batch of parameters at once.
+
+        CRU and RASmax must be arrays of the same length. The results are
+        returned as 2D arrays of shape (len(CRU), len(ETP)) where each row
+        corresponds to the results obtained with the parameters at the
+        same index in CRU and RASmax. Note that the arrays that are returned
+        are buffers that are reused from one call to another.
         """
-        This is a forward numerical explicit scheme for generating the
-        synthetic well hydrograph.
+        shape = (len(CRU), len(self.ETP))
+        if (self._swb_buffers is None or
+                np.shape(self._swb_buffers[0]) != shape):
+            self._swb_buffers = tuple(np.empty(shape) for i in range(5))
+        rechg, ru, etr, ras, pacc = self._swb_buffers
 
-        This is a backward explicit scheme to produce a synthetic well
-        hydrograph. The water level starts at the last days in the observed
-        water level time series and generate the hydrograph by going backward
-        in time. This is very usefull when one which to produce water level
-        for the period of time before water level measurements are
-        available.
+        calcul_surf_water_budget_batch(
+            self.ETP, self.PTOT, self.TAVG, self.TMELT, self.CM,
+            CRU, RASmax, rechg, ru, etr, ras, pacc,
+            num_threads=self.nthreads)
 
-        Parameters
-        ----------
-        Wlpre: Predicted Water Level (mm)
-        Sy: Specific Yield
-        RECHG: Groundwater Recharge (mm)
-        WLobs: Observed Water Level (mm)
+        return rechg, ru, etr, ras, pacc
 
-        A, B: MRC Parameters, where: Recess(m/d) = -A * h + B
-        nscheme: Option are "forward" or "downdward" depending if the
-                 hydrograph is being built forward in time or backward.
-                 Default is "forward".
+    def calc_hydrograph(self, RECHG, Sy, nscheme=None):
         """
-
-        # TODO: It should also be possible to do a Crank-Nicholson on this.
-        # I should check this out.
-
-        A, B = self.A, self.B
+        Compute a synthetic well hydrograph from the groundwater recharge
+        (RECHG) in mm and the specific yield (Sy), using the MRC parameters
+        A and B, where: Recess(m/d) = -A * h + B. The predicted water levels
+        are returned in mm.
+
+        nscheme: Option are "forward", "crank-nicolson" or "backward".
+                 The "forward" scheme is a forward numerical explicit scheme
+                 and the "crank-nicolson" scheme averages the recession
+                 between the start and the end of each day. Both start from
+                 the first observed water level. The "backward" scheme
+                 starts at the last days in the observed water level time
+                 series and generate the hydrograph by going backward in
+                 time. This is very usefull when one which to produce water
+                 level for the period of time before water level
+                 measurements are available. Default is the value of the
+                 nscheme attribute.
+        """
+        nscheme = self.nscheme if nscheme is None else nscheme
         wlobs = self.wlobs.copy() * 1000
         if np.isnan(wlobs[0]) or np.isnan(wlobs[-1]):
             raise ValueError('The observed water level time series either '
                              'starts or ends with a nan value.')
         if nscheme == 'backward':
-            wlpre = np.zeros(len(RECHG)+1) * np.nan
-            wlpre[0] = wlobs[-1]
-            for i in reversed(range(len(RECHG))):
-                RECESS = (B - A * wlpre[i] / 1000.) * 1000
-                RECESS = max(RECESS, 0)
-
-                wlpre[i] = wlpre[i+1] + (RECHG[i] / Sy) - RECESS
+            wlpre = calc_hydrograph_backward(RECHG, wlobs, Sy, self.A, self.B)
+        elif nscheme == 'crank-nicolson':
+            wlpre = calc_hydrograph_cn(RECHG, wlobs, Sy, self.A, self.B)
         elif nscheme == 'forward':
             wlpre = calc_hydrograph_forward(RECHG, wlobs, Sy, self.A, self.B)
         else:
-            wlpre = []
+            raise ValueError("Unknown hydrograph scheme '{}'.".format(nscheme))
 
         return wlpre
 
 
+def _eval_models_in_subprocess(state, params, ts, te, index0=0, Sy0=None):
+    """
+    Evaluate the models for the list of (Cro, RASmax) parameter combinations
+    in params with a recharge worker setup from the provided state.
+
+    This is the function that is run by the worker processes when the
+    models are evaluated in parallel.
+    """
+    rechg_worker = RechgEvalWorker()
+    for key, value in state.items():
+        setattr(rechg_worker, key, value)
+
+    # We use a single OpenMP thread per process to avoid oversubscribing
+    # the CPU cores, since the processes already run in parallel.
+    rechg_worker.nthreads = 1
+    return rechg_worker._eval_models(
+        params, ts, te, Sy0=Sy0, index0=index0)
+
+
+def _eval_models_lags_in_subprocess(state, params, ts, te, deltats):
+    """
+    Evaluate the models for the list of (Cro, RASmax) parameter combinations
+    in params for every time lag in deltats with a recharge worker setup
+    from the provided state.
+
+    This is the function that is run by the worker processes when the
+    time lags are swept in parallel.
+    """
+    rechg_worker = RechgEvalWorker()
+    for key, value in state.items():
+        setattr(rechg_worker, key, value)
+    rechg_worker.nthreads = 1
+    return rechg_worker._eval_models_lags(params, ts, te, deltats)
+
+
 def convert_date_to_strdate(years, months, days):
     """Produce a list of dates in bytes using the '%Y-%m-%d' format."""
     strdates = ['%d-%02d-%02d' % (yy, mm, dd) for
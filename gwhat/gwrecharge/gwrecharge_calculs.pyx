@@ -13,32 +13,70 @@ from numpy cimport ndarray
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange
 ctypedef np.float64_t DTYPE_t
 DTYPE = np.float64
 
-def calcul_surf_water_budget(ndarray[np.float64_t, ndim=1] ETP, 
-                             ndarray[np.float64_t, ndim=1] PTOT, 
-                             ndarray[np.float64_t, ndim=1] TAVG,
-                             double TMELT, double CM, double CRU, 
-                             double RASmax):
-    
-    cdef int N = len(ETP)
-    cdef ndarray[np.float64_t, ndim=1] PAVL = np.zeros(N, dtype=DTYPE)   # Available  Precipitation
-    cdef ndarray[np.float64_t, ndim=1] PACC = np.zeros(N, dtype=DTYPE)   # Accumulated Precipitation
-    cdef ndarray[np.float64_t, ndim=1] RU = np.zeros(N, dtype=DTYPE)     # Runoff
-    cdef ndarray[np.float64_t, ndim=1] I = np.zeros(N, dtype=DTYPE)      # Infiltration
-    cdef ndarray[np.float64_t, ndim=1] ETR = np.zeros(N, dtype=DTYPE)    # Evapotranspiration Real
-    cdef ndarray[np.float64_t, ndim=1] dRAS = np.zeros(N, dtype=DTYPE)   # Variation of RAW
-    cdef ndarray[np.float64_t, ndim=1] RAS = np.zeros(N, dtype=DTYPE)    # Readily Available Storage
-    cdef ndarray[np.float64_t, ndim=1] RECHG = np.zeros(N, dtype=DTYPE)  # Recharge (mm)
-    cdef double MP = 0.0
-    
-    PACC[0] = 0
-    RAS[0] = RASmax
-    
+cdef extern from *:
+    """
+    #ifdef _OPENMP
+    #define GWHAT_OPENMP_ENABLED 1
+    #else
+    #define GWHAT_OPENMP_ENABLED 0
+    #endif
+    """
+    int GWHAT_OPENMP_ENABLED
+
+# Whether this extension was compiled with OpenMP support. When it is not,
+# the prange loops below are executed serially.
+OPENMP_ENABLED = bool(GWHAT_OPENMP_ENABLED)
+
+
+# ---- C-level helpers
+cdef inline double _max(double a, double b) noexcept nogil:
+    # Same semantic as the builtin max (the first argument is returned
+    # unless the second one is strictly greater).
+    return b if b > a else a
+
+
+cdef inline double _min(double a, double b) noexcept nogil:
+    # Same semantic as the builtin min (the first argument is returned
+    # unless the second one is strictly lower).
+    return b if b < a else a
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _surf_water_budget(const double[:] ETP,
+                             const double[:] PTOT,
+                             const double[:] TAVG,
+                             double TMELT, double CM, double CRU,
+                             double RASmax, double RAS0, double PACC0,
+                             double[::1] RECHG,
+                             double[::1] RU,
+                             double[::1] ETR,
+                             double[::1] RAS,
+                             double[::1] PACC) noexcept nogil:
+    """
+    Compute the daily soil surface moisture balance for a single set of
+    model parameters, starting from the readily available storage RAS0 and
+    the accumulated precipitation PACC0, and write the results in the
+    provided buffers.
+    """
+    cdef Py_ssize_t N = ETP.shape[0]
+    cdef double MP = 0.0    # Snow Melt Potential
+    cdef double PAVL = 0.0  # Available Precipitation
+    cdef double I = 0.0     # Infiltration
+    cdef double dRAS = 0.0  # Variation of RAW
     cdef Py_ssize_t i
+
+    if N == 0:
+        return
+
+    PACC[0] = PACC0
+    RAS[0] = RAS0
     for i in range(N-1):
-        MP = max(CM * (TAVG[i] - TMELT), 0)  # Snow Melt Potential
+        MP = _max(CM * (TAVG[i] - TMELT), 0)
 
         # ----- Precipitation, Accumulation, and Melt -----
 
@@ -46,57 +84,618 @@ def calcul_surf_water_budget(ndarray[np.float64_t, ndim=1] ETP,
             # Precipitation is falling as rain.
             if MP >= PACC[i]:
                 # Rain is falling on bareground (all snow is melted).
-                PAVL[i] = PACC[i] + PTOT[i]
+                PAVL = PACC[i] + PTOT[i]
                 PACC[i+1] = 0
             else:
                 # Rain is falling on the snowpack.
-                PAVL[i] = MP
+                PAVL = MP
                 PACC[i+1] = PACC[i] - MP + PTOT[i]
         else:
             # Precipitation is falling as Snow.
-            PAVL[i] = 0
+            PAVL = 0
             PACC[i+1] = PACC[i] + PTOT[i]
 
         # ----- Infiltration and Runoff -----
 
-        # runoff coefficient
-        RU[i] = CRU*PAVL[i]
-
-        # curve number
-        # CN = CRU
-        # num = (PAVL[i] - 0.2*(1000/CN-10))**2
-        # den = PAVL[i] + 0.8*(1000/CN-10)
-        # RU[i] = max(num/den, 0)
-
-        I[i] = PAVL[i] - RU[i]
+        RU[i] = CRU * PAVL
+        I = PAVL - RU[i]
 
         # ----- ETR, Recharge and Storage change -----
 
         # Intermediate Step
-        dRAS[i] = min(I[i], RASmax - RAS[i])
-        RAS[i+1] = RAS[i] + dRAS[i]
+        dRAS = _min(I, RASmax - RAS[i])
+        RAS[i+1] = RAS[i] + dRAS
 
         # Final Step
-        RECHG[i] = I[i] - dRAS[i]
-        ETR[i] = min(ETP[i], RAS[i])
+        RECHG[i] = I - dRAS
+        ETR[i] = _min(ETP[i], RAS[i])
         RAS[i+1] = RAS[i+1] - ETR[i]
 
         # Evaportransporation is calculated after recharge. It is assumed
         # that recharge occurs on a time scale that is faster than
         # evapotranspiration in permeable soil.
-    return RECHG, RU, ETR, RAS, PACC
 
+    # The fluxes are not computed for the last day of the series.
+    RECHG[N-1] = 0
+    RU[N-1] = 0
+    ETR[N-1] = 0
 
-def calc_hydrograph_forward(ndarray[np.float64_t, ndim=1] rechg, 
-                            ndarray[np.float64_t, ndim=1] wlobs,
-                            double Sy, double A, double B):
-    
-    cdef int N = len(wlobs)
-    cdef ndarray[np.float64_t, ndim=1] wlpre = np.zeros(N, dtype=DTYPE)
-    
-    wlpre[0] = wlobs[0]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_forward(const double[:] rechg, double wl0,
+                              double Sy, double A, double B,
+                              double[::1] wlpre) noexcept nogil:
+    """
+    Compute a synthetic hydrograph with a forward explicit scheme,
+    starting from the water level wl0, and write the results in wlpre.
+    """
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double recess
     cdef Py_ssize_t i
+
+    if N == 0:
+        return
+
+    wlpre[0] = wl0
     for i in range(N-1):
-        recess = max((B - A*wlpre[i]/1000) * 1000, 0)
+        recess = _max((B - A*wlpre[i]/1000) * 1000, 0)
         wlpre[i+1] = wlpre[i] - (rechg[i]/Sy) + recess
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_forward_tl(const double[:] rechg, double wl0,
+                                 double Sy, double A, double B,
+                                 double[::1] wlpre,
+                                 double[::1] dwlpre) noexcept nogil:
+    """
+    Compute a synthetic hydrograph with a forward explicit scheme, along
+    with its derivative with respect to Sy (tangent-linear model), and
+    write the results in wlpre and dwlpre respectively.
+    """
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double recess
+    cdef double drdSy = 1 / (Sy * Sy)
+    cdef Py_ssize_t i
+
+    if N == 0:
+        return
+
+    wlpre[0] = wl0
+    dwlpre[0] = 0
+    for i in range(N-1):
+        recess = (B - A*wlpre[i]/1000) * 1000
+        if recess > 0:
+            dwlpre[i+1] = dwlpre[i] * (1 - A) + rechg[i] * drdSy
+        else:
+            recess = 0
+            dwlpre[i+1] = dwlpre[i] + rechg[i] * drdSy
+        wlpre[i+1] = wlpre[i] - (rechg[i]/Sy) + recess
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_backward(const double[:] rechg, double wl0,
+                               double Sy, double A, double B,
+                               double[::1] wlpre) noexcept nogil:
+    """
+    Compute a synthetic hydrograph with a backward explicit scheme, going
+    backward in time from the water level wl0 on the last day, and write
+    the results in wlpre.
+    """
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double recess
+    cdef Py_ssize_t i
+
+    if N == 0:
+        return
+
+    wlpre[N-1] = wl0
+    for i in range(N-2, -1, -1):
+        recess = _max((B - A*wlpre[i+1]/1000) * 1000, 0)
+        wlpre[i] = wlpre[i+1] + (rechg[i]/Sy) - recess
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_backward_tl(const double[:] rechg, double wl0,
+                                  double Sy, double A, double B,
+                                  double[::1] wlpre,
+                                  double[::1] dwlpre) noexcept nogil:
+    """
+    Compute a synthetic hydrograph with a backward explicit scheme, along
+    with its derivative with respect to Sy (tangent-linear model), and
+    write the results in wlpre and dwlpre respectively.
+    """
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double recess
+    cdef double drdSy = 1 / (Sy * Sy)
+    cdef Py_ssize_t i
+
+    if N == 0:
+        return
+
+    wlpre[N-1] = wl0
+    dwlpre[N-1] = 0
+    for i in range(N-2, -1, -1):
+        recess = (B - A*wlpre[i+1]/1000) * 1000
+        if recess > 0:
+            dwlpre[i] = dwlpre[i+1] * (1 + A) - rechg[i] * drdSy
+        else:
+            recess = 0
+            dwlpre[i] = dwlpre[i+1] - rechg[i] * drdSy
+        wlpre[i] = wlpre[i+1] + (rechg[i]/Sy) - recess
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_cn(const double[:] rechg, double wl0,
+                         double Sy, double A, double B,
+                         double[::1] wlpre) noexcept nogil:
+    """
+    Compute a synthetic hydrograph with a Crank-Nicolson scheme, starting
+    from the water level wl0, and write the results in wlpre.
+
+    The recession is averaged between the start and the end of each day.
+    Since the recession is piecewise linear in the water level, the implicit
+    equation is solved exactly at each time step.
+    """
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double wl
+    cdef Py_ssize_t i
+
+    if N == 0:
+        return
+
+    wlpre[0] = wl0
+    for i in range(N-1):
+        wl = (wlpre[i] - (rechg[i]/Sy) +
+              _max((B - A*wlpre[i]/1000) * 1000, 0) / 2)
+        if (B - A*wl/1000) > 0:
+            # The recession at the end of the day is positive.
+            wl = (wl + B * 1000 / 2) / (1 + A / 2)
+        wlpre[i+1] = wl
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_cn_tl(const double[:] rechg, double wl0,
+                            double Sy, double A, double B,
+                            double[::1] wlpre,
+                            double[::1] dwlpre) noexcept nogil:
+    """
+    Compute a synthetic hydrograph with a Crank-Nicolson scheme, along
+    with its derivative with respect to Sy (tangent-linear model), and
+    write the results in wlpre and dwlpre respectively.
+    """
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double wl, dwl
+    cdef double drdSy = 1 / (Sy * Sy)
+    cdef Py_ssize_t i
+
+    if N == 0:
+        return
+
+    wlpre[0] = wl0
+    dwlpre[0] = 0
+    for i in range(N-1):
+        wl = wlpre[i] - (rechg[i]/Sy)
+        dwl = dwlpre[i] + rechg[i] * drdSy
+        if (B - A*wlpre[i]/1000) > 0:
+            wl = wl + (B - A*wlpre[i]/1000) * 1000 / 2
+            dwl = dwl - dwlpre[i] * A / 2
+        if (B - A*wl/1000) > 0:
+            wl = (wl + B * 1000 / 2) / (1 + A / 2)
+            dwl = dwl / (1 + A / 2)
+        wlpre[i+1] = wl
+        dwlpre[i+1] = dwl
+
+
+# The numerical schemes that can be used to compute synthetic hydrographs.
+cdef enum:
+    SCHEME_FORWARD = 0
+    SCHEME_BACKWARD = 1
+    SCHEME_CN = 2
+
+HYDROGRAPH_SCHEMES = {'forward': SCHEME_FORWARD,
+                      'backward': SCHEME_BACKWARD,
+                      'crank-nicolson': SCHEME_CN}
+
+
+cdef void _hydrograph(int scheme, const double[:] rechg, double wl0,
+                      double Sy, double A, double B,
+                      double[::1] wlpre) noexcept nogil:
+    """
+    Compute a synthetic hydrograph with the numerical scheme and write the
+    results in wlpre. With the backward scheme, wl0 is the water level on
+    the last day instead of the first one.
+    """
+    if scheme == SCHEME_BACKWARD:
+        _hydrograph_backward(rechg, wl0, Sy, A, B, wlpre)
+    elif scheme == SCHEME_CN:
+        _hydrograph_cn(rechg, wl0, Sy, A, B, wlpre)
+    else:
+        _hydrograph_forward(rechg, wl0, Sy, A, B, wlpre)
+
+
+def _get_scheme(nscheme):
+    """Return the code of the numerical scheme named nscheme."""
+    try:
+        return HYDROGRAPH_SCHEMES[nscheme]
+    except KeyError:
+        raise ValueError("nscheme must be one of {}.".format(
+            ', '.join("'{}'".format(s) for s in HYDROGRAPH_SCHEMES)))
+
+
+def _get_initial_wl(const double[:] wlobs, int scheme):
+    """
+    Return the observed water level from which the synthetic hydrographs
+    are computed with the numerical scheme.
+    """
+    return wlobs[wlobs.shape[0] - 1] if scheme == SCHEME_BACKWARD else wlobs[0]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef double _hydrograph_sse_bound(const double[:] rechg,
+                                  const double[:] wlobs,
+                                  const double[::1] Sy,
+                                  double A, double B,
+                                  double sse_max,
+                                  double[::1] wl,
+                                  double[::1] sse) noexcept nogil:
+    """
+    Compute a lower bound of the sum of squared errors between the observed
+    water levels and the synthetic hydrographs computed with any value of
+    Sy between Sy[0] and Sy[K], where Sy is a sorted array of K + 1 values.
+
+    Since recharge is positive and A <= 1, the synthetic water levels
+    increase monotonically with Sy, so that the synthetic hydrographs
+    computed with Sy[k] and Sy[k+1] bound those computed with any value
+    of Sy in between. The sum of the squared distances of the observed water
+    levels to this envelope is thus a lower bound of the sum of squared
+    errors in the interval [Sy[k], Sy[k+1]] and the smallest of these bounds
+    is a lower bound for the whole range of Sy.
+
+    The computation stops as soon as the bounds of all the intervals
+    exceed sse_max. The wl and sse work buffers must be of size K + 1
+    and K respectively.
+    """
+    cdef Py_ssize_t N = wlobs.shape[0]
+    cdef Py_ssize_t K = sse.shape[0]
+    cdef Py_ssize_t nalive = K
+    cdef double wl_low, wl_high, err
+    cdef double sse_min
+    cdef Py_ssize_t i, k
+
+    for k in range(K + 1):
+        wl[k] = wlobs[0]
+    for k in range(K):
+        sse[k] = 0
+
+    for i in range(1, N):
+        for k in range(K + 1):
+            wl[k] = (wl[k] - (rechg[i-1]/Sy[k]) +
+                     _max((B - A*wl[k]/1000) * 1000, 0))
+        for k in range(K):
+            wl_low = _min(wl[k], wl[k+1])
+            wl_high = _max(wl[k], wl[k+1])
+            # Note that the comparisons below are both False for nan values.
+            if wlobs[i] < wl_low:
+                err = wl_low - wlobs[i]
+            elif wlobs[i] > wl_high:
+                err = wlobs[i] - wl_high
+            else:
+                continue
+            if sse[k] <= sse_max:
+                sse[k] += err * err
+                if sse[k] > sse_max:
+                    nalive -= 1
+        if nalive == 0:
+            break
+
+    sse_min = sse[0]
+    for k in range(1, K):
+        sse_min = _min(sse_min, sse[k])
+    return sse_min
+
+
+# ---- Python API
+def calcul_surf_water_budget(ndarray[np.float64_t, ndim=1] ETP,
+                             ndarray[np.float64_t, ndim=1] PTOT,
+                             ndarray[np.float64_t, ndim=1] TAVG,
+                             double TMELT, double CM, double CRU,
+                             double RASmax):
+    """
+    Compute the daily soil surface moisture balance for a single set of
+    model parameters.
+
+    This is a thin wrapper around calcul_surf_water_budget_batch.
+    """
+    cdef int N = len(ETP)
+    cdef ndarray[np.float64_t, ndim=2] RECHG = np.empty((1, N), dtype=DTYPE)
+    cdef ndarray[np.float64_t, ndim=2] RU = np.empty((1, N), dtype=DTYPE)
+    cdef ndarray[np.float64_t, ndim=2] ETR = np.empty((1, N), dtype=DTYPE)
+    cdef ndarray[np.float64_t, ndim=2] RAS = np.empty((1, N), dtype=DTYPE)
+    cdef ndarray[np.float64_t, ndim=2] PACC = np.empty((1, N), dtype=DTYPE)
+
+    calcul_surf_water_budget_batch(
+        ETP, PTOT, TAVG, TMELT, CM,
+        np.array([CRU], dtype=DTYPE), np.array([RASmax], dtype=DTYPE),
+        RECHG, RU, ETR, RAS, PACC, num_threads=1)
+    return RECHG[0], RU[0], ETR[0], RAS[0], PACC[0]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def calcul_surf_water_budget_batch(const double[:] ETP,
+                                   const double[:] PTOT,
+                                   const double[:] TAVG,
+                                   double TMELT, double CM,
+                                   const double[:] CRU,
+                                   const double[:] RASmax,
+                                   double[:, ::1] RECHG,
+                                   double[:, ::1] RU,
+                                   double[:, ::1] ETR,
+                                   double[:, ::1] RAS,
+                                   double[:, ::1] PACC,
+                                   int num_threads=0,
+                                   const double[:] RAS0=None,
+                                   const double[:] PACC0=None):
+    """
+    Compute the daily soil surface moisture balance for a batch of model
+    parameters (CRU[j], RASmax[j]) at once.
+
+    The results are written in the preallocated output buffers, which must
+    be 2D arrays of shape (len(CRU), len(ETP)). Row j of each output buffer
+    contains the results computed for the parameters at index j.
+
+    By default, the readily available storage starts at RASmax and the
+    accumulated precipitation at 0. Other initial states can be provided
+    for each model with RAS0 and PACC0, for instance to continue the
+    water budget from the last day of a previous call.
+
+    The models are distributed over num_threads OpenMP threads, with the
+    GIL released. The number of threads is left to OpenMP when num_threads
+    is 0 or less.
+    """
+    cdef Py_ssize_t N = ETP.shape[0]
+    cdef Py_ssize_t M = CRU.shape[0]
+    if RASmax.shape[0] != M:
+        raise ValueError('CRU and RASmax must have the same length.')
+    if not (RECHG.shape[0] == RU.shape[0] == ETR.shape[0] ==
+            RAS.shape[0] == PACC.shape[0] == M and
+            RECHG.shape[1] == RU.shape[1] == ETR.shape[1] ==
+            RAS.shape[1] == PACC.shape[1] == N):
+        raise ValueError('The shape of the output buffers must be '
+                         '({}, {}).'.format(M, N))
+    if PTOT.shape[0] != N or TAVG.shape[0] != N:
+        raise ValueError('ETP, PTOT and TAVG must have the same length.')
+    if RAS0 is None:
+        RAS0 = RASmax
+    if PACC0 is None:
+        PACC0 = np.zeros(M, dtype=DTYPE)
+    if RAS0.shape[0] != M or PACC0.shape[0] != M:
+        raise ValueError('RAS0 and PACC0 must have the same length as CRU.')
+
+    cdef Py_ssize_t j
+    if num_threads > 0:
+        for j in prange(M, nogil=True, schedule='static',
+                        num_threads=num_threads):
+            _surf_water_budget(ETP, PTOT, TAVG, TMELT, CM, CRU[j], RASmax[j],
+                               RAS0[j], PACC0[j],
+                               RECHG[j], RU[j], ETR[j], RAS[j], PACC[j])
+    else:
+        for j in prange(M, nogil=True, schedule='static'):
+            _surf_water_budget(ETP, PTOT, TAVG, TMELT, CM, CRU[j], RASmax[j],
+                               RAS0[j], PACC0[j],
+                               RECHG[j], RU[j], ETR[j], RAS[j], PACC[j])
+
+
+def calc_hydrograph_forward(const double[:] rechg,
+                            const double[:] wlobs,
+                            double Sy, double A, double B):
+    """
+    Compute a synthetic hydrograph with a forward explicit scheme for a
+    single value of Sy, starting from the first observed water level.
+    """
+    cdef Py_ssize_t N = wlobs.shape[0]
+    if rechg.shape[0] < N - 1:
+        raise ValueError('rechg must contain at least len(wlobs) - 1 values.')
+    wlpre = np.zeros(N, dtype=DTYPE)
+    if N > 0:
+        _hydrograph_forward(rechg, wlobs[0], Sy, A, B, wlpre)
     return wlpre
+
+
+def calc_hydrograph_forward_tl(const double[:] rechg,
+                               const double[:] wlobs,
+                               double Sy, double A, double B):
+    """
+    Compute a synthetic hydrograph with a forward explicit scheme for a
+    single value of Sy, starting from the first observed water level.
+
+    Return the synthetic hydrograph and its analytical derivative with
+    respect to Sy, which are both computed in a single forward sweep.
+    """
+    cdef Py_ssize_t N = wlobs.shape[0]
+    if rechg.shape[0] < N - 1:
+        raise ValueError('rechg must contain at least len(wlobs) - 1 values.')
+    wlpre = np.zeros(N, dtype=DTYPE)
+    dwlpre = np.zeros(N, dtype=DTYPE)
+    if N > 0:
+        _hydrograph_forward_tl(rechg, wlobs[0], Sy, A, B, wlpre, dwlpre)
+    return wlpre, dwlpre
+
+
+def calc_hydrograph_backward(const double[:] rechg,
+                             const double[:] wlobs,
+                             double Sy, double A, double B):
+    """
+    Compute a synthetic hydrograph with a backward explicit scheme for a
+    single value of Sy, going backward in time from the last observed
+    water level.
+    """
+    cdef Py_ssize_t N = wlobs.shape[0]
+    if rechg.shape[0] < N - 1:
+        raise ValueError('rechg must contain at least len(wlobs) - 1 values.')
+    wlpre = np.zeros(N, dtype=DTYPE)
+    if N > 0:
+        _hydrograph_backward(rechg, wlobs[N-1], Sy, A, B, wlpre)
+    return wlpre
+
+
+def calc_hydrograph_cn(const double[:] rechg,
+                       const double[:] wlobs,
+                       double Sy, double A, double B):
+    """
+    Compute a synthetic hydrograph with a Crank-Nicolson scheme for a
+    single value of Sy, starting from the first observed water level.
+    """
+    cdef Py_ssize_t N = wlobs.shape[0]
+    if rechg.shape[0] < N - 1:
+        raise ValueError('rechg must contain at least len(wlobs) - 1 values.')
+    wlpre = np.zeros(N, dtype=DTYPE)
+    if N > 0:
+        _hydrograph_cn(rechg, wlobs[0], Sy, A, B, wlpre)
+    return wlpre
+
+
+def calc_hydrograph_tl(const double[:] rechg,
+                       const double[:] wlobs,
+                       double Sy, double A, double B,
+                       nscheme='forward'):
+    """
+    Compute a synthetic hydrograph with the numerical scheme nscheme
+    ('forward', 'backward' or 'crank-nicolson') for a single value of Sy,
+    starting from the first observed water level, or from the last one
+    with the 'backward' scheme.
+
+    Return the synthetic hydrograph and its analytical derivative with
+    respect to Sy, which are both computed in a single sweep.
+    """
+    cdef int scheme = _get_scheme(nscheme)
+    cdef Py_ssize_t N = wlobs.shape[0]
+    if rechg.shape[0] < N - 1:
+        raise ValueError('rechg must contain at least len(wlobs) - 1 values.')
+    wlpre = np.zeros(N, dtype=DTYPE)
+    dwlpre = np.zeros(N, dtype=DTYPE)
+    if N == 0:
+        return wlpre, dwlpre
+    wl0 = _get_initial_wl(wlobs, scheme)
+    if scheme == SCHEME_BACKWARD:
+        _hydrograph_backward_tl(rechg, wl0, Sy, A, B, wlpre, dwlpre)
+    elif scheme == SCHEME_CN:
+        _hydrograph_cn_tl(rechg, wl0, Sy, A, B, wlpre, dwlpre)
+    else:
+        _hydrograph_forward_tl(rechg, wl0, Sy, A, B, wlpre, dwlpre)
+    return wlpre, dwlpre
+
+
+def calc_hydrograph_sse_bound(const double[:] rechg,
+                              const double[:] wlobs,
+                              double Sy_low, double Sy_high,
+                              double A, double B,
+                              double sse_max=np.inf,
+                              int nintervals=1):
+    """
+    Return a lower bound of the sum of squared errors between the observed
+    water levels and the synthetic hydrographs computed with a forward
+    explicit scheme for any value of Sy between Sy_low and Sy_high.
+
+    The range of Sy is split in nintervals intervals that are evenly
+    spaced in 1/Sy to tighten the bound. The bound is exact when Sy_low
+    equals Sy_high. The computation is abandoned as soon as the bound
+    exceeds sse_max, in which case the partial bound, that is also greater
+    than sse_max, is returned. The bound is only valid for positive
+    recharge values and A <= 1.
+    """
+    cdef Py_ssize_t N = wlobs.shape[0]
+    if rechg.shape[0] < N - 1:
+        raise ValueError('rechg must contain at least len(wlobs) - 1 values.')
+    if nintervals < 1:
+        raise ValueError('nintervals must be greater than 0.')
+    if N == 0:
+        return 0.0
+    Sy = 1 / np.linspace(1 / Sy_low, 1 / Sy_high, nintervals + 1)
+    wl = np.empty(nintervals + 1, dtype=DTYPE)
+    sse = np.empty(nintervals, dtype=DTYPE)
+    return _hydrograph_sse_bound(rechg, wlobs, Sy, A, B, sse_max, wl, sse)
+
+
+def calc_hydrograph_forward_batch(const double[:, :] rechg,
+                                  const double[:] wlobs,
+                                  const double[:] Sy,
+                                  double A, double B,
+                                  double[:, ::1] wlpre,
+                                  int num_threads=0,
+                                  const double[:] wl0=None):
+    """
+    Compute synthetic hydrographs with a forward explicit scheme for a
+    batch of parameter sets (rechg[j], Sy[j]) at once.
+
+    The hydrographs are written in the preallocated output buffer wlpre,
+    which must be a 2D array of shape (len(Sy), len(wlobs)). By default,
+    the hydrographs all start from the first observed water level. Other
+    starting water levels can be provided for each parameter set with wl0.
+
+    The parameter sets are distributed over num_threads OpenMP threads,
+    with the GIL released. The number of threads is left to OpenMP when
+    num_threads is 0 or less.
+    """
+    calc_hydrograph_batch(rechg, wlobs, Sy, A, B, wlpre, num_threads, wl0,
+                          nscheme='forward')
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def calc_hydrograph_batch(const double[:, :] rechg,
+                          const double[:] wlobs,
+                          const double[:] Sy,
+                          double A, double B,
+                          double[:, ::1] wlpre,
+                          int num_threads=0,
+                          const double[:] wl0=None,
+                          nscheme='forward'):
+    """
+    Compute synthetic hydrographs with the numerical scheme nscheme
+    ('forward', 'backward' or 'crank-nicolson') for a batch of parameter
+    sets (rechg[j], Sy[j]) at once.
+
+    This works as calc_hydrograph_forward_batch, except that with the
+    'backward' scheme, the hydrographs are computed backward in time from
+    the last observed water level, or from the values in wl0 if provided.
+    """
+    cdef int scheme = _get_scheme(nscheme)
+    cdef Py_ssize_t N = wlobs.shape[0]
+    cdef Py_ssize_t M = Sy.shape[0]
+    if rechg.shape[0] != M:
+        raise ValueError('rechg and Sy must have the same length.')
+    if rechg.shape[1] < N - 1:
+        raise ValueError('rechg must contain at least len(wlobs) - 1 values.')
+    if wlpre.shape[0] != M or wlpre.shape[1] != N:
+        raise ValueError('The shape of the output buffer must be '
+                         '({}, {}).'.format(M, N))
+    if N == 0:
+        return
+    if wl0 is None:
+        wl0 = np.full(M, _get_initial_wl(wlobs, scheme), dtype=DTYPE)
+    if wl0.shape[0] != M:
+        raise ValueError('wl0 must have the same length as Sy.')
+
+    cdef Py_ssize_t j
+    if num_threads > 0:
+        for j in prange(M, nogil=True, schedule='static',
+                        num_threads=num_threads):
+            _hydrograph(scheme, rechg[j], wl0[j], Sy[j], A, B, wlpre[j])
+    else:
+        for j in prange(M, nogil=True, schedule='static'):
+            _hydrograph(scheme, rechg[j], wl0[j], Sy[j], A, B, wlpre[j])
@@ -8,7 +8,7 @@
 # -----------------------------------------------------------------------------
 
 # ---- Stantard imports
-import time
+import os
 import os.path as osp
 
 # ---- Third party imports
@@ -17,9 +17,10 @@ from PyQt5.QtCore import pyqtSlot as QSlot
 from PyQt5.QtCore import pyqtSignal as QSignal
 from PyQt5.QtWidgets import (
     QWidget, QGridLayout, QPushButton, QProgressBar, QLabel, QScrollArea,
-    QApplication, QMessageBox, QFrame, QCheckBox, QGroupBox)
+    QApplication, QMessageBox, QFrame, QCheckBox, QGroupBox, QComboBox)
 
 # ---- Local imports
+from gwhat.config.main import CONF
 from gwhat.widgets.buttons import ExportDataButton
 from gwhat.common.widgets import QDoubleSpinBox
 from gwhat.gwrecharge.gwrecharge_calc2 import RechgEvalWorker
@@ -50,11 +51,15 @@ class RechgEvalWidget(QFrame):
         # Set the worker and thread mechanics
         self.rechg_worker = RechgEvalWorker()
         self.rechg_worker.sig_glue_finished.connect(self.receive_glue_calcul)
-        self.rechg_worker.sig_glue_progress.connect(self.progressbar.setValue)
+        self.rechg_worker.sig_glue_cancelled.connect(
+            self.receive_glue_cancelled)
+        self.rechg_worker.sig_glue_progress.connect(
+            lambda progress: self.progressbar.setValue(int(progress)))
 
         self.rechg_thread = QThread()
         self.rechg_worker.moveToThread(self.rechg_thread)
         self.rechg_thread.started.connect(self.rechg_worker.eval_recharge)
+        self.rechg_thread.finished.connect(self._handle_glue_thread_finished)
 
     def __initUI__(self):
 
@@ -150,6 +155,52 @@ class RechgEvalWidget(QFrame):
         self.CRO_max.setRange(0, 1)
         self.CRO_max.setToolTip(cro_tooltip)
 
+        # Setup the sampling of the parameters space.
+        sampling_tooltip = (
+            """
+            <b>Sampling Method</b>
+            <p>The method used to sample the (RASmax, Cro) parameters space.
+            With <i>Grid</i>, all the combinations of a regular grid are
+            evaluated. With <i>Sobol</i>, <i>Latin hypercube</i> and
+            <i>Adaptive</i>, the number of models to evaluate is set
+            with the model budget and the models are sampled randomly.
+            The <i>Adaptive</i> method uses half of the model budget to
+            sample the whole parameters space and then refines the
+            sampling where behavioural models were found.</p>
+            """
+            )
+        sampling_label = QLabel('Sampling:')
+        sampling_label.setToolTip(sampling_tooltip)
+
+        self.sampling_cbox = QComboBox()
+        self.sampling_cbox.setToolTip(sampling_tooltip)
+        for method, text in [('grid', 'Grid'),
+                             ('sobol', 'Sobol'),
+                             ('lhs', 'Latin hypercube'),
+                             ('adaptive', 'Adaptive')]:
+            self.sampling_cbox.addItem(text, method)
+        self.sampling_cbox.setCurrentIndex(self.sampling_cbox.findData(
+            CONF.get('recharge', 'glue_sampling', 'grid')))
+
+        budget_tooltip = (
+            """
+            <b>Model Budget</b>
+            <p>The number of models to evaluate when the parameters space
+            is not sampled with a regular grid.</p>
+            """
+            )
+        budget_label = QLabel('Models:')
+        budget_label.setToolTip(budget_tooltip)
+
+        self._model_budget = QDoubleSpinBox(
+            CONF.get('recharge', 'glue_model_budget', 1000), 0)
+        self._model_budget.setRange(1, 999999)
+        self._model_budget.setToolTip(budget_tooltip)
+        self.sampling_cbox.currentIndexChanged.connect(
+            lambda index: self._model_budget.setEnabled(
+                self.sampling_method != 'grid'))
+        self._model_budget.setEnabled(self.sampling_method != 'grid')
+
         # Setup the models parameters space groupbox.
         params_space_group = QGroupBox('Models Parameters Space')
         params_space_layout = QGridLayout(params_space_group)
@@ -170,6 +221,12 @@ class RechgEvalWidget(QFrame):
         params_space_layout.addWidget(self.QSy_min, row, 1)
         params_space_layout.addWidget(sy_range_label2, row, 2)
         params_space_layout.addWidget(self.QSy_max, row, 3)
+        row += 1
+        params_space_layout.addWidget(sampling_label, row, 0)
+        params_space_layout.addWidget(self.sampling_cbox, row, 1, 1, 3)
+        row += 1
+        params_space_layout.addWidget(budget_label, row, 0)
+        params_space_layout.addWidget(self._model_budget, row, 1)
 
         params_space_layout.setColumnStretch(
             params_space_layout.columnCount() + 1, 1)
@@ -291,6 +348,65 @@ class RechgEvalWidget(QFrame):
 
         cutoff_layout.setColumnStretch(cutoff_layout.columnCount() + 1, 1)
 
+        # Setup the number of worker processes.
+        nworkers_tooltip = (
+            """
+            <b>Number of Worker Processes</b>
+            <p>The number of processes that are used to evaluate the models
+            in parallel. The models are evaluated serially in a single
+            process when this is set to 1.</p>
+            """
+            )
+        nworkers_label = QLabel('Workers:')
+        nworkers_label.setToolTip(nworkers_tooltip)
+        self._nworkers = QDoubleSpinBox(
+            CONF.get('recharge', 'glue_nworkers', 1), 0)
+        self._nworkers.setRange(1, os.cpu_count() or 1)
+        self._nworkers.setToolTip(nworkers_tooltip)
+
+        # Setup the GLUE accumulation mode.
+        self.glue_streaming_cbox = QCheckBox('Low memory GLUE')
+        self.glue_streaming_cbox.setChecked(
+            CONF.get('recharge', 'glue_streaming', False))
+        self.glue_streaming_cbox.setToolTip(
+            """
+            <b>Low memory GLUE</b>
+            <p>Keep only the parameters of the behavioural models in memory
+            during the evaluation and compute GLUE afterwards by simulating
+            the behavioural models again by blocks of time. This is slower,
+            but uses much less memory when many models are evaluated over a
+            long period of time.</p>
+            """)
+
+        # Setup the option to keep a table of all the evaluated models.
+        self.glue_retain_models_cbox = QCheckBox('Keep all models')
+        self.glue_retain_models_cbox.setChecked(
+            CONF.get('recharge', 'glue_retain_models', True))
+        self.glue_retain_models_cbox.setToolTip(
+            """
+            <b>Keep all models</b>
+            <p>Save the parameters, Sy and RMSE of all the models that
+            were evaluated with the GLUE results, so that recharge can be
+            computed again for a narrower range of Sy or another RMSE cutoff
+            without having to evaluate all the models again.</p>
+            """)
+
+        # Setup the computation settings group widget.
+        computation_group = QGroupBox('Computation Settings')
+        computation_layout = QGridLayout(computation_group)
+
+        row = 0
+        computation_layout.addWidget(nworkers_label, row, 0)
+        computation_layout.addWidget(self._nworkers, row, 1)
+        row += 1
+        computation_layout.addWidget(self.glue_streaming_cbox, row, 0, 1, 2)
+        row += 1
+        computation_layout.addWidget(
+            self.glue_retain_models_cbox, row, 0, 1, 2)
+
+        computation_layout.setColumnStretch(
+            computation_layout.columnCount() + 1, 1)
+
         # Setup the scroll area.
         scroll_area_widget = QFrame()
         scroll_area_widget.setObjectName("viewport")
@@ -303,12 +419,13 @@ class RechgEvalWidget(QFrame):
         scroll_area_layout.addWidget(params_space_group, 0, 0)
         scroll_area_layout.addWidget(secondary_group, 1, 0)
         scroll_area_layout.addWidget(cutoff_group, 2, 0)
-        scroll_area_layout.setRowStretch(3, 100)
+        scroll_area_layout.addWidget(computation_group, 3, 0)
+        scroll_area_layout.setRowStretch(4, 100)
 
         qtitle = QLabel('Parameter Range')
         qtitle.setAlignment(Qt.AlignCenter)
 
-        scroll_area = QScrollArea()
+        self.scroll_area = scroll_area = QScrollArea()
         scroll_area.setWidget(scroll_area_widget)
         scroll_area.setWidgetResizable(True)
         scroll_area.setFrameStyle(0)
@@ -327,7 +444,7 @@ class RechgEvalWidget(QFrame):
         """Setup the toolbar of the widget. """
         toolbar = QWidget()
 
-        btn_calib = QPushButton('Compute Recharge')
+        self.btn_calib = btn_calib = QPushButton('Compute Recharge')
         btn_calib.clicked.connect(self.btn_calibrate_isClicked)
 
         self.btn_show_result = QToolButtonSmall(get_icon('search'))
@@ -419,12 +536,27 @@ class RechgEvalWidget(QFrame):
     def deltaT(self):
         return self._deltaT.value()
 
+    @property
+    def sampling_method(self):
+        return self.sampling_cbox.currentData()
+
+    @property
+    def model_budget(self):
+        return int(self._model_budget.value())
+
+    @property
+    def nworkers(self):
+        return int(self._nworkers.value())
+
     def btn_calibrate_isClicked(self):
         """
         Handles when the button to compute recharge and its uncertainty is
         clicked.
         """
-        self.start_glue_calcul()
+        if self.rechg_thread.isRunning():
+            self.cancel_glue_calcul()
+        else:
+            self.start_glue_calcul()
 
     def start_glue_calcul(self):
         """
@@ -445,25 +577,91 @@ class RechgEvalWidget(QFrame):
         self.rechg_worker.rmse_cutoff_enabled = int(
             self.rmsecutoff_cbox.isChecked())
 
+        # Set how the models parameters space is sampled.
+        self.rechg_worker.glue_sampling = self.sampling_method
+        self.rechg_worker.glue_model_budget = self.model_budget
+        CONF.set('recharge', 'glue_sampling', self.sampling_method)
+        CONF.set('recharge', 'glue_model_budget', self.model_budget)
+        self.rechg_worker.glue_traversal = CONF.get(
+            'recharge', 'glue_traversal', 'rowmajor')
+
+        # Set the number of processes used to evaluate the models.
+        self.rechg_worker.nworkers = self.nworkers
+        CONF.set('recharge', 'glue_nworkers', self.nworkers)
+
+        # Set how the results of the behavioural models are accumulated.
+        glue_streaming = self.glue_streaming_cbox.isChecked()
+        self.rechg_worker.glue_accumulator = (
+            'streaming' if glue_streaming else 'memory')
+        CONF.set('recharge', 'glue_streaming', glue_streaming)
+
+        # Set the table of the models that were evaluated to produce the last
+        # GLUE results, so that the behavioural models are selected from it
+        # instead of evaluating all the models again when possible.
+        retain_models = self.glue_retain_models_cbox.isChecked()
+        self.rechg_worker.retain_models_table = retain_models
+        CONF.set('recharge', 'glue_retain_models', retain_models)
+        gluedf = self.wldset.get_glue_at(-1)
+        try:
+            self.rechg_worker.models_table = gluedf['models table']
+        except (KeyError, TypeError):
+            self.rechg_worker.models_table = None
+
         # Set the data and check for errors.
         error = self.rechg_worker.load_data(self.wxdset, self.wldset)
         if error is not None:
             QMessageBox.warning(self, 'Warning', error, QMessageBox.Ok)
             return
 
+        # Use the GLUE results that were previously saved in the project
+        # for the same inputs, if any.
+        idnum = self.wldset.find_glue(self.rechg_worker.get_inputs_key())
+        if idnum is not None:
+            print('GLUE results loaded from the project.')
+            idnum = self.wldset.set_glue_as_latest(idnum)
+            self._set_new_gluedf(self.wldset.get_glue(idnum))
+            return
+
         # Start the computation of groundwater recharge.
-        self.setEnabled(False)
-        self.progressbar.show()
-
-        waittime = 0
-        while self.rechg_thread.isRunning():
-            time.sleep(0.1)
-            waittime += 0.1
-            if waittime > 15:
-                print('Impossible to quit the thread.')
-                return
+        self._set_computing(True)
         self.rechg_thread.start()
 
+    def cancel_glue_calcul(self):
+        """
+        Request the cancellation of the computation of ground-water recharge
+        that is currently running.
+        """
+        self.btn_calib.setEnabled(False)
+        self.btn_calib.setText('Cancelling...')
+        self.rechg_worker.cancel()
+
+    def receive_glue_cancelled(self):
+        """
+        Handle when the computation of ground-water recharge was cancelled.
+        """
+        self.rechg_thread.quit()
+
+    def _handle_glue_thread_finished(self):
+        """
+        Handle when the thread in which ground-water recharge was computed
+        is finished.
+        """
+        self._set_computing(False)
+
+    def _set_computing(self, computing):
+        """
+        Set the state of the widget depending on whether ground-water
+        recharge is being computed or not.
+        """
+        self.scroll_area.setEnabled(not computing)
+        self.btn_show_result.setEnabled(not computing)
+        self.btn_save_glue.setEnabled(
+            not computing and self.btn_save_glue.model is not None)
+        self.btn_calib.setEnabled(True)
+        self.btn_calib.setText('Cancel' if computing else 'Compute Recharge')
+        self.progressbar.setValue(0)
+        self.progressbar.setVisible(computing)
+
     def receive_glue_calcul(self, glue_dataframe):
         """
         Handle the plotting of the results once ground-water recharge has
@@ -480,17 +678,26 @@ class RechgEvalWidget(QFrame):
                    " behaviour of the observed hydrograph.")
             QMessageBox.warning(self, 'Warning', msg, QMessageBox.Ok)
         else:
-            self.wldset.clear_glue()
-            self.wldset.save_glue(glue_dataframe)
-            self.sig_new_gluedf.emit(glue_dataframe)
-
-            self.btn_save_glue.set_model(glue_dataframe)
-            self.figstack.set_gluedf(glue_dataframe)
-        self.progressbar.hide()
-        self.setEnabled(True)
+            # We keep the results of the last runs in the project, so that
+            # they do not need to be computed again for the same inputs.
+            with self.wldset.transaction():
+                self.wldset.save_glue(glue_dataframe)
+                self.wldset.clear_glue(
+                    keep=CONF.get('recharge', 'glue_cache_size', 5))
+            self._set_new_gluedf(glue_dataframe)
+
+    def _set_new_gluedf(self, gluedf):
+        """Set the new GLUE results to display."""
+        self.sig_new_gluedf.emit(gluedf)
+        self.btn_save_glue.set_model(gluedf)
+        self.figstack.set_gluedf(gluedf)
 
     def close(self):
         """Extend Qt method to close child windows."""
+        if self.rechg_thread.isRunning():
+            self.rechg_worker.cancel()
+            self.rechg_thread.quit()
+            self.rechg_thread.wait()
         self.figstack.close()
         super().close()
 
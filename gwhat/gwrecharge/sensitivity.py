@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+"""
+Global sensitivity analysis of the groundwater recharge model to its
+parameters with the Sobol and Morris methods.
+"""
+
+# ---- Standard imports
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+# ---- Third party imports
+import numpy as np
+from scipy.stats import qmc
+
+# ---- Local imports
+from gwhat.utils.math import calcul_rmse
+from gwhat.gwrecharge.gwrecharge_calc2 import RechgEvalWorker
+from gwhat.gwrecharge.gwrecharge_calculs import (
+    calcul_surf_water_budget, calc_hydrograph_forward)
+
+# The parameters of the recharge model whose influence is assessed.
+SENSITIVITY_PARAMS = ['Cro', 'RASmax', 'Sy', 'TMELT', 'CM', 'deltat']
+
+# The outputs of the recharge model whose sensitivity is assessed.
+SENSITIVITY_OUTPUTS = ['annual recharge', 'RMSE']
+
+
+class RechgSensitivityAnalysis(object):
+    """
+    Assess how strongly the mean annual recharge and the RMSE of the
+    synthetic hydrograph depend on the parameters of the recharge model.
+
+    With the 'sobol' method, the first-order (S1) and total-order (ST)
+    Sobol indices of each parameter are estimated with the Saltelli and
+    Jansen estimators from nsamples * (nparams + 2) models, where nsamples
+    is rounded up to the next power of two, along with
+    the half-width of their bootstrap 95% confidence interval. With the
+    'morris' method, the mean (mu), mean of the absolute values (mu_star)
+    and standard deviation (sigma) of the elementary effects of each
+    parameter are computed from nsamples trajectories of nparams + 1
+    models on a grid of morris_levels levels. The elementary effects are
+    expressed for a change of the parameter over its whole range.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ETP, self.PTOT, self.TAVG = [], [], []
+        self.wlobs = []
+        self.A, self.B = None, None
+
+        # The index of the day of the first observed water level in the
+        # weather data when no lag is applied.
+        self.ts = None
+
+        # The ranges of values of the parameters. The deltat values are
+        # rounded to the nearest day.
+        self.ranges = {'Cro': (0.1, 0.3),
+                       'RASmax': (5, 40),
+                       'Sy': (0.05, 0.2),
+                       'TMELT': (-2, 2),
+                       'CM': (2, 6),
+                       'deltat': (0, 5)}
+
+        self.method = 'sobol'
+        self.nsamples = 1024
+        self.morris_levels = 4
+        self.nbootstrap = 100
+        self.seed = None
+
+        # The number of processes used to evaluate the models. Models are
+        # evaluated serially in the current process when this is 1.
+        self.nworkers = 1
+
+    def load_data(self, wxdset, wldset):
+        """
+        Load the weather and water level data and the MRC used to
+        evaluate the models. Return an error message if the data cannot
+        be used to compute recharge, or None otherwise.
+        """
+        rechg_worker = RechgEvalWorker()
+        rechg_worker.deltat = 0
+        error = rechg_worker.load_data(wxdset, wldset)
+        if error is not None:
+            return error
+        self.ETP = rechg_worker.ETP.astype(float)
+        self.PTOT = rechg_worker.PTOT.astype(float)
+        self.TAVG = rechg_worker.TAVG.astype(float)
+        self.wlobs = rechg_worker.wlobs * 1000
+        self.A, self.B = rechg_worker.A, rechg_worker.B
+        self.ts = int(np.where(
+            rechg_worker.twlvl[0] == rechg_worker.tweatr)[0][0])
+        return None
+
+    # ---- Sampling
+    def _get_bounds(self):
+        """Return the lower and upper bounds of the parameters."""
+        lower = [min(self.ranges[name]) for name in SENSITIVITY_PARAMS]
+        upper = [max(self.ranges[name]) for name in SENSITIVITY_PARAMS]
+        return np.array(lower, dtype=float), np.array(upper, dtype=float)
+
+    def produce_sobol_samples(self):
+        """
+        Return the nsamples x nparams matrices A and B sampled with a
+        scrambled Sobol sequence in the unit hypercube, and the matrices
+        AB where the column of each parameter in A is replaced by the one
+        in B, stacked in a (nparams, nsamples, nparams) array.
+
+        The number of samples is rounded up to the next power of two,
+        since the balance properties of the Sobol sequence on which the
+        Saltelli estimator relies are lost when it is truncated.
+        """
+        k = len(SENSITIVITY_PARAMS)
+        sampler = qmc.Sobol(d=2 * k, scramble=True, seed=self.seed)
+        samples = sampler.random_base2(
+            int(np.ceil(np.log2(max(self.nsamples, 2)))))
+        A, B = samples[:, :k], samples[:, k:]
+        AB = np.repeat(A[np.newaxis, :, :], k, axis=0)
+        for i in range(k):
+            AB[i, :, i] = B[:, i]
+        return A, B, AB
+
+    def produce_morris_trajectories(self):
+        """
+        Return nsamples trajectories of nparams + 1 points in the unit
+        hypercube, stacked in a (nsamples, nparams + 1, nparams) array,
+        where a single parameter is changed by delta from one point to the
+        next, along with the index of the parameter changed at each step
+        and delta.
+        """
+        k = len(SENSITIVITY_PARAMS)
+        p = self.morris_levels
+        delta = p / (2 * (p - 1))
+        rng = np.random.default_rng(self.seed)
+
+        trajectories = np.empty((self.nsamples, k + 1, k))
+        orders = np.empty((self.nsamples, k), dtype=int)
+        for r in range(self.nsamples):
+            x = rng.integers(0, p, k) / (p - 1)
+            orders[r] = rng.permutation(k)
+            trajectories[r, 0] = x
+            for step, i in enumerate(orders[r]):
+                x = x.copy()
+                x[i] = x[i] + delta if x[i] + delta <= 1 else x[i] - delta
+                trajectories[r, step + 1] = x
+        return trajectories, orders, delta
+
+    # ---- Models evaluation
+    def _get_state(self):
+        """
+        Return a picklable dict with the data that are required to
+        evaluate models in a separate process.
+        """
+        return {key: getattr(self, key) for key in
+                ['ETP', 'PTOT', 'TAVG', 'wlobs', 'A', 'B', 'ts']}
+
+    def eval_models(self, samples):
+        """
+        Evaluate the models for the parameter sets in samples, a 2D array
+        of shape (n, nparams) with the parameters in the order of
+        SENSITIVITY_PARAMS, and return the mean annual recharge in mm and
+        the RMSE of the synthetic hydrograph in mm of each model in a 2D
+        array of shape (n, noutputs).
+        """
+        samples = np.asarray(samples, dtype=float)
+        lags = np.round(samples[:, SENSITIVITY_PARAMS.index('deltat')])
+        if len(lags) and (
+                self.ts - lags.max() < 0 or
+                self.ts - lags.min() + len(self.wlobs) - 1 > len(self.ETP)):
+            raise ValueError('The range of deltat exceeds the period '
+                             'covered by the weather data.')
+
+        if self.nworkers <= 1 or len(samples) < 2 * self.nworkers:
+            return _eval_samples(self._get_state(), samples)
+        chunks = np.array_split(samples, self.nworkers)
+        with ProcessPoolExecutor(
+                max_workers=self.nworkers,
+                mp_context=multiprocessing.get_context('spawn')
+                ) as executor:
+            results = list(executor.map(
+                _eval_samples, [self._get_state()] * len(chunks), chunks))
+        return np.vstack(results)
+
+    # ---- Analysis
+    def run(self):
+        """
+        Run the sensitivity analysis with the selected method and return
+        the results in a dict that can be saved in the project.
+        """
+        lower, upper = self._get_bounds()
+        k = len(SENSITIVITY_PARAMS)
+        if self.method == 'sobol':
+            A, B, AB = self.produce_sobol_samples()
+            N = len(A)
+            unit_samples = np.vstack([A, B, AB.reshape(k * N, k)])
+            outputs = self.eval_models(lower + unit_samples * (upper - lower))
+            nmodels = len(outputs)
+            indices = {}
+            for j, name in enumerate(SENSITIVITY_OUTPUTS):
+                fA = outputs[:N, j]
+                fB = outputs[N:2 * N, j]
+                fAB = outputs[2 * N:, j].reshape(k, N)
+                indices[name] = calcul_sobol_indices(
+                    fA, fB, fAB, self.nbootstrap, self.seed)
+        elif self.method == 'morris':
+            trajectories, orders, _ = self.produce_morris_trajectories()
+            R = len(trajectories)
+            outputs = self.eval_models(
+                lower + trajectories.reshape(R * (k + 1), k) * (upper - lower))
+            nmodels = len(outputs)
+            outputs = outputs.reshape(R, k + 1, len(SENSITIVITY_OUTPUTS))
+            indices = {}
+            for j, name in enumerate(SENSITIVITY_OUTPUTS):
+                indices[name] = calcul_morris_indices(
+                    trajectories, orders, outputs[:, :, j])
+        else:
+            raise ValueError("Unknown sensitivity analysis method '{}'."
+                             .format(self.method))
+
+        return {'method': self.method,
+                'params': SENSITIVITY_PARAMS,
+                'outputs': SENSITIVITY_OUTPUTS,
+                'ranges': {name: self.ranges[name] for
+                           name in SENSITIVITY_PARAMS},
+                'nsamples': self.nsamples,
+                'nmodels': nmodels,
+                'indices': indices}
+
+
+def calcul_sobol_indices(fA, fB, fAB, nbootstrap=100, seed=None):
+    """
+    Return the first-order (S1) and total-order (ST) Sobol indices that are
+    estimated from the outputs of the models evaluated with the sample
+    matrices A and B and with the matrices AB of each parameter, along
+    with the half-width of their bootstrap 95% confidence interval.
+    """
+    def estimate(idx):
+        f = np.concatenate((fA[idx], fB[idx]))
+        variance = np.var(f)
+        if variance == 0:
+            nan = np.full(len(fAB), np.nan)
+            return nan, nan
+        # The outputs of B are centered to reduce the variance of the
+        # estimator of the first-order indices.
+        S1 = np.mean((fB[idx] - np.mean(f)) * (fAB[:, idx] - fA[idx]),
+                     axis=1) / variance
+        ST = 0.5 * np.mean((fA[idx] - fAB[:, idx])**2, axis=1) / variance
+        return S1, ST
+
+    N = len(fA)
+    S1, ST = estimate(np.arange(N))
+    rng = np.random.default_rng(seed)
+    S1_boot, ST_boot = zip(*[
+        estimate(rng.integers(0, N, N)) for i in range(nbootstrap)])
+    return {'S1': S1, 'ST': ST,
+            'S1 conf': 1.96 * np.std(S1_boot, axis=0),
+            'ST conf': 1.96 * np.std(ST_boot, axis=0)}
+
+
+def calcul_morris_indices(trajectories, orders, outputs):
+    """
+    Return the mean (mu), mean of the absolute values (mu_star) and
+    standard deviation (sigma) of the elementary effects of each parameter
+    that are computed from the outputs of the models evaluated along the
+    Morris trajectories.
+    """
+    R, k = orders.shape
+    effects = np.empty((R, k))
+    for r in range(R):
+        for step, i in enumerate(orders[r]):
+            dx = trajectories[r, step + 1, i] - trajectories[r, step, i]
+            effects[r, i] = (outputs[r, step + 1] - outputs[r, step]) / dx
+    return {'mu': np.mean(effects, axis=0),
+            'mu_star': np.mean(np.abs(effects), axis=0),
+            'sigma': np.std(effects, axis=0, ddof=1 if R > 1 else 0)}
+
+
+def _eval_samples(state, samples):
+    """
+    Evaluate the models for the parameter sets in samples with the data
+    in state and return the mean annual recharge and the RMSE of the
+    synthetic hydrograph of each model.
+
+    This is also the function that is run by the worker processes when
+    the models are evaluated in parallel.
+    """
+    ETP, PTOT, TAVG = state['ETP'], state['PTOT'], state['TAVG']
+    wlobs = state['wlobs']
+    nonan_indx = np.where(~np.isnan(wlobs))[0]
+    outputs = np.empty((len(samples), len(SENSITIVITY_OUTPUTS)))
+    for j, (cro, rasmax, sy, tmelt, cm, deltat) in enumerate(samples):
+        rechg, _, _, _, _ = calcul_surf_water_budget(
+            ETP, PTOT, TAVG, tmelt, cm, cro, rasmax)
+
+        # The fluxes are not computed for the last day of the series.
+        outputs[j, 0] = np.mean(rechg[:-1]) * 365.25
+
+        # The lag is applied by aligning the observed water levels with
+        # the recharge of deltat days earlier.
+        ts = state['ts'] - int(round(deltat))
+        wlpre = calc_hydrograph_forward(
+            rechg[ts:], wlobs, sy, state['A'], state['B'])
+        outputs[j, 1] = calcul_rmse(wlobs[nonan_indx], wlpre[nonan_indx])
+    return outputs
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+# ---- Standard library imports
+import os
+import pickle
+
+# ---- Third party imports
+import numpy as np
+import pytest
+
+# ---- Local library imports
+from gwhat.gwrecharge.gwrecharge_batch import (
+    WXDatasetSnapshot, WLDatasetSnapshot, DEFAULT_SETTINGS,
+    get_closest_wxdset_name, get_glue_settings, eval_wldset_recharge,
+    format_summary, run_project_recharge, run_project_sensitivity)
+from gwhat.gwrecharge.__main__ import get_parser
+from gwhat.gwrecharge.tests.test_gwrecharge_calc import (
+    SyntheticWXDataFrame, SyntheticWLDataset, TRUE_CRU, TRUE_RASMAX,
+    MRC_A, MRC_B)
+from gwhat.projet.reader_projet import ProjetReader
+
+
+class WLDatasetWithGlue(SyntheticWLDataset):
+    """A synthetic water level dataset with previous GLUE results."""
+
+    def __init__(self, wxdset, gluedf=None):
+        super().__init__(wxdset)
+        self.gluedf = gluedf
+
+    def get_glue_at(self, index):
+        return self.gluedf
+
+
+class ProjectWithWeather(object):
+    """A project that contains only weather datasets."""
+
+    def __init__(self, stations):
+        self.stations = stations
+
+    @property
+    def wxdsets(self):
+        return list(self.stations.keys())
+
+    def get_wxdsets_lat(self):
+        return [lat for lat, lon in self.stations.values()]
+
+    def get_wxdsets_lon(self):
+        return [lon for lat, lon in self.stations.values()]
+
+
+# =============================================================================
+# ---- Fixtures
+# =============================================================================
+@pytest.fixture(scope='module')
+def wxdset():
+    return SyntheticWXDataFrame()
+
+
+@pytest.fixture(scope='module')
+def wldset(wxdset):
+    return WLDatasetWithGlue(wxdset)
+
+
+@pytest.fixture
+def projectpath(tmp_path):
+    """
+    A project with two water level datasets, each produced from the data
+    of the weather station that is the closest to its well, and a third
+    weather station that is far from both wells.
+    """
+    filename = str(tmp_path / 'project_test_batch.gwt')
+    project = ProjetReader(filename)
+    stations = {'station1': (45, -73, 0), 'station2': (46, -72, 1),
+                'station3': (50, -60, 2)}
+    for name, (lat, lon, seed) in stations.items():
+        wxdset = SyntheticWXDataFrame(seed=seed)
+        wxdset.metadata.update({'Station Name': name, 'Latitude': lat,
+                                'Longitude': lon})
+        project.add_wxdset(name, wxdset)
+
+        if name == 'station3':
+            continue
+        # The water levels are observed from the 31st day of the weather
+        # data, so that time lags can be applied in the sensitivity
+        # analysis.
+        wldset = SyntheticWLDataset(wxdset)
+        wlname = name.replace('station', 'well')
+        wldset.update({'Well': wlname, 'Latitude': lat + 0.01,
+                       'Longitude': lon + 0.01, 'filename': '',
+                       'Time': wxdset.data.index[30:],
+                       'WL': wldset['WL'][30:],
+                       'BP': np.zeros(len(wxdset.data) - 30),
+                       'ET': np.zeros(len(wxdset.data) - 30)})
+        project.add_wldset(wlname, wldset)
+        project.get_wldset(wlname).set_mrc(
+            MRC_A, MRC_B, [], [], [], 0, 1, 0)
+    project.close()
+    return filename
+
+
+# =============================================================================
+# ---- Tests
+# =============================================================================
+def test_datasets_snapshot(wxdset, wldset):
+    """
+    Test that the in-memory copies of the datasets can be pickled and
+    contain the data that are required to evaluate GLUE.
+    """
+    wxsnapshot = pickle.loads(pickle.dumps(WXDatasetSnapshot(wxdset)))
+    assert wxsnapshot.data.equals(wxdset.data)
+    assert wxsnapshot.metadata == wxdset.metadata
+    assert np.array_equal(wxsnapshot.get_xldates(), wxdset.get_xldates())
+
+    wlsnapshot = pickle.loads(pickle.dumps(WLDatasetSnapshot(wldset)))
+    assert wlsnapshot['Well'] == wldset['Well']
+    assert np.array_equal(wlsnapshot['WL'], wldset['WL'])
+    assert np.array_equal(wlsnapshot.xldates, wldset.xldates)
+    assert wlsnapshot.get_mrc()['params'] == tuple(wldset.get_mrc()['params'])
+
+
+def test_eval_wldset_recharge(wxdset, wldset):
+    """
+    Test that GLUE is evaluated correctly from the snapshots of the
+    datasets.
+    """
+    settings = get_glue_settings(
+        wldset, Cro=(0.15, 0.25), RASmax=(30, 50), glue_pardist_res='rough')
+    gluedf, elapsed = eval_wldset_recharge(
+        WXDatasetSnapshot(wxdset), WLDatasetSnapshot(wldset), settings)
+    assert elapsed > 0
+    assert gluedf['count'] > 0
+    assert gluedf['wlinfo']['Well'] == wldset['Well']
+
+    best = np.argmin(gluedf['RMSE'])
+    assert gluedf['params']['Cru'][best] == pytest.approx(TRUE_CRU)
+    assert gluedf['params']['RASmax'][best] == pytest.approx(TRUE_RASMAX)
+
+    summary = format_summary([{'wldset': 'well', 'wxdset': 'station',
+                               'status': 'computed', 'count': gluedf['count'],
+                               'time': elapsed}])
+    assert summary[1][:4] == ['well', 'station', 'computed', gluedf['count']]
+
+
+def test_get_glue_settings(wxdset):
+    """
+    Test that the GLUE settings are taken from the last GLUE results saved
+    for the water level dataset and overridden by those that are passed.
+    """
+    wldset = WLDatasetWithGlue(wxdset)
+    assert get_glue_settings(wldset) == DEFAULT_SETTINGS
+
+    wldset.gluedf = {
+        'ranges': {'Sy': [0.1, 0.3], 'Cro': [0.2, 0.4], 'RASmax': [10, 60]},
+        'params': {'tmelt': -1, 'CM': 3, 'deltat': 2},
+        'cutoff': {'rmse_cutoff': 50, 'rmse_cutoff_enabled': 1}}
+    settings = get_glue_settings(wldset, Sy=(0.01, 0.1), CM=None)
+    assert settings['Sy'] == (0.01, 0.1)
+    assert settings['Cro'] == (0.2, 0.4)
+    assert settings['RASmax'] == (10, 60)
+    assert settings['TMELT'] == -1
+    assert settings['CM'] == 3
+    assert settings['deltat'] == 2
+    assert settings['rmse_cutoff'] == 50
+    assert settings['rmse_cutoff_enabled'] == 1
+
+
+def test_get_closest_wxdset_name(wldset):
+    """
+    Test that the weather dataset of the closest station is paired with
+    the water level dataset.
+    """
+    assert get_closest_wxdset_name(ProjectWithWeather({}), wldset) is None
+
+    project = ProjectWithWeather({
+        'far': (48, -70), 'close': (45.1, -73.1), 'farther': (40, -80)})
+    assert get_closest_wxdset_name(project, wldset) == 'close'
+
+
+def test_run_project_recharge(projectpath):
+    """
+    Test that GLUE is evaluated for all the water level datasets of a
+    project across a pool of processes, that the results are saved in the
+    project and that they are loaded from the project afterwards instead
+    of being computed again.
+    """
+    settings = {'Cro': (0.15, 0.25), 'RASmax': (30, 50),
+                'glue_pardist_res': 'rough', 'glue_sampling': 'grid'}
+    summary = run_project_recharge(
+        projectpath, ['well1', 'well2', 'well3'], nprocesses=2, **settings)
+    assert [item['wldset'] for item in summary] == ['well1', 'well2', 'well3']
+    assert [item['wxdset'] for item in summary] == [
+        'station1', 'station2', None]
+    assert [item['status'] for item in summary] == [
+        'computed', 'computed', 'water level dataset not found']
+    assert summary[0]['count'] > 0 and summary[1]['count'] > 0
+    assert summary[0]['time'] > 0 and summary[1]['time'] > 0
+
+    project = ProjetReader(projectpath)
+    try:
+        for item in summary[:2]:
+            wldset = project.get_wldset(item['wldset'])
+            assert wldset.glue_count() == 1
+            gluedf = wldset.get_glue_at(-1)
+            assert gluedf['count'] == item['count']
+            assert gluedf['ranges']['Cro'].tolist() == [0.15, 0.25]
+
+            best = np.argmin(gluedf['RMSE'])
+            assert gluedf['params']['Cru'][best] == pytest.approx(TRUE_CRU)
+            assert gluedf['params']['RASmax'][best] == pytest.approx(
+                TRUE_RASMAX)
+    finally:
+        project.close()
+
+    # The results saved in the project must be reused when GLUE is
+    # evaluated again with the same inputs.
+    summary2 = run_project_recharge(projectpath, nprocesses=2, **settings)
+    assert [item['status'] for item in summary2] == [
+        'loaded from project', 'loaded from project']
+    assert [item['count'] for item in summary2] == [
+        item['count'] for item in summary[:2]]
+
+    project = ProjetReader(projectpath)
+    try:
+        for name in ['well1', 'well2']:
+            assert project.get_wldset(name).glue_count() == 1
+    finally:
+        project.close()
+
+
+def test_run_project_sensitivity(projectpath):
+    """
+    Test that the sensitivity analysis of the recharge model is run for
+    the water level datasets of a project and that the results are saved
+    in the project.
+    """
+    summary = run_project_sensitivity(
+        projectpath, ['well1'], nprocesses=2, nsamples=16, nbootstrap=10,
+        seed=0)
+    assert len(summary) == 1
+    assert summary[0]['wxdset'] == 'station1'
+    assert summary[0]['status'] == 'computed'
+    assert summary[0]['count'] > 0
+
+    project = ProjetReader(projectpath)
+    try:
+        results = project.get_wldset('well1').get_sensitivity('sobol')
+        assert results is not None
+        assert results['nmodels'] == summary[0]['count']
+        assert project.get_wldset('well2').get_sensitivity('sobol') is None
+    finally:
+        project.close()
+
+
+def test_command_line_parser():
+    """Test that the command line arguments are parsed correctly."""
+    args = get_parser().parse_args(
+        ['run', 'project.gwt', '--wells', 'well1', 'well2',
+         '--processes', '2', '--sampling', 'lhs', '--sy', '0.01', '0.1',
+         '--rmse-cutoff', '50', '--deltat-sweep', '0', '5', '10',
+         '--traversal', 'serpentine', '--append'])
+    assert args.command == 'run'
+    assert args.filename == 'project.gwt'
+    assert args.wells == ['well1', 'well2']
+    assert args.processes == 2
+    assert args.sampling == 'lhs'
+    assert args.Sy == [0.01, 0.1]
+    assert args.Cro is None
+    assert args.rmse_cutoff == 50
+    assert args.deltat_sweep == [0, 5, 10]
+    assert args.traversal == 'serpentine'
+    assert args.append is True
+
+    args = get_parser().parse_args(
+        ['sensitivity', 'project.gwt', '--method', 'morris',
+         '--samples', '16'])
+    assert args.command == 'sensitivity'
+    assert args.method == 'morris'
+    assert args.samples == 16
+    assert args.seed is None
+
+
+if __name__ == "__main__":
+    pytest.main(['-x', os.path.basename(__file__), '-v', '-rw'])
@@ -0,0 +1,1014 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+# ---- Standard library imports
+import copy
+import os
+from itertools import product
+from collections import namedtuple
+
+# ---- Third party imports
+import numpy as np
+import pandas as pd
+import pytest
+
+# ---- Local library imports
+from gwhat.meteo.weather_reader import WXDataFrameBase
+from gwhat.utils.dates import datetimeindex_to_xldates
+from gwhat.gwrecharge.gwrecharge_calc2 import RechgEvalWorker
+from gwhat.gwrecharge.glue import (
+    GLUEDataFrame, calcul_mly_budget, calcul_yrly_budget,
+    calcul_hydro_yrly_budget, calcul_glue_quantiles)
+from gwhat.gwrecharge.gwrecharge_calculs import (
+    calcul_surf_water_budget, calcul_surf_water_budget_batch,
+    calc_hydrograph_forward, calc_hydrograph_forward_batch,
+    calc_hydrograph_forward_tl, calc_hydrograph_sse_bound,
+    calc_hydrograph_backward, calc_hydrograph_cn, calc_hydrograph_tl,
+    calc_hydrograph_batch)
+
+# The parameters that are used to produce the synthetic hydrograph.
+TRUE_CRU = 0.2
+TRUE_RASMAX = 40
+TRUE_SY = 0.1
+MRC_A = 0.001
+MRC_B = 0.003
+
+
+# =============================================================================
+# ---- Synthetic datasets
+# =============================================================================
+class SyntheticWXDataFrame(WXDataFrameBase):
+    """A daily weather dataset produced from a random generator."""
+
+    def __init__(self, nyears=4, seed=0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__load_dataset__(nyears, seed)
+
+    def __getitem__(self, key):
+        raise NotImplementedError
+
+    def __setitem__(self, key, value):
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.data)
+
+    def __load_dataset__(self, nyears, seed):
+        rng = np.random.RandomState(seed)
+        index = pd.date_range(
+            '2010-01-01', '{}-12-31'.format(2010 + nyears - 1), freq='D')
+        ndays = len(index)
+        doy = index.dayofyear.values
+        tavg = 6 - 15 * np.cos(2 * np.pi * doy / 365.25) + rng.normal(
+            0, 3, ndays)
+        ptot = rng.gamma(0.4, 6, ndays)
+        rain = np.where(tavg > 0, ptot, 0)
+        self.data = pd.DataFrame(
+            {'Tmax': tavg + 5, 'Tmin': tavg - 5, 'Tavg': tavg,
+             'Ptot': ptot, 'Rain': rain, 'Snow': ptot - rain,
+             'PET': np.clip(2 - 2 * np.cos(2 * np.pi * doy / 365.25),
+                            0, None)},
+            index=index)
+        self.metadata['Station Name'] = 'Synthetic'
+        self.metadata['Station ID'] = '0000000'
+
+
+class SyntheticWLDataset(dict):
+    """
+    A water level dataset produced with the recharge model from
+    synthetic weather data.
+    """
+
+    def __init__(self, wxdset):
+        super().__init__()
+        self.update({'Well': 'Synthetic', 'Well ID': '0000000',
+                     'Province': 'QC', 'Latitude': 45, 'Longitude': -73,
+                     'Elevation': 0, 'Municipality': ''})
+        rechg, _, _, _, _ = calcul_surf_water_budget(
+            wxdset.data['PET'].values, wxdset.data['Ptot'].values,
+            wxdset.data['Tavg'].values, 0, 4, TRUE_CRU, TRUE_RASMAX)
+        wlobs = np.zeros(len(rechg)) * np.nan
+        wlobs[0] = 3000
+        wlobs = calc_hydrograph_forward(rechg, wlobs, TRUE_SY, MRC_A, MRC_B)
+        self.xldates = datetimeindex_to_xldates(wxdset.data.index)
+        self['WL'] = wlobs / 1000
+
+    def get_mrc(self):
+        return {'params': namedtuple('Coeffs', ['A', 'B'])(MRC_A, MRC_B),
+                'peak_indx': [], 'time': np.array([]),
+                'recess': np.array([])}
+
+
+class DelayedWLDataset(SyntheticWLDataset):
+    """
+    A synthetic water level dataset whose water levels respond to the
+    recharge with a delay of deltat days.
+    """
+
+    def __init__(self, wxdset, deltat):
+        super().__init__(wxdset)
+        self.xldates = self.xldates + deltat
+
+
+class CheckpointWLDataset(SyntheticWLDataset):
+    """
+    A synthetic water level dataset that keeps the GLUE checkpoints in
+    memory in the same way they are saved in the project hdf file.
+    """
+
+    def __init__(self, wxdset):
+        super().__init__(wxdset)
+        self.checkpoint = None
+
+    def save_glue_checkpoint(self, key, data):
+        if self.checkpoint is None or self.checkpoint['key'] != key:
+            self.checkpoint = {'key': key}
+        for name, values in data.items():
+            if np.ndim(values) == 0 or name not in self.checkpoint:
+                self.checkpoint[name] = values
+            else:
+                self.checkpoint[name] = np.concatenate(
+                    (self.checkpoint[name], values))
+
+    def get_glue_checkpoint(self, key):
+        if self.checkpoint is None or self.checkpoint['key'] != key:
+            return None
+        return {k: v for k, v in self.checkpoint.items() if k != 'key'}
+
+    def del_glue_checkpoint(self):
+        self.checkpoint = None
+
+
+# =============================================================================
+# ---- Fixtures
+# =============================================================================
+@pytest.fixture(scope='module')
+def wxdset():
+    return SyntheticWXDataFrame()
+
+
+@pytest.fixture(scope='module')
+def wldset(wxdset):
+    return SyntheticWLDataset(wxdset)
+
+
+@pytest.fixture
+def rechg_worker(wxdset, wldset):
+    rechg_worker = RechgEvalWorker()
+    rechg_worker.Sy = (0.05, 0.2)
+    rechg_worker.Cro = (0.15, 0.25)
+    rechg_worker.RASmax = (30, 50)
+    rechg_worker.glue_pardist_res = 'rough'
+    rechg_worker.TMELT = 0
+    rechg_worker.CM = 4
+    rechg_worker.deltat = 0
+    assert rechg_worker.load_data(wxdset, wldset) is None
+    return rechg_worker
+
+
+# =============================================================================
+# ---- Tests
+# =============================================================================
+def test_surf_water_budget_batch(wxdset):
+    """
+    Test that the results of the batch surface water budget kernel are
+    identical to those obtained one set of parameters at a time.
+    """
+    ETP = wxdset.data['PET'].values
+    PTOT = wxdset.data['Ptot'].values
+    TAVG = wxdset.data['Tavg'].values
+    CRU = np.array([0, 0.1, 0.25, 0.5])
+    RASMAX = np.array([0, 20, 45, 150], dtype=float)
+
+    buffers = tuple(np.empty((len(CRU), len(ETP))) for i in range(5))
+    calcul_surf_water_budget_batch(
+        ETP, PTOT, TAVG, 0, 4, CRU, RASMAX, *buffers)
+    for j in range(len(CRU)):
+        expected = calcul_surf_water_budget(
+            ETP, PTOT, TAVG, 0, 4, CRU[j], RASMAX[j])
+        for result, buffer in zip(expected, buffers):
+            assert np.array_equal(result, buffer[j])
+
+    with pytest.raises(ValueError):
+        calcul_surf_water_budget_batch(
+            ETP, PTOT, TAVG, 0, 4, CRU, RASMAX[:-1], *buffers)
+
+
+@pytest.mark.parametrize('num_threads', [0, 1, 2])
+def test_hydrograph_forward_batch(wxdset, wldset, num_threads):
+    """
+    Test that the results of the batch forward hydrograph kernel are
+    identical to those obtained one set of parameters at a time.
+    """
+    ETP = wxdset.data['PET'].values
+    PTOT = wxdset.data['Ptot'].values
+    TAVG = wxdset.data['Tavg'].values
+    CRU = np.array([0, 0.1, 0.25, 0.5])
+    RASMAX = np.array([0, 20, 45, 150], dtype=float)
+    SY = np.array([0.05, 0.1, 0.15, 0.2])
+    wlobs = wldset['WL'] * 1000
+
+    buffers = tuple(np.empty((len(CRU), len(ETP))) for i in range(5))
+    calcul_surf_water_budget_batch(
+        ETP, PTOT, TAVG, 0, 4, CRU, RASMAX, *buffers,
+        num_threads=num_threads)
+    rechg = buffers[0]
+
+    wlpre = np.empty((len(SY), len(wlobs)))
+    calc_hydrograph_forward_batch(
+        rechg, wlobs, SY, MRC_A, MRC_B, wlpre, num_threads=num_threads)
+    for j in range(len(SY)):
+        expected = calc_hydrograph_forward(
+            rechg[j], wlobs, SY[j], MRC_A, MRC_B)
+        assert np.array_equal(expected, wlpre[j])
+
+    with pytest.raises(ValueError):
+        calc_hydrograph_forward_batch(
+            rechg, wlobs, SY[:-1], MRC_A, MRC_B, wlpre)
+
+
+def test_hydrograph_forward_tl(wxdset, wldset):
+    """
+    Test that the tangent-linear hydrograph kernel returns the same
+    hydrograph as the forward kernel and a derivative with respect to Sy
+    that matches a centered finite difference approximation.
+    """
+    rechg, _, _, _, _ = calcul_surf_water_budget(
+        wxdset.data['PET'].values, wxdset.data['Ptot'].values,
+        wxdset.data['Tavg'].values, 0, 4, 0.15, 30)
+    wlobs = wldset['WL'] * 1000
+    for Sy in [0.05, 0.1, 0.3]:
+        wlpre, dwlpre = calc_hydrograph_forward_tl(
+            rechg, wlobs, Sy, MRC_A, MRC_B)
+        assert np.array_equal(
+            wlpre, calc_hydrograph_forward(rechg, wlobs, Sy, MRC_A, MRC_B))
+
+        eps = 1e-7
+        dwlpre_fd = (
+            calc_hydrograph_forward(rechg, wlobs, Sy + eps, MRC_A, MRC_B) -
+            calc_hydrograph_forward(rechg, wlobs, Sy - eps, MRC_A, MRC_B)
+            ) / (2 * eps)
+        assert np.allclose(dwlpre, dwlpre_fd, rtol=1e-5,
+                           atol=1e-6 * np.max(np.abs(dwlpre)))
+
+
+@pytest.mark.parametrize('nintervals', [1, 8])
+def test_hydrograph_sse_bound(wxdset, wldset, nintervals):
+    """
+    Test that the sum of squared errors of the hydrographs computed with
+    values of Sy within a range is never below the lower bound computed for
+    that range, and that the computation of the bound is abandoned once it
+    exceeds the maximum value provided.
+    """
+    rechg, _, _, _, _ = calcul_surf_water_budget(
+        wxdset.data['PET'].values, wxdset.data['Ptot'].values,
+        wxdset.data['Tavg'].values, 0, 4, 0.15, 30)
+    wlobs = wldset['WL'] * 1000
+    wlobs[1::7] = np.nan
+
+    def calc_sse(Sy):
+        wlpre = calc_hydrograph_forward(rechg, wlobs, Sy, MRC_A, MRC_B)
+        return np.nansum((wlobs - wlpre)**2)
+
+    sse_bound = calc_hydrograph_sse_bound(
+        rechg, wlobs, 0.3, 0.5, MRC_A, MRC_B, nintervals=nintervals)
+    sse_min = min(calc_sse(Sy) for Sy in np.linspace(0.3, 0.5, 41))
+    assert 0 < sse_bound <= sse_min
+
+    # The bound must be exact when the range is reduced to a single value.
+    assert calc_hydrograph_sse_bound(
+        rechg, wlobs, 0.1, 0.1, MRC_A, MRC_B, nintervals=nintervals
+        ) == pytest.approx(calc_sse(0.1))
+
+    # The bound must be greater than sse_max when abandoned.
+    sse_max = sse_bound / 10
+    assert calc_hydrograph_sse_bound(
+        rechg, wlobs, 0.3, 0.5, MRC_A, MRC_B, sse_max, nintervals
+        ) > sse_max
+
+
+def test_hydrograph_schemes(wxdset, wldset):
+    """
+    Test that the backward and Crank-Nicolson hydrograph kernels produce
+    the same results as a direct implementation of these schemes.
+    """
+    rechg, _, _, _, _ = calcul_surf_water_budget(
+        wxdset.data['PET'].values, wxdset.data['Ptot'].values,
+        wxdset.data['Tavg'].values, 0, 4, 0.15, 30)
+    wlobs = wldset['WL'] * 1000
+    N = len(wlobs)
+    for Sy, A, B in [(0.1, MRC_A, MRC_B), (0.2, 0.01, 0.05)]:
+        def recess(wl):
+            return max((B - A * wl / 1000) * 1000, 0)
+
+        expected = np.empty(N)
+        expected[-1] = wlobs[-1]
+        for i in reversed(range(N - 1)):
+            expected[i] = expected[i+1] + rechg[i] / Sy - recess(expected[i+1])
+        assert np.allclose(
+            calc_hydrograph_backward(rechg, wlobs, Sy, A, B), expected)
+
+        # The implicit equation of the Crank-Nicolson scheme must be
+        # satisfied at each time step.
+        wlpre = calc_hydrograph_cn(rechg, wlobs, Sy, A, B)
+        assert wlpre[0] == wlobs[0]
+        residuals = [
+            wlpre[i+1] - wlpre[i] + rechg[i] / Sy -
+            (recess(wlpre[i]) + recess(wlpre[i+1])) / 2 for
+            i in range(N - 1)]
+        assert np.allclose(residuals, 0, atol=1e-9)
+
+
+@pytest.mark.parametrize('nscheme', ['forward', 'backward', 'crank-nicolson'])
+def test_hydrograph_tl_and_batch(wxdset, wldset, nscheme):
+    """
+    Test that the tangent-linear and batch hydrograph kernels return the
+    same hydrographs as the single kernel of each numerical scheme, and a
+    derivative with respect to Sy that matches a centered finite
+    difference approximation.
+    """
+    calc_hydrograph = {'forward': calc_hydrograph_forward,
+                       'backward': calc_hydrograph_backward,
+                       'crank-nicolson': calc_hydrograph_cn}[nscheme]
+    rechg, _, _, _, _ = calcul_surf_water_budget(
+        wxdset.data['PET'].values, wxdset.data['Ptot'].values,
+        wxdset.data['Tavg'].values, 0, 4, 0.15, 30)
+    wlobs = wldset['WL'] * 1000
+    A, B = 0.01, 0.05
+    SY = np.array([0.05, 0.1, 0.3])
+    wlpre_batch = np.empty((len(SY), len(wlobs)))
+    calc_hydrograph_batch(np.tile(rechg, (len(SY), 1)), wlobs, SY, A, B,
+                          wlpre_batch, nscheme=nscheme)
+    for j, Sy in enumerate(SY):
+        expected = calc_hydrograph(rechg, wlobs, Sy, A, B)
+        assert np.array_equal(wlpre_batch[j], expected)
+
+        wlpre, dwlpre = calc_hydrograph_tl(rechg, wlobs, Sy, A, B, nscheme)
+        assert np.allclose(wlpre, expected, rtol=1e-12)
+
+        eps = 1e-7
+        dwlpre_fd = (calc_hydrograph(rechg, wlobs, Sy + eps, A, B) -
+                     calc_hydrograph(rechg, wlobs, Sy - eps, A, B)
+                     ) / (2 * eps)
+        assert np.allclose(dwlpre, dwlpre_fd, rtol=1e-5,
+                           atol=1e-6 * np.max(np.abs(dwlpre)))
+
+    with pytest.raises(ValueError):
+        calc_hydrograph_tl(rechg, wlobs, 0.1, A, B, 'unknown')
+
+
+def test_optimize_specific_yield(rechg_worker, wxdset):
+    """
+    Test that the optimization of the specific yield converges to the value
+    used to produce the synthetic hydrograph, whatever the initial guess.
+    """
+    rechg, _, _, _, _ = rechg_worker.surf_water_budget(TRUE_CRU, TRUE_RASMAX)
+    for Sy0 in [0.01, 0.1, 0.5]:
+        Sy, RMSE, wlpre, niter = rechg_worker.optimize_specific_yield(
+            Sy0, rechg_worker.wlobs * 1000, rechg)
+        assert Sy == pytest.approx(TRUE_SY, abs=0.0001)
+        assert RMSE < 1
+        assert len(wlpre) == len(rechg_worker.wlobs)
+        assert 1 < niter < 100
+
+
+def test_eval_recharge(rechg_worker):
+    """
+    Test that the GLUE results computed by the recharge worker are
+    consistent with the parameters used to produce the synthetic hydrograph.
+    """
+    gluedf = rechg_worker.eval_recharge()
+    assert gluedf['count'] > 0
+    assert len(gluedf['RMSE']) == gluedf['count']
+
+    best = np.argmin(gluedf['RMSE'])
+    assert gluedf['params']['Cru'][best] == pytest.approx(TRUE_CRU)
+    assert gluedf['params']['RASmax'][best] == pytest.approx(TRUE_RASMAX)
+    assert gluedf['params']['Sy'][best] == pytest.approx(TRUE_SY, abs=0.001)
+
+
+def test_eval_recharge_parallel(rechg_worker):
+    """
+    Test that evaluating the models across a pool of processes produces the
+    same behavioural models, in the same order, as the serial evaluation,
+    regardless of the number of processes.
+    """
+    # We use small chunks, so that the models are split in several chunks.
+    rechg_worker.chunk_size = 10
+    rechg_worker.nworkers = 1
+    gluedf_serial = rechg_worker.eval_recharge()
+    niter_serial = rechg_worker.niter.copy()
+
+    for nworkers in [2, 3]:
+        rechg_worker.nworkers = nworkers
+        progress = []
+        rechg_worker.sig_glue_progress.connect(progress.append)
+        gluedf_parallel = rechg_worker.eval_recharge()
+        rechg_worker.sig_glue_progress.disconnect()
+
+        assert gluedf_parallel['count'] == gluedf_serial['count']
+        for key in ['Cru', 'RASmax', 'Sy']:
+            assert np.array_equal(gluedf_parallel['params'][key],
+                                  gluedf_serial['params'][key])
+        assert np.array_equal(gluedf_parallel['RMSE'], gluedf_serial['RMSE'])
+        assert np.array_equal(rechg_worker.niter, niter_serial)
+        assert progress[0] == 0
+        assert progress[-1] == pytest.approx(100)
+
+
+def test_eval_recharge_rmse_cutoff(rechg_worker):
+    """
+    Test that the models that are rejected before optimizing Sy when the
+    RMSE cutoff is enabled are not behavioural.
+    """
+    gluedf = rechg_worker.eval_recharge()
+    rmse_cutoff = np.median(gluedf['RMSE'])
+    expected = gluedf['RMSE'] <= rmse_cutoff
+    assert 0 < np.sum(expected) < gluedf['count']
+
+    rechg_worker.rmse_cutoff = rmse_cutoff
+    rechg_worker.rmse_cutoff_enabled = 1
+    gluedf_cutoff = rechg_worker.eval_recharge()
+    assert gluedf_cutoff['count'] == np.sum(expected)
+    for key in ['Cru', 'RASmax']:
+        assert np.array_equal(gluedf_cutoff['params'][key],
+                              gluedf['params'][key][expected])
+    assert np.allclose(gluedf_cutoff['RMSE'], gluedf['RMSE'][expected],
+                       rtol=0.01)
+
+
+@pytest.mark.parametrize('glue_traversal', ['serpentine', 'hilbert'])
+def test_get_traversal_order(rechg_worker, glue_traversal):
+    """
+    Test that the traversal orders keep neighbouring parameter combinations
+    of a grid adjacent.
+    """
+    rechg_worker.glue_traversal = glue_traversal
+    params = list(product(range(8), range(8)))
+    order = rechg_worker.get_traversal_order(params)
+    assert sorted(order) == list(range(64))
+    steps = np.abs(np.diff(np.array(params)[order], axis=0))
+    assert np.all(np.sum(steps, axis=1) == 1)
+
+    rechg_worker.glue_sampling = 'sobol'
+    params = rechg_worker.produce_params_samples(100, seed=0)
+    order = rechg_worker.get_traversal_order(params)
+    assert sorted(order) == list(range(100))
+
+    rechg_worker.glue_traversal = 'rowmajor'
+    assert np.array_equal(
+        rechg_worker.get_traversal_order(params), np.arange(100))
+
+
+def test_eval_recharge_niter(rechg_worker):
+    """
+    Test that the number of iterations required to optimize Sy is recorded
+    for each model and that the serpentine traversal of the parameter
+    space requires less iterations than the row-major traversal.
+    """
+    U_RAS, U_Cro = rechg_worker.produce_params_combinations()
+    nparams = len(U_RAS) * len(U_Cro)
+    assert rechg_worker.glue_traversal == 'rowmajor'
+    rechg_worker.eval_recharge()
+    niter_rowmajor = rechg_worker.niter
+    assert len(niter_rowmajor) == nparams
+    assert np.all(niter_rowmajor > 0)
+
+    rechg_worker.glue_traversal = 'serpentine'
+    rechg_worker.eval_recharge()
+    assert len(rechg_worker.niter) == nparams
+    assert np.sum(rechg_worker.niter) <= np.sum(niter_rowmajor)
+
+
+@pytest.mark.parametrize('glue_stream_memory', [2**12, 2**26])
+def test_eval_recharge_streaming(rechg_worker, glue_stream_memory):
+    """
+    Test that the GLUE results computed in the 'streaming' accumulation mode
+    are the same as those computed when the time series of all the
+    behavioural models are kept in memory.
+    """
+    rechg_worker.glue_accumulator = 'memory'
+    gluedf_memory = rechg_worker.eval_recharge()
+
+    rechg_worker.glue_accumulator = 'streaming'
+    rechg_worker.glue_stream_memory = glue_stream_memory
+    gluedf_streaming = rechg_worker.eval_recharge()
+
+    assert gluedf_streaming['count'] == gluedf_memory['count']
+    assert np.array_equal(gluedf_streaming['RMSE'], gluedf_memory['RMSE'])
+    for var in ['recharge', 'evapo', 'runoff']:
+        assert np.allclose(gluedf_streaming['daily budget'][var],
+                           gluedf_memory['daily budget'][var])
+        assert np.allclose(gluedf_streaming['yearly budget'][var],
+                           gluedf_memory['yearly budget'][var])
+    assert np.allclose(gluedf_streaming['water levels']['predicted'],
+                       gluedf_memory['water levels']['predicted'])
+
+
+
+@pytest.mark.parametrize('nscheme', ['backward', 'crank-nicolson'])
+def test_eval_recharge_nscheme(rechg_worker, nscheme):
+    """
+    Test that the behavioural models are evaluated with the hydrograph
+    scheme selected in the recharge worker.
+    """
+    rechg_worker.nscheme = nscheme
+    gluedf = rechg_worker.eval_recharge()
+    assert gluedf['count'] > 0
+
+    # The RMSE of the best model must be that of the hydrograph computed
+    # with the selected scheme.
+    best = np.argmin(gluedf['RMSE'])
+    rechg, _, _, _, _ = rechg_worker.surf_water_budget(
+        gluedf['params']['Cru'][best], gluedf['params']['RASmax'][best])
+    ts = np.where(rechg_worker.twlvl[0] == rechg_worker.tweatr)[0][0]
+    wlpre = rechg_worker.calc_hydrograph(
+        rechg[ts:], gluedf['params']['Sy'][best])
+    assert gluedf['RMSE'][best] == pytest.approx(np.sqrt(np.mean(
+        (rechg_worker.wlobs * 1000 - wlpre[:len(rechg_worker.wlobs)])**2)))
+
+    # The scheme must be part of the key of the inputs.
+    key = rechg_worker.get_inputs_key()
+    rechg_worker.nscheme = 'forward'
+    assert rechg_worker.get_inputs_key() != key
+
+    if nscheme == 'crank-nicolson':
+        rechg_worker.nscheme = nscheme
+        rechg_worker.glue_accumulator = 'streaming'
+        gluedf_streaming = rechg_worker.eval_recharge()
+        assert np.allclose(gluedf_streaming['water levels']['predicted'],
+                           gluedf['water levels']['predicted'])
+    else:
+        rechg_worker.nscheme = nscheme
+        rechg_worker.glue_accumulator = 'streaming'
+        with pytest.raises(ValueError):
+            rechg_worker.eval_recharge()
+
+
+@pytest.mark.parametrize('glue_sampling', ['sobol', 'lhs'])
+def test_produce_params_samples(rechg_worker, glue_sampling):
+    """
+    Test that the parameter samples respect the model budget and the
+    parameter ranges, and that they are reproducible for a given seed.
+    """
+    rechg_worker.glue_sampling = glue_sampling
+    params = rechg_worker.produce_params_samples(100, seed=0)
+    assert len(params) == 100
+    params = np.array(params)
+    assert np.all((params[:, 0] >= 0.15) & (params[:, 0] <= 0.25))
+    assert np.all((params[:, 1] >= 30) & (params[:, 1] <= 50))
+    assert np.array_equal(
+        params, rechg_worker.produce_params_samples(100, seed=0))
+
+    params = np.array(rechg_worker.produce_params_samples(
+        100, bounds=[(0.18, 0.2), (35, 40)], seed=0))
+    assert np.all((params[:, 0] >= 0.18) & (params[:, 0] <= 0.2))
+    assert np.all((params[:, 1] >= 35) & (params[:, 1] <= 40))
+
+
+@pytest.mark.parametrize('glue_sampling', ['sobol', 'lhs', 'adaptive'])
+def test_eval_recharge_sampling(rechg_worker, glue_sampling):
+    """
+    Test that the models sampled with a model budget are evaluated
+    correctly and that the progress is reported over the whole budget.
+    """
+    rechg_worker.glue_sampling = glue_sampling
+    rechg_worker.glue_model_budget = 40
+    rechg_worker.sampling_seed = 0
+    rechg_worker.rmse_cutoff = 50
+    rechg_worker.rmse_cutoff_enabled = 1
+    progress = []
+    rechg_worker.sig_glue_progress.connect(progress.append)
+
+    gluedf = rechg_worker.eval_recharge()
+    assert 0 < gluedf['count'] <= 40
+    assert np.all(gluedf['RMSE'] <= 50)
+    assert np.all((gluedf['params']['Cru'] >= 0.15) &
+                  (gluedf['params']['Cru'] <= 0.25))
+    assert np.all((gluedf['params']['RASmax'] >= 30) &
+                  (gluedf['params']['RASmax'] <= 50))
+    assert progress[0] == 0
+    assert progress[-1] == pytest.approx(100)
+    assert np.all(np.diff(progress) >= 0)
+
+
+@pytest.mark.parametrize('glue_sampling', ['grid', 'adaptive'])
+def test_eval_recharge_resume(rechg_worker, wxdset, glue_sampling):
+    """
+    Test that an interrupted evaluation of the models is resumed from its
+    last checkpoint and produces the same results as an evaluation that
+    was not interrupted.
+    """
+    rechg_worker.glue_sampling = glue_sampling
+    rechg_worker.glue_model_budget = 40
+    rechg_worker.sampling_seed = 0
+    rechg_worker.batch_size = 4
+    rechg_worker.checkpoint_interval = 0
+    expected_gluedf = rechg_worker.eval_recharge()
+    expected_niter = rechg_worker.niter
+
+    wldset = CheckpointWLDataset(wxdset)
+    rechg_worker.load_data(wxdset, wldset)
+
+    # Interrupt the evaluation of the models after 25 optimizations of Sy.
+    optimize_specific_yield = rechg_worker.optimize_specific_yield
+    ncalls = []
+    maxcalls = [25]
+
+    def interrupted_optimize_specific_yield(*args, **kwargs):
+        ncalls.append(1)
+        if len(ncalls) > maxcalls[0]:
+            raise RuntimeError('Interrupted')
+        return optimize_specific_yield(*args, **kwargs)
+    rechg_worker.optimize_specific_yield = interrupted_optimize_specific_yield
+    with pytest.raises(RuntimeError):
+        rechg_worker.eval_recharge()
+    assert wldset.checkpoint is not None
+    assert wldset.checkpoint['ndone'] == 24
+
+    # Resume the evaluation of the models from the checkpoint.
+    ncalls.clear()
+    maxcalls[0] = np.inf
+    gluedf = rechg_worker.eval_recharge()
+    assert len(ncalls) == len(expected_niter) - 24
+    assert wldset.checkpoint is None
+    assert gluedf['count'] == expected_gluedf['count']
+    assert np.array_equal(gluedf['RMSE'], expected_gluedf['RMSE'])
+    assert np.array_equal(gluedf['params']['Sy'],
+                          expected_gluedf['params']['Sy'])
+    assert np.array_equal(rechg_worker.niter, expected_niter)
+    assert np.allclose(gluedf['daily budget']['recharge'],
+                       expected_gluedf['daily budget']['recharge'])
+
+
+def test_eval_recharge_cancel(rechg_worker, wxdset):
+    """
+    Test that the evaluation of the models is stopped at the end of the
+    current batch of models when it is cancelled, that its progress is
+    saved in a checkpoint and that it can be resumed afterwards.
+    """
+    wldset = CheckpointWLDataset(wxdset)
+    rechg_worker.load_data(wxdset, wldset)
+    rechg_worker.batch_size = 4
+    rechg_worker.progress_interval = 0
+    rechg_worker.checkpoint_interval = 3600
+
+    cancelled = []
+    finished = []
+    rechg_worker.sig_glue_cancelled.connect(lambda: cancelled.append(True))
+    rechg_worker.sig_glue_finished.connect(finished.append)
+    rechg_worker.sig_glue_progress.connect(
+        lambda progress: progress > 0 and rechg_worker.cancel())
+
+    assert rechg_worker.eval_recharge() is None
+    assert cancelled == [True]
+    assert finished == []
+    assert wldset.checkpoint['ndone'] == 4
+    assert len(wldset.checkpoint['niter']) == 4
+
+    # Make sure the computation can be resumed from where it was cancelled.
+    rechg_worker.sig_glue_progress.disconnect()
+    gluedf = rechg_worker.eval_recharge()
+    assert len(finished) == 1 and finished[0] is gluedf
+    assert gluedf['count'] > 0
+    assert wldset.checkpoint is None
+
+
+def test_eval_recharge_parallel_cancel(rechg_worker):
+    """
+    Test that the evaluation of the models across a pool of processes is
+    stopped when it is cancelled and that the pool is shut down without
+    waiting for the chunks of models that are still running.
+    """
+    rechg_worker.nworkers = 2
+    rechg_worker.progress_interval = 0
+
+    cancelled = []
+    rechg_worker.sig_glue_cancelled.connect(lambda: cancelled.append(True))
+    rechg_worker.sig_glue_progress.connect(
+        lambda progress: progress > 0 and rechg_worker.cancel())
+
+    assert rechg_worker.eval_recharge() is None
+    assert cancelled == [True]
+
+
+def test_eval_recharge_progress_throttling(rechg_worker):
+    """
+    Test that the progress of the evaluation of the models is emitted at
+    most once per progress_interval, except when it starts and ends.
+    """
+    progress = []
+    rechg_worker.sig_glue_progress.connect(progress.append)
+
+    rechg_worker.progress_interval = 3600
+    rechg_worker.eval_recharge()
+    assert progress == [0, 100]
+
+    progress.clear()
+    rechg_worker.progress_interval = 0
+    rechg_worker.eval_recharge()
+    assert len(progress) == len(rechg_worker.niter) + 1
+    assert progress[-1] == pytest.approx(100)
+
+
+@pytest.mark.parametrize('glue_accumulator', ['memory', 'streaming'])
+def test_eval_recharge_refilter(rechg_worker, glue_accumulator):
+    """
+    Test that the behavioural models selected from the table of all the
+    models that were evaluated previously with a new Sy range and RMSE
+    cutoff are the same as those produced by evaluating all the models
+    again.
+    """
+    rechg_worker.glue_accumulator = glue_accumulator
+    rechg_worker.retain_models_table = True
+    gluedf = rechg_worker.eval_recharge()
+    models_table = gluedf['models table']
+    assert len(models_table['Sy']) == len(rechg_worker.niter)
+    assert np.array_equal(np.sort(models_table['RMSE'][
+        np.isin(models_table['Sy'], gluedf['params']['Sy'])]),
+        np.sort(gluedf['RMSE']))
+
+    # Select the behavioural models with a narrower Sy range and an
+    # RMSE cutoff.
+    rechg_worker.Sy = (0.09, 0.11)
+    rechg_worker.rmse_cutoff = 30
+    rechg_worker.rmse_cutoff_enabled = 1
+    expected_gluedf = rechg_worker.eval_recharge()
+
+    rechg_worker.models_table = models_table
+    assert rechg_worker.can_refilter_models_table(models_table)
+    refiltered_gluedf = rechg_worker.eval_recharge()
+    assert np.all(rechg_worker.niter == 0)
+    assert 0 < refiltered_gluedf['count'] < gluedf['count']
+    assert refiltered_gluedf['count'] == expected_gluedf['count']
+    assert np.allclose(refiltered_gluedf['RMSE'], expected_gluedf['RMSE'])
+    assert np.allclose(refiltered_gluedf['params']['Sy'],
+                       expected_gluedf['params']['Sy'])
+    assert np.allclose(refiltered_gluedf['daily budget']['recharge'],
+                       expected_gluedf['daily budget']['recharge'])
+    assert np.allclose(refiltered_gluedf['water levels']['predicted'],
+                       expected_gluedf['water levels']['predicted'])
+
+    # Make sure the results are the same when the behavioural models are
+    # all simulated again.
+    rechg_worker._last_models = None
+    refiltered_gluedf = rechg_worker.eval_recharge()
+    assert np.allclose(refiltered_gluedf['daily budget']['recharge'],
+                       expected_gluedf['daily budget']['recharge'])
+    assert np.allclose(refiltered_gluedf['water levels']['predicted'],
+                       expected_gluedf['water levels']['predicted'])
+
+    # Models that cannot meet the RMSE cutoff are rejected without
+    # optimizing Sy, so the table of the models produced with an RMSE
+    # cutoff cannot be used with a higher one.
+    models_table = expected_gluedf['models table']
+    assert rechg_worker.can_refilter_models_table(models_table)
+    rechg_worker.rmse_cutoff = 40
+    assert not rechg_worker.can_refilter_models_table(models_table)
+    rechg_worker.rmse_cutoff = 30
+    rechg_worker.Sy = (0.05, 0.11)
+    assert not rechg_worker.can_refilter_models_table(models_table)
+
+    # The table cannot be used either if the models are different.
+    rechg_worker.Sy = (0.09, 0.11)
+    rechg_worker.RASmax = (30, 45)
+    assert not rechg_worker.can_refilter_models_table(models_table)
+
+
+def test_eval_recharge_deltat_sweep(rechg_worker, wxdset):
+    """
+    Test that the time lag with which the water levels respond to the
+    recharge is found when several lags are evaluated in a single sweep and
+    that the results of each lag are the same as those obtained when
+    evaluating this lag alone.
+    """
+    wldset = DelayedWLDataset(wxdset, 3)
+    rechg_worker.deltat_sweep = [6, 0, 3]
+    assert rechg_worker.load_data(wxdset, wldset) is None
+    gluedf = rechg_worker.eval_recharge()
+    assert list(gluedf['lags']['deltat']) == [0, 3, 6]
+    assert gluedf['lags']['best deltat'] == 3
+    assert gluedf['params']['deltat'] == 3
+    assert np.argmin(gluedf['lags']['RMSE']) == 1
+    assert gluedf['count'] == gluedf['lags']['count'][1]
+
+    best = np.argmin(gluedf['RMSE'])
+    assert gluedf['RMSE'][best] == pytest.approx(
+        gluedf['lags']['RMSE'][1])
+    assert gluedf['params']['Cru'][best] == pytest.approx(TRUE_CRU)
+    assert gluedf['params']['RASmax'][best] == pytest.approx(TRUE_RASMAX)
+    assert gluedf['params']['Sy'][best] == pytest.approx(TRUE_SY, abs=0.001)
+
+    # The lags must give the same results when evaluated alone.
+    rechg_worker.deltat_sweep = [3]
+    assert rechg_worker.load_data(wxdset, wldset) is None
+    gluedf_sweep = rechg_worker.eval_recharge()
+    rechg_worker.deltat_sweep = None
+    rechg_worker.deltat = 3
+    assert rechg_worker.load_data(wxdset, wldset) is None
+    gluedf_single = rechg_worker.eval_recharge()
+    assert 'lags' not in gluedf_single
+    assert gluedf_sweep['count'] == gluedf_single['count']
+    assert np.allclose(gluedf_sweep['RMSE'], gluedf_single['RMSE'])
+    assert np.allclose(gluedf_sweep['params']['Sy'],
+                       gluedf_single['params']['Sy'])
+    assert np.allclose(gluedf_sweep['daily budget']['recharge'],
+                       gluedf_single['daily budget']['recharge'])
+    assert np.allclose(gluedf_sweep['water levels']['predicted'],
+                       gluedf_single['water levels']['predicted'])
+
+    # The lags must give the same results when swept in parallel.
+    rechg_worker.deltat_sweep = [0, 3, 6]
+    assert rechg_worker.load_data(wxdset, wldset) is None
+    rechg_worker.chunk_size = 10
+    gluedf = rechg_worker.eval_recharge()
+    rechg_worker.nworkers = 2
+    gluedf_parallel = rechg_worker.eval_recharge()
+    assert np.array_equal(gluedf_parallel['lags']['count'],
+                          gluedf['lags']['count'])
+    assert np.array_equal(gluedf_parallel['RMSE'], gluedf['RMSE'])
+    assert np.array_equal(gluedf_parallel['params']['Sy'],
+                          gluedf['params']['Sy'])
+    rechg_worker.nworkers = 1
+
+    # The adaptive sampling cannot be used to sweep the lags.
+    rechg_worker.glue_sampling = 'adaptive'
+    with pytest.raises(ValueError):
+        rechg_worker.eval_recharge()
+
+
+@pytest.mark.parametrize('deltat', [0, 2])
+def test_append_recharge(rechg_worker, wxdset, deltat):
+    """
+    Test that continuing the GLUE results over the days of data that were
+    appended to the datasets gives the same results as simulating the
+    behavioural models over the whole period.
+    """
+    prev_wxdset = copy.copy(wxdset)
+    prev_wxdset.data = wxdset.data.iloc[:-100]
+    rechg_worker.deltat = deltat
+    assert rechg_worker.load_data(
+        prev_wxdset, DelayedWLDataset(prev_wxdset, deltat)) is None
+    prev_gluedf = rechg_worker.eval_recharge()
+    assert len(prev_gluedf['end state']['RAS']) == prev_gluedf['count']
+
+    assert rechg_worker.load_data(
+        wxdset, DelayedWLDataset(wxdset, deltat)) is None
+    gluedf = rechg_worker.append_recharge(prev_gluedf)
+    assert gluedf['count'] == prev_gluedf['count']
+    assert np.array_equal(gluedf['RMSE'], prev_gluedf['RMSE'])
+    assert np.array_equal(gluedf['water levels']['time'], rechg_worker.twlvl)
+    assert len(gluedf['daily budget']['time']) == len(wxdset.data) + deltat
+
+    # Simulate the behavioural models over the whole period.
+    params = prev_gluedf['params']
+    M, N = prev_gluedf['count'], len(wxdset.data)
+    rechg, ru, etr, ras, pacc = (np.empty((M, N)) for i in range(5))
+    calcul_surf_water_budget_batch(
+        wxdset.data['PET'].values, wxdset.data['Ptot'].values,
+        wxdset.data['Tavg'].values, 0, 4, params['Cru'].astype(float),
+        params['RASmax'].astype(float), rechg, ru, etr, ras, pacc)
+    ts = np.where(rechg_worker.twlvl[0] == rechg_worker.tweatr)[0][0]
+    te = np.where(rechg_worker.twlvl[-1] == rechg_worker.tweatr)[0][0]
+    wlobs = rechg_worker.wlobs * 1000
+    wlpre = np.empty((M, len(wlobs)))
+    calc_hydrograph_batch(
+        rechg[:, ts:te], wlobs, params['Sy'], MRC_A, MRC_B, wlpre)
+
+    glue_limits = GLUEDataFrame.GLUE_LIMITS
+    for var, values in [('recharge', rechg), ('evapo', etr), ('runoff', ru)]:
+        expected = calcul_glue_quantiles(values, gluedf['RMSE'], glue_limits)
+        dly_values = gluedf['daily budget'][var]
+        dly_values = dly_values[deltat:] if var == 'recharge' else (
+            dly_values[:N])
+        assert np.allclose(dly_values, expected)
+    assert np.allclose(
+        gluedf['water levels']['predicted'],
+        calcul_glue_quantiles(wlpre, gluedf['RMSE'], [0.05, 0.5, 0.95]))
+    assert np.allclose(gluedf['end state']['RAS'], ras[:, te])
+    assert np.allclose(gluedf['end state']['PACC'], pacc[:, te])
+    assert np.allclose(gluedf['end state']['wl'], wlpre[:, -1])
+
+    # The results cannot be continued without the end state of the models
+    # nor with another time lag.
+    store = {key: value for key, value in prev_gluedf.store.items() if
+             key != 'end state'}
+    with pytest.raises(ValueError):
+        rechg_worker.append_recharge(store)
+    rechg_worker.deltat = deltat + 1
+    assert rechg_worker.load_data(
+        wxdset, DelayedWLDataset(wxdset, deltat)) is None
+    with pytest.raises(ValueError):
+        rechg_worker.append_recharge(prev_gluedf)
+
+
+def test_get_inputs_key(rechg_worker):
+    """
+    Test that the key of the inputs used to produce GLUE results changes
+    only when the inputs that affect these results are changed.
+    """
+    key = rechg_worker.get_inputs_key()
+    models_key = rechg_worker.get_inputs_key(filters=False)
+    assert rechg_worker.eval_recharge()['inputs key'] == key
+
+    rechg_worker.glue_accumulator = 'streaming'
+    assert rechg_worker.get_inputs_key() == key
+
+    rechg_worker.rmse_cutoff_enabled = 1
+    assert rechg_worker.get_inputs_key() != key
+    assert rechg_worker.get_inputs_key(filters=False) == models_key
+
+    for attr, value in [('CM', 3), ('deltat', 1), ('RASmax', (30, 45)),
+                        ('A', MRC_A * 2), ('deltat_sweep', [0])]:
+        old_value = getattr(rechg_worker, attr)
+        setattr(rechg_worker, attr, value)
+        assert rechg_worker.get_inputs_key(filters=False) != models_key
+        setattr(rechg_worker, attr, old_value)
+    assert rechg_worker.get_inputs_key(filters=False) == models_key
+
+
+def test_calcul_budget_aggregation():
+    """
+    Test that the monthly, yearly and hydrological yearly values of the
+    water budget are computed as expected from daily values.
+    """
+    index = pd.date_range('2010-01-15', '2012-10-10', freq='D')
+    glue_dly = {'years': index.year.values,
+                'months': index.month.values,
+                'precip': np.ones(len(index)),
+                'GLUE limits': [0.05, 0.5, 0.95]}
+    for i, var in enumerate(['recharge', 'evapo', 'runoff']):
+        glue_dly[var] = np.ones((len(index), 3)) * [1, 2, 3] * (i + 1)
+
+    glue_mly = calcul_mly_budget(glue_dly)
+    assert glue_mly['years'].tolist() == [2010, 2011, 2012]
+    expected = np.array([[np.nan, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+                         [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+                         [31, 29, 31, 30, 31, 30, 31, 31, 30, np.nan,
+                          np.nan, np.nan]])
+    assert np.array_equal(glue_mly['precip'], expected, equal_nan=True)
+    assert np.array_equal(glue_mly['runoff'][:, :, 1], expected * 6,
+                          equal_nan=True)
+
+    glue_yrly = calcul_yrly_budget(glue_mly)
+    assert np.isnan(glue_yrly['precip'][0])
+    assert glue_yrly['precip'][1] == 365
+    assert np.isnan(glue_yrly['precip'][2])
+
+    glue_hydro = calcul_hydro_yrly_budget(glue_dly)
+    assert glue_hydro['years'].tolist() == [2010, 2011]
+    assert glue_hydro['precip'].tolist() == [365, 366]
+    assert glue_hydro['recharge'][:, 2].tolist() == [365 * 3, 366 * 3]
+
+    # The first hydrological year starts at the beginning of the data
+    # when the data starts after the first of October.
+    start = np.where(index == '2010-11-01')[0][0]
+    glue_hydro = calcul_hydro_yrly_budget(
+        {key: (value[start:] if key != 'GLUE limits' else value) for
+         key, value in glue_dly.items()})
+    assert glue_hydro['precip'].tolist() == [334, 366]
+
+
+def test_calcul_hydro_yrly_budget_nan():
+    """
+    Test that a missing daily value only affects the hydrological year
+    in which it is and that the sums of the other years match those
+    computed from the daily values of each year separately.
+    """
+    index = pd.date_range('1900-10-01', '2020-09-30', freq='D')
+    rng = np.random.RandomState(0)
+    glue_dly = {'years': index.year.values,
+                'months': index.month.values,
+                'precip': rng.uniform(0, 50, len(index)),
+                'GLUE limits': [0.05, 0.5, 0.95]}
+    for var in ['recharge', 'evapo', 'runoff']:
+        glue_dly[var] = rng.uniform(0, 5, (len(index), 3))
+    for var in ['precip', 'recharge']:
+        glue_dly[var][10] = np.nan
+
+    glue_hydro = calcul_hydro_yrly_budget(glue_dly)
+    assert glue_hydro['years'].tolist() == list(range(1900, 2020))
+    for var in ['precip', 'recharge', 'evapo', 'runoff']:
+        expected = np.array([
+            np.sum(glue_dly[var][
+                (index >= '{}-10-01'.format(year)) &
+                (index <= '{}-09-30'.format(year + 1))], axis=0)
+            for year in glue_hydro['years']])
+        assert np.allclose(glue_hydro[var], expected, rtol=1e-12, atol=0,
+                           equal_nan=True)
+    assert np.isnan(glue_hydro['precip'][0])
+    assert np.all(np.isnan(glue_hydro['recharge'][0]))
+    assert not np.any(np.isnan(glue_hydro['recharge'][1:]))
+
+
+if __name__ == "__main__":
+    pytest.main(['-x', os.path.basename(__file__), '-v', '-rw'])
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+# -----------------------------------------------------------------------------
+
+# ---- Standard library imports
+import os
+
+# ---- Third party imports
+import numpy as np
+import pytest
+
+# ---- Local library imports
+from gwhat.gwrecharge.sensitivity import (
+    RechgSensitivityAnalysis, calcul_sobol_indices, calcul_morris_indices,
+    SENSITIVITY_PARAMS, SENSITIVITY_OUTPUTS)
+from gwhat.gwrecharge.tests.test_gwrecharge_calc import (
+    SyntheticWXDataFrame, SyntheticWLDataset)
+
+
+class LaggedWLDataset(SyntheticWLDataset):
+    """
+    A synthetic water level dataset whose water levels are only observed
+    from the 31st day of the weather data, so that lags can be applied.
+    """
+
+    def __init__(self, wxdset):
+        super().__init__(wxdset)
+        self.xldates = self.xldates[30:]
+        self['WL'] = self['WL'][30:]
+
+
+# =============================================================================
+# ---- Fixtures
+# =============================================================================
+@pytest.fixture(scope='module')
+def wxdset():
+    return SyntheticWXDataFrame(nyears=2)
+
+
+@pytest.fixture(scope='module')
+def wldset(wxdset):
+    return LaggedWLDataset(wxdset)
+
+
+@pytest.fixture
+def analysis(wxdset, wldset):
+    analysis = RechgSensitivityAnalysis()
+    analysis.nsamples = 64
+    analysis.nbootstrap = 10
+    analysis.seed = 0
+    assert analysis.load_data(wxdset, wldset) is None
+    return analysis
+
+
+# =============================================================================
+# ---- Tests
+# =============================================================================
+def test_calcul_sobol_indices():
+    """
+    Test that the Sobol indices of an additive function of independent
+    uniform variables are estimated correctly.
+    """
+    rng = np.random.default_rng(0)
+    N = 2**14
+    A, B = rng.random((N, 3)), rng.random((N, 3))
+    coeffs = np.array([1, 2, 0])
+    AB = np.repeat(A[np.newaxis, :, :], 3, axis=0)
+    for i in range(3):
+        AB[i, :, i] = B[:, i]
+    indices = calcul_sobol_indices(A @ coeffs, B @ coeffs, AB @ coeffs,
+                                   nbootstrap=10, seed=0)
+
+    expected = coeffs**2 / np.sum(coeffs**2)
+    assert np.allclose(indices['S1'], expected, atol=0.02)
+    assert np.allclose(indices['ST'], expected, atol=0.02)
+    assert np.all(indices['S1 conf'] >= 0)
+    assert indices['S1'][2] == 0 and indices['ST'][2] == 0
+
+
+def test_calcul_morris_indices(analysis):
+    """
+    Test that the elementary effects of a linear function are equal to
+    its coefficients over the unit hypercube.
+    """
+    trajectories, orders, delta = analysis.produce_morris_trajectories()
+    assert delta == pytest.approx(2 / 3)
+    assert np.all((trajectories >= 0) & (trajectories <= 1))
+    assert np.allclose(np.abs(np.diff(trajectories, axis=1)).sum(axis=2),
+                       delta)
+
+    coeffs = np.arange(len(SENSITIVITY_PARAMS)) - 2.0
+    indices = calcul_morris_indices(
+        trajectories, orders, trajectories @ coeffs)
+    assert np.allclose(indices['mu'], coeffs)
+    assert np.allclose(indices['mu_star'], np.abs(coeffs))
+    assert np.allclose(indices['sigma'], 0)
+
+
+@pytest.mark.parametrize('method', ['sobol', 'morris'])
+def test_run_sensitivity_analysis(analysis, method):
+    """
+    Test that the sensitivity of the annual recharge and of the RMSE of
+    the synthetic hydrograph to the parameters of the model is assessed as
+    expected.
+    """
+    analysis.method = method
+    results = analysis.run()
+    assert results['method'] == method
+    assert results['params'] == SENSITIVITY_PARAMS
+    assert results['outputs'] == SENSITIVITY_OUTPUTS
+    k = len(SENSITIVITY_PARAMS)
+    assert results['nmodels'] == (
+        64 * (k + 2) if method == 'sobol' else 64 * (k + 1))
+
+    # The annual recharge does not depend on Sy nor deltat.
+    indices = results['indices']['annual recharge']
+    for name in ['Sy', 'deltat']:
+        i = SENSITIVITY_PARAMS.index(name)
+        if method == 'sobol':
+            assert indices['S1'][i] == 0 and indices['ST'][i] == 0
+        else:
+            assert indices['mu_star'][i] == 0
+
+    # The RMSE of the synthetic hydrograph depends strongly on Sy.
+    indices = results['indices']['RMSE']
+    i = SENSITIVITY_PARAMS.index('Sy')
+    if method == 'sobol':
+        assert indices['ST'][i] > 0.1
+        assert np.all(indices['ST'] >= 0)
+    else:
+        assert indices['mu_star'][i] > 0
+
+
+@pytest.mark.parametrize('nsamples, expected', [(64, 64), (50, 64),
+                                                 (1000, 1024)])
+def test_produce_sobol_samples(analysis, nsamples, expected):
+    """
+    Test that the number of Sobol samples is rounded up to the next power
+    of two, so that the Sobol sequence is never truncated.
+    """
+    analysis.nsamples = nsamples
+    A, B, AB = analysis.produce_sobol_samples()
+    k = len(SENSITIVITY_PARAMS)
+    assert A.shape == B.shape == (expected, k)
+    assert AB.shape == (k, expected, k)
+
+    # Each of the expected intervals of equal width along each dimension
+    # must contain exactly one sample of a balanced Sobol sequence.
+    for samples in (A, B):
+        bins = np.floor(samples * expected).astype(int)
+        for j in range(k):
+            assert np.array_equal(np.sort(bins[:, j]), np.arange(expected))
+
+
+def test_eval_models_parallel(analysis):
+    """
+    Test that the models evaluated across a pool of processes give the
+    same results as those evaluated serially.
+    """
+    A, B, AB = analysis.produce_sobol_samples()
+    lower, upper = analysis._get_bounds()
+    samples = lower + A * (upper - lower)
+    expected = analysis.eval_models(samples)
+    assert expected.shape == (len(samples), len(SENSITIVITY_OUTPUTS))
+
+    analysis.nworkers = 2
+    assert np.array_equal(analysis.eval_models(samples), expected)
+
+
+def test_deltat_out_of_range(analysis):
+    """
+    Test that an error is raised when the lags exceed the period covered
+    by the weather data.
+    """
+    analysis.ranges['deltat'] = (0, 45)
+    with pytest.raises(ValueError):
+        analysis.run()
+
+
+if __name__ == "__main__":
+    pytest.main(['-x', os.path.basename(__file__), '-v', '-rw'])
@@ -306,10 +306,11 @@ class MasterRecessionCalcTool(WLCalcTool, SaveFileMixin):
 
         # Store and plot the results.
         print('Saving MRC interpretation in dataset...')
-        self.wldset.set_mrc(
-            A, B, self._mrc_period_xdata,
-            self.wldset.xldates, hp,
-            std_err, r_squared, rmse)
+        with self.wldset.transaction():
+            self.wldset.set_mrc(
+                A, B, self._mrc_period_xdata,
+                self.wldset.xldates, hp,
+                std_err, r_squared, rmse)
 
         self.show_mrc_results()
         self.btn_save_mrc.setEnabled(True)
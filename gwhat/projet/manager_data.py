@@ -11,10 +11,11 @@
 # ---- Standard Library imports
 import os
 import os.path as osp
+from contextlib import nullcontext
 
 # ---- Third party imports
 import numpy as np
-from PyQt5.QtCore import Qt, QCoreApplication
+from PyQt5.QtCore import Qt, QCoreApplication, QTimer
 from PyQt5.QtCore import pyqtSignal as QSignal
 from PyQt5.QtWidgets import (
     QWidget, QCheckBox, QComboBox, QGridLayout, QLabel, QMessageBox,
@@ -35,6 +36,10 @@ from gwhat.meteo.weather_reader import WXDataFrame
 from gwhat.widgets.buttons import ToolBarWidget
 from gwhat.widgets.spinboxes import StrSpinBox
 
+# The interval in msec at which the changes made to the project file are
+# flushed to the disk while the application is idle.
+FLUSH_INTERVAL = 2000
+
 
 class DataManager(QWidget):
 
@@ -57,6 +62,12 @@ class DataManager(QWidget):
 
         self.weather_avg_graph = None
 
+        # The changes made to the project file are flushed by this timer
+        # instead of after each change (see set_projet).
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setInterval(FLUSH_INTERVAL)
+        self._flush_timer.timeout.connect(self.flush_projet)
+
         self.new_waterlvl_win = NewDatasetDialog(
             'water level', parent, projet)
         self.new_waterlvl_win.sig_new_dataset_imported.connect(
@@ -76,6 +87,8 @@ class DataManager(QWidget):
 
     def close(self):
         """Close this data manager."""
+        self._flush_timer.stop()
+        self.flush_projet()
         if self.weather_avg_graph is not None:
             CONF.set('weather_normals_viewer',
                      'graphs_labels_language',
@@ -182,19 +195,38 @@ class DataManager(QWidget):
 
     def set_projet(self, projet):
         """Set the namespace for the projet hdf5 file."""
+        self.flush_projet()
         self._projet = projet
         self._wldset = None
         self._wxdset = None
         if projet is not None:
+            projet.set_deferred_flush(True)
+            self._flush_timer.start()
             self.update_wldsets(projet.get_last_opened_wldset())
             self.update_wxdsets(projet.get_last_opened_wxdset())
             self.wldset_changed()
+        else:
+            self._flush_timer.stop()
 
         self.btn_export_weather.set_model(self.get_current_wxdset())
 
         self.new_waterlvl_win.set_projet(projet)
         self.new_weather_win.set_projet(projet)
 
+    def flush_projet(self):
+        """Flush the changes that were made to the project file, if any."""
+        if self.projet is not None and self.projet.db is not None:
+            self.projet.flush_pending()
+
+    def transaction(self):
+        """
+        Return a context manager that groups the changes made to the
+        project, so that the project file is flushed only once.
+        """
+        if self.projet is None or self.projet.db is None:
+            return nullcontext()
+        return self.projet.transaction()
+
     # ---- Utilities
 
     def emit_warning(self, msg):
@@ -268,9 +300,10 @@ class DataManager(QWidget):
         update the GUI.
         """
         print("Saving the new water level dataset in the project...")
-        self.projet.add_wldset(name, dataset)
-        self.update_wldsets(name)
-        self.wldset_changed()
+        with self.transaction():
+            self.projet.add_wldset(name, dataset)
+            self.update_wldsets(name)
+            self.wldset_changed()
         print("New water level dataset saved in the project successfully.")
 
     def update_wldsets(self, name=None):
@@ -299,8 +332,9 @@ class DataManager(QWidget):
     def wldset_changed(self):
         """Handle when the currently selected water level dataset changed."""
         QApplication.processEvents()
-        self.update_wldset_info()
-        self.wldsetChanged.emit(self.get_current_wldset())
+        with self.transaction():
+            self.update_wldset_info()
+            self.wldsetChanged.emit(self.get_current_wldset())
 
     def get_current_wldset(self):
         """Return the currently selected water level dataset."""
@@ -331,9 +365,10 @@ class DataManager(QWidget):
                 elif reply == QMessageBox.Yes:
                     self._confirm_before_deleting_dset = dont_show_again
             self._wldset = None
-            self.projet.del_wldset(dsetname)
-            self.update_wldsets()
-            self.wldset_changed()
+            with self.transaction():
+                self.projet.del_wldset(dsetname)
+                self.update_wldsets()
+                self.wldset_changed()
             self.sig_new_console_msg.emit((
                 "<font color=black>Water level dataset <i>{}</i> deleted "
                 "successfully.</font>").format(dsetname))
@@ -384,9 +419,10 @@ class DataManager(QWidget):
         update the GUI.
         """
         print("Saving the new weather dataset in the project.", end=" ")
-        self.projet.add_wxdset(name, dataset)
-        self.update_wxdsets(name)
-        self.wxdset_changed()
+        with self.transaction():
+            self.projet.add_wxdset(name, dataset)
+            self.update_wxdsets(name)
+            self.wxdset_changed()
         print("done")
 
     def update_wxdsets(self, name=None, silent=False):
@@ -414,9 +450,10 @@ class DataManager(QWidget):
     def wxdset_changed(self):
         """Handle when the currently selected weather dataset changed."""
         QApplication.processEvents()
-        self.update_wxdset_info()
-        self.btn_export_weather.set_model(self.get_current_wxdset())
-        self.wxdsetChanged.emit(self.get_current_wxdset())
+        with self.transaction():
+            self.update_wxdset_info()
+            self.btn_export_weather.set_model(self.get_current_wxdset())
+            self.wxdsetChanged.emit(self.get_current_wxdset())
 
     def del_current_wxdset(self):
         """Delete the currently selected weather dataset."""
@@ -430,9 +467,10 @@ class DataManager(QWidget):
                 elif reply == QMessageBox.Yes:
                     self._confirm_before_deleting_dset = dont_show_again
             self._wxdset = None
-            self.projet.del_wxdset(dsetname)
-            self.update_wxdsets()
-            self.wxdset_changed()
+            with self.transaction():
+                self.projet.del_wxdset(dsetname)
+                self.update_wxdsets()
+                self.wxdset_changed()
             self.sig_new_console_msg.emit((
                 "<font color=black>Weather dataset <i>{}</i> deleted "
                 "successfully.</font>").format(dsetname))
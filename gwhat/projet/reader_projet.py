@@ -15,6 +15,7 @@ import os
 import os.path as osp
 from shutil import copyfile
 from collections import namedtuple
+from contextlib import contextmanager
 
 # ---- Third party imports
 import h5py
@@ -23,15 +24,35 @@ import pandas as pd
 import datetime
 
 # ---- Local library imports
+from gwhat.config.main import CONF
 from gwhat.meteo.weather_reader import WXDataFrameBase, METEO_VARIABLES
-from gwhat.projet.reader_waterlvl import WLDatasetBase, WLDataFrame
+from gwhat.projet.reader_waterlvl import (
+    WLDatasetBase, COLUMNS, INDEX)
 from gwhat.gwrecharge.glue import GLUEDataFrameBase
 from gwhat.common.utils import save_content_to_file
 from gwhat.utils.math import nan_as_text_tolist, calcul_rmse
-from gwhat.utils.dates import xldates_to_datetimeindex, xldates_to_strftimes
+from gwhat.utils.dates import (
+    xldates_to_datetimeindex, datetimeindex_to_xldates)
 
 INVALID_CHARS = ['\\', '/', ':', '*', '?', '"', '<', '>', '|']
 
+# The units of the time datasets in which the times are saved as the number
+# of nanoseconds elapsed since the Unix epoch (see create_time_dataset).
+TIME_UNITS = 'nanoseconds since 1970-01-01T00:00:00'
+
+# The compression filters that can be used to save the numerical arrays
+# in the project files (see get_storage_options).
+COMPRESSION_FILTERS = ['gzip', 'lzf', None]
+
+# Arrays smaller than this, in bytes, are saved uncompressed since the
+# chunking overhead would outweigh the gain of compressing them.
+MIN_COMPRESSED_NBYTES = 1024
+
+# The number of transactions opened on each project file, whether a flush
+# is pending and whether the flushes are deferred, keyed by the name of the
+# hdf5 files (see project_transaction and request_flush).
+_FLUSH_STATES = {}
+
 
 class ProjetReader(object):
     def __init__(self, filename):
@@ -87,12 +108,36 @@ class ProjetReader(object):
     def close(self):
         """Close the project hdf5 file."""
         try:
+            if self.db.id.valid:
+                _FLUSH_STATES.pop(self.db.filename, None)
             self.db.close()
             self.__db = None
         except AttributeError:
             # projet is None or already closed.
             pass
 
+    def transaction(self):
+        """
+        Return a context manager that groups the changes made to the
+        project, so that the project file is flushed only once when the
+        outermost transaction ends.
+        """
+        return project_transaction(self.db)
+
+    def set_deferred_flush(self, deferred):
+        """
+        Set whether the flushes of the project file are deferred until
+        flush_pending is called, for example when the application is idle.
+        """
+        set_deferred_flush(self.db, deferred)
+
+    def flush_pending(self):
+        """
+        Flush the project file if there are deferred changes and no
+        transaction is opened and return whether the file was flushed.
+        """
+        return flush_pending(self.db)
+
     def check_project_file(self):
         """Check to ensure that the project hdf5 file is not corrupt."""
         item_names = []
@@ -210,7 +255,7 @@ class ProjetReader(object):
         Set the name of the last opened water level dataset.
         """
         self.db['wldsets'].attrs['last_opened'] = name
-        self.db.flush()
+        request_flush(self.db)
 
     def get_wldset(self, name):
         """
@@ -239,16 +284,12 @@ class ProjetReader(object):
             grp = self.db['wldsets'].create_group(name)
 
             # Water level data
-            grp.create_dataset(
-                'Time',
-                data=np.array(df['Time'], dtype=h5py.special_dtype(vlen=str)))
-            # See http://docs.h5py.org/en/latest/strings.html as to why this
-            # is necessary to do this in order to save a list of strings in
-            # a dataset with h5py.
-
-            grp.create_dataset('WL', data=np.copy(df['WL']))
-            grp.create_dataset('BP', data=np.copy(df['BP']))
-            grp.create_dataset('ET', data=np.copy(df['ET']))
+            create_time_dataset(
+                grp, 'Time', df.data.index if isinstance(df, WLDatasetBase)
+                else pd.to_datetime(df['Time']))
+            create_compressed_dataset(grp, 'WL', np.copy(df['WL']))
+            create_compressed_dataset(grp, 'BP', np.copy(df['BP']))
+            create_compressed_dataset(grp, 'ET', np.copy(df['ET']))
 
             # Piezometric well info
             grp.attrs['filename'] = df['filename']
@@ -282,14 +323,14 @@ class ProjetReader(object):
             print(e)
             del self.db['wldsets'][name]
         finally:
-            self.db.flush()
+            request_flush(self.db)
 
         return WLDatasetHDF5(grp)
 
     def del_wldset(self, name):
         """Delete the specified water level dataset."""
         del self.db['wldsets/%s' % name]
-        self.db.flush()
+        request_flush(self.db)
 
     # ---- Weather Dataset Handlers
     @property
@@ -329,7 +370,7 @@ class ProjetReader(object):
         Set the name of the last opened weather dataset.
         """
         self.db['wxdsets'].attrs['last_opened'] = name
-        self.db.flush()
+        request_flush(self.db)
 
     def get_wxdset(self, name):
         """
@@ -360,35 +401,26 @@ class ProjetReader(object):
             grp.attrs[key] = value
 
         # Save time.
-        strtimes = np.array(
-            wxdset.strftime(), dtype=h5py.special_dtype(vlen=str))
-        grp.create_dataset('Time', data=strtimes)
-        # See http://docs.h5py.org/en/latest/strings.html as to why this
-        # is necessary to do this in order to save a list of strings in
-        # a dataset with h5py.
+        create_time_dataset(grp, 'Time', wxdset.data.index)
 
         # Save timeseries data
         for variable in METEO_VARIABLES:
-            grp.create_dataset(
-                variable, data=np.copy(wxdset.data[variable].values))
+            create_compressed_dataset(
+                grp, variable, np.copy(wxdset.data[variable].values))
 
         # Save times where data was missing.
         for variable in METEO_VARIABLES:
-            datetimeindex = wxdset.missing_value_indexes[variable]
-            strtimes = np.array(
-                datetimeindex.strftime("%Y-%m-%dT%H:%M:%S").values.tolist(),
-                dtype=h5py.special_dtype(vlen=str)
-                )
-            grp.create_dataset(
-                'Missing {}'.format(variable), data=strtimes)
+            create_time_dataset(
+                grp, 'Missing {}'.format(variable),
+                wxdset.missing_value_indexes[variable])
 
         print('Dataset {} created sucessfully.'.format(name))
-        self.db.flush()
+        request_flush(self.db)
 
     def del_wxdset(self, name):
         """Delete the specified weather dataset."""
         del self.db['wxdsets/%s' % name]
-        self.db.flush()
+        request_flush(self.db)
 
 
 class WLDatasetHDF5(WLDatasetBase):
@@ -397,6 +429,11 @@ class WLDatasetHDF5(WLDatasetBase):
     water level datasets. It mimick the structure of the DataFrame that
     is returned when loading water level dataset from an Excel file in
     reader_waterlvl module.
+
+    The data are read from the project file only when they are needed, so
+    that opening a dataset doesn't require to read its whole time series.
+    The time, the water levels and the data within a time window are read
+    directly from the hdf5 datasets until the data frame is loaded.
     """
 
     def __init__(self, hdf5group, *args, **kwargs):
@@ -407,15 +444,28 @@ class WLDatasetHDF5(WLDatasetBase):
         self.dset = hdf5group
         self._undo_stack = []
 
-        columns = []
-        data = []
-        for colname in ['Time', 'WL', 'BP', 'ET']:
-            if len(self.dset[colname][...]):
-                data.append(self.dset[colname][...])
-                columns.append(colname)
-        data = np.vstack(tuple(data)).transpose()
-        columns = tuple(columns)
-        self._dataf = WLDataFrame(data, columns)
+        # Make older datasets compatible with newer format.
+        if self.dset['Time'].attrs.get('units') != TIME_UNITS:
+            # Time needs to be converted from ISO date strings, or from
+            # Excel numeric dates for even older datasets, to int64
+            # nanoseconds, so that the dates don't need to be parsed each
+            # time the dataset is loaded.
+            print('Saving time as int64 nanoseconds instead of '
+                  'date strings...', end=' ')
+            migrate_time_dataset(self.dset, 'Time')
+            request_flush(self.dset.file)
+            print('done')
+        if 'monotonic' not in self.dset['Time'].attrs:
+            # This is required to query the data within a time window
+            # without reading the whole time series.
+            self.dset['Time'].attrs['monotonic'] = (
+                read_time_dataset(self.dset['Time']).is_monotonic_increasing)
+            request_flush(self.dset.file)
+
+        # The data frame is only loaded when needed (see the data property).
+        self._dataf = None
+        self._xldates = None
+        self._waterlevels = None
 
         # Setup the structure for the Master Recession Curve
         if 'mrc' not in list(self.dset.keys()):
@@ -429,33 +479,21 @@ class WLDatasetHDF5(WLDatasetBase):
                                dtype='float64', maxshape=(None,))
             mrc.create_dataset('time', data=np.array([]),
                                dtype='float64', maxshape=(None,))
-            self.dset.file.flush()
+            request_flush(self.dset.file)
 
         # Make older datasets compatible with newer format.
-        if isinstance(self.dset['Time'][0], (int, float)):
-            # Time needs to be converted from Excel numeric dates
-            # to ISO date strings (see PR #276).
-            print('Saving time as ISO date strings instead of Excel dates...',
-                  end=' ')
-            del self.dset['Time']
-            self.dset.create_dataset(
-                'Time',
-                data=np.array(self.strftime,
-                              dtype=h5py.special_dtype(vlen=str)))
-            self.dset.file.flush()
-            print('done')
         if 'Well ID' not in list(self.dset.attrs.keys()):
             # Added in version 0.2.1 (see PR #124).
             self.dset.attrs['Well ID'] = ""
-            self.dset.file.flush()
+            request_flush(self.dset.file)
         if 'Province' not in list(self.dset.attrs.keys()):
             # Added in version 0.2.1 (see PR #124).
             self.dset.attrs['Province'] = ""
-            self.dset.file.flush()
+            request_flush(self.dset.file)
         if 'glue' not in list(self.dset.keys()):
             # Added in version 0.3.1 (see PR #184)
             self.dset.create_group('glue')
-            self.dset.file.flush()
+            request_flush(self.dset.file)
         if self.dset['mrc/peak_indx'].dtype != np.dtype('float64'):
             # We need to convert peak_indx data to the format used in
             # gwhat >= 0.5.1, where we store the mrc periods as a series of
@@ -469,37 +507,230 @@ class WLDatasetHDF5(WLDatasetBase):
             # The only way to do that in HDF5 is to delete the dataset and
             # create a new one with the right dtype.
             del self.dset['mrc/peak_indx']
-            self.dset.file.flush()
+            request_flush(self.dset.file)
 
             self.dset['mrc'].create_dataset(
                 'peak_indx', data=np.array([]),
                 dtype='float64', maxshape=(None,))
             self.dset['mrc/peak_indx'].resize(np.shape(peak_indx))
             self.dset['mrc/peak_indx'][:] = np.array(peak_indx)
-            self.dset.file.flush()
+            request_flush(self.dset.file)
 
     def __getitem__(self, key):
         if key in list(self.dset.attrs.keys()):
             return self.dset.attrs[key]
+        elif key == 'Time':
+            # The times are returned as ISO date strings, as in WLDataset.
+            return read_time_dataset(self.dset['Time']).strftime(
+                "%Y-%m-%dT%H:%M:%S").values.tolist()
         else:
             return self.dset[key][...]
 
+    def __len__(self):
+        return len(self.dset['Time'])
+
     @property
     def dirname(self):
         return os.path.dirname(self.dset.file.filename)
 
+    def transaction(self):
+        """
+        Return a context manager that groups the changes made to the
+        dataset, so that the project file is flushed only once when the
+        outermost transaction ends.
+        """
+        return project_transaction(self.dset.file)
+
+    # ---- Data
+    @property
+    def data(self):
+        if self._dataf is None:
+            self._dataf = self._read_data(slice(None))
+        return self._dataf
+
+    @property
+    def xldates(self):
+        if self._xldates is None:
+            self._xldates = datetimeindex_to_xldates(
+                read_time_dataset(self.dset['Time']))
+        return self._xldates
+
+    @property
+    def dates(self):
+        return read_time_dataset(self.dset['Time']).values
+
+    @property
+    def strftime(self):
+        return read_time_dataset(self.dset['Time']).strftime(
+            "%Y-%m-%dT%H:%M:%S").values.tolist()
+
+    @property
+    def waterlevels(self):
+        if self._dataf is not None:
+            return self._dataf['WL'].values
+        # The water levels are cached so that the whole dataset is not
+        # read and decompressed each time they are accessed.
+        if self._waterlevels is None:
+            self._waterlevels = self.dset['WL'][...]
+        return self._waterlevels
+
+    def get_data_between(self, start=None, end=None):
+        """
+        Return a dataframe with the water level, barometric and earth tide
+        data of the dataset between the start and end dates inclusively.
+
+        Only the data within the time window are read from the project
+        file if the data frame is not loaded yet and the times are sorted.
+        """
+        is_sorted = self.dset['Time'].attrs['monotonic']
+        if self._dataf is not None or not is_sorted:
+            return super().get_data_between(start, end)
+        istart = (0 if start is None else
+                  self._search_time(pd.Timestamp(start), side='left'))
+        iend = (len(self) if end is None else
+                self._search_time(pd.Timestamp(end), side='right'))
+        return self._read_data(slice(istart, max(istart, iend)))
+
+    def _search_time(self, time, side='left'):
+        """
+        Return the index where time would be inserted in the sorted times
+        of the dataset, reading only the times required by a bisection.
+        """
+        value = np.datetime64(time, 'ns').view('int64')
+        times = self.dset['Time']
+        lo, hi = 0, len(times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[mid] < value or (side == 'right' and times[mid] == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _read_data(self, index):
+        """
+        Read the data at index from the project file and return them in a
+        data frame formatted as those produced by WLDataFrame.
+        """
+        data = pd.DataFrame(
+            [], columns=COLUMNS[1:],
+            index=pd.DatetimeIndex(
+                self.dset['Time'][index].view('datetime64[ns]'), name=INDEX),
+            dtype='float64')
+        for colname in COLUMNS[1:]:
+            if len(self.dset[colname]):
+                data[colname] = self.dset[colname][index]
+        return data
+
     @property
     def name(self):
         return osp.basename(self.dset.name)
 
     # ---- Water levels
     def commit(self):
-        """Commit the changes made to the water level data to the project."""
+        """
+        Commit the changes made to the water level data to the project.
+
+        Only the slabs of water levels that contain changes are written
+        and the changes are saved in the change log of the dataset (see
+        get_commit_log).
+        """
+        if not self.has_uncommited_changes:
+            return
+        indexes = np.unique(np.hstack(
+            [changes.index.values for changes in self._undo_stack]))
+        changed, old_values = self._write_waterlevels(
+            indexes, self.waterlevels[indexes])
+        if len(changed):
+            grp = self.dset.require_group('changelog')
+            idnum = str(max([int(key) for key in grp.keys()] or [0]) + 1)
+            save_dict_to_h5grp(grp.create_group(idnum), {
+                'index': changed,
+                'old': old_values,
+                'new': self.waterlevels[changed]})
+            grp[idnum].attrs['date'] = datetime.datetime.now().isoformat()
+        request_flush(self.dset.file)
+        self._undo_stack = []
+        self._waterlevels = None
+        print('Changes commited successfully.')
+
+    def get_commit_log(self):
+        """
+        Return a list with the changes that were commited to the water
+        level data, from the oldest to the most recent commit.
+
+        Each commit is a dict with the id number and date of the commit,
+        the indexes of the water levels that were changed and their old
+        and new values.
+        """
+        grp = self.dset.get('changelog')
+        if grp is None:
+            return []
+        commits = []
+        for idnum in sorted(grp.keys(), key=int):
+            commit = load_dict_from_h5grp(grp[idnum])
+            commit['idnum'] = idnum
+            commits.append(commit)
+        return commits
+
+    def rollback(self, idnum):
+        """
+        Revert the water levels to what they were before the commit
+        idnum, undoing this commit and all the more recent ones, and
+        remove these commits from the change log.
+        """
         if self.has_uncommited_changes:
-            self.dset['WL'][:] = np.copy(self.waterlevels)
-            self.dset.file.flush()
-            self._undo_stack = []
-            print('Changes commited successfully.')
+            raise ValueError("Uncommited changes must be commited or "
+                             "cleared before rolling back commits.")
+        idnums = [commit['idnum'] for commit in self.get_commit_log()]
+        if idnum not in idnums:
+            raise ValueError("There is no commit {} in the change log of "
+                             "this dataset.".format(idnum))
+        with self.transaction():
+            for commit in reversed(self.get_commit_log()):
+                self._write_waterlevels(commit['index'], commit['old'])
+                if self._dataf is not None:
+                    self._dataf.iloc[
+                        commit['index'], self._dataf.columns.get_loc('WL')
+                        ] = commit['old']
+                del self.dset['changelog'][commit['idnum']]
+                if commit['idnum'] == idnum:
+                    break
+        self._waterlevels = None
+        print('Commits rolled back successfully.')
+
+    def undo(self):
+        """Undo the last changes made to the water level data."""
+        super().undo()
+        self._waterlevels = None
+
+    def _write_waterlevels(self, indexes, values):
+        """
+        Write the water level values at the sorted indexes to the project
+        in contiguous slabs and return the indexes whose values were
+        changed along with their old values.
+
+        The slabs are coalesced over the gaps that are smaller than the
+        chunks of the dataset, since whole chunks are written anyway.
+        """
+        dset = self.dset['WL']
+        max_gap = 0 if dset.chunks is None else dset.chunks[0]
+        changed = []
+        old_values = []
+        for start, stop in coalesce_indexes(indexes, max_gap):
+            old = dset[start:stop]
+            new = old.copy()
+            i, j = np.searchsorted(indexes, [start, stop])
+            new[indexes[i:j] - start] = values[i:j]
+
+            is_changed = ~((old == new) | (np.isnan(old) & np.isnan(new)))
+            if np.any(is_changed):
+                dset[start:stop] = new
+                changed.append(np.flatnonzero(is_changed) + start)
+                old_values.append(old[is_changed])
+        if changed:
+            return np.hstack(changed), np.hstack(old_values)
+        return np.array([], dtype=int), np.array([])
 
     # ---- Manual measurements
     def set_wlmeas(self, time, wl):
@@ -514,7 +745,7 @@ class WLDatasetHDF5(WLDatasetBase):
             mmeas = self.dset.create_group('manual')
             mmeas.create_dataset('Time', data=time, maxshape=(None,))
             mmeas.create_dataset('WL', data=wl, maxshape=(None,))
-        self.dset.file.flush()
+        request_flush(self.dset.file)
 
     def get_wlmeas(self):
         """Get the water level measurements for this dataset."""
@@ -542,7 +773,7 @@ class WLDatasetHDF5(WLDatasetBase):
         self.dset['mrc'].attrs['r_squared'] = r_squared
         self.dset['mrc'].attrs['rmse'] = rmse
 
-        self.dset.file.flush()
+        request_flush(self.dset.file)
 
     def get_mrc(self):
         """Return the mrc results stored in the hdf5 project file."""
@@ -606,7 +837,7 @@ class WLDatasetHDF5(WLDatasetBase):
         df = pd.DataFrame(
             np.vstack([self['WL'], self['mrc/recess']]).transpose(),
             columns=['h_obs(mbgs)', 'h_sim(mbgs)'],
-            index=pd.to_datetime(self['Time']))
+            index=read_time_dataset(self.dset['Time']))
         df.index.name = 'Time'
         df.to_csv(filename)
 
@@ -619,25 +850,32 @@ class WLDatasetHDF5(WLDatasetBase):
 
     # ---- GLUE data
     def glue_idnums(self):
-        """Return the id numbers of all the previously saved GLUE results"""
-        return list(self.dset['glue'].keys())
+        """
+        Return the id numbers of all the previously saved GLUE results,
+        from the oldest to the most recent.
+        """
+        return sorted([key for key in self.dset['glue'].keys() if
+                       key.isdigit()], key=int)
 
     def glue_count(self):
         """Return the number of GLUE results saved in this dataset."""
         return len(self.glue_idnums())
 
-    def save_glue(self, gluedf):
-        """Save GLUE results in the project hdf file."""
-        if list(self.dset['glue'].keys()):
-            idnum = np.array(list(self.dset['glue'].keys())).astype(int)
+    def _new_glue_idnum(self):
+        """Return the id number to use for new GLUE results."""
+        if self.glue_idnums():
+            idnum = np.array(self.glue_idnums()).astype(int)
             idnum = np.max(idnum) + 1
         else:
             idnum = 1
-        idnum = str(idnum)
+        return str(idnum)
 
+    def save_glue(self, gluedf):
+        """Save GLUE results in the project hdf file."""
+        idnum = self._new_glue_idnum()
         grp = self.dset['glue'].create_group(idnum)
         save_dict_to_h5grp(grp, gluedf)
-        self.dset.file.flush()
+        request_flush(self.dset.file)
         print('GLUE results saved successfully')
 
     def get_glue(self, idnum):
@@ -654,19 +892,128 @@ class WLDatasetHDF5(WLDatasetBase):
         else:
             return self.get_glue(idnum)
 
+    def find_glue(self, inputs_key):
+        """
+        Return the id number of the most recent GLUE results that were
+        produced with the inputs identified by inputs_key (see
+        RechgEvalWorker.get_inputs_key) or None if there is none.
+        """
+        for idnum in reversed(self.glue_idnums()):
+            dset = self.dset['glue'][idnum].get('inputs key')
+            if dset is None:
+                continue
+            key = dset[()]
+            if isinstance(key, bytes):
+                key = key.decode('utf8')
+            if key == inputs_key:
+                return idnum
+        return None
+
+    def set_glue_as_latest(self, idnum):
+        """
+        Set the GLUE results at idnum as the most recent ones and return
+        their new id number.
+        """
+        if idnum != self.glue_idnums()[-1]:
+            new_idnum = self._new_glue_idnum()
+            self.dset['glue'].move(idnum, new_idnum)
+            request_flush(self.dset.file)
+            idnum = new_idnum
+        return idnum
+
     def del_glue(self, idnum):
         """Delete GLUE results at idnum."""
         if idnum in self.glue_idnums():
             del self.dset['glue'][idnum]
-            self.dset.file.flush()
+            request_flush(self.dset.file)
             print('GLUE data %s deleted successfully' % idnum)
         else:
             print('GLUE data %s does not exist' % idnum)
 
-    def clear_glue(self):
-        """Delete all GLUE results from the dataset."""
-        while self.glue_count():
-            self.del_glue(self.glue_idnums()[0])
+    def clear_glue(self, keep=0):
+        """
+        Delete all GLUE results from the dataset, except for the keep
+        most recent ones.
+        """
+        with self.transaction():
+            while self.glue_count() > keep:
+                self.del_glue(self.glue_idnums()[0])
+
+    def save_glue_checkpoint(self, key, data):
+        """
+        Save the progress of a GLUE run that is identified by key in the
+        project hdf file.
+
+        The arrays in data are appended to those previously saved for the
+        same run, while the scalar values are overwritten. The checkpoint of
+        any other GLUE run is deleted.
+        """
+        grp = self.dset['glue'].get('checkpoint')
+        if grp is not None and grp.attrs.get('key') != key:
+            del self.dset['glue']['checkpoint']
+            grp = None
+        if grp is None:
+            grp = self.dset['glue'].create_group('checkpoint')
+            grp.attrs['key'] = key
+        append_dict_to_h5grp(grp, data)
+        # The checkpoints are flushed right away, even within a transaction,
+        # since they are meant to survive a crash of the application.
+        self.dset.file.flush()
+
+    def get_glue_checkpoint(self, key):
+        """
+        Return a dict with the progress saved for the GLUE run identified by
+        key or None if there is no checkpoint saved for that run.
+        """
+        grp = self.dset['glue'].get('checkpoint')
+        if grp is None or grp.attrs.get('key') != key:
+            return None
+        data = load_dict_from_h5grp(grp)
+        data.update({k: v for k, v in grp.attrs.items() if k != 'key'})
+        return data
+
+    def del_glue_checkpoint(self):
+        """Delete the progress saved for a GLUE run, if any."""
+        if 'checkpoint' in self.dset['glue']:
+            del self.dset['glue']['checkpoint']
+            request_flush(self.dset.file)
+
+    # ---- Sensitivity analysis
+    def save_sensitivity(self, results):
+        """
+        Save the results of a sensitivity analysis of the recharge model
+        (see RechgSensitivityAnalysis) in the project hdf file, replacing
+        those previously saved for the same method.
+        """
+        grp = self.dset.require_group('sensitivity')
+        method = results['method']
+        if method in grp:
+            del grp[method]
+        results = results.copy()
+        # We need to encode the strings because it cannot be saved in hdf5
+        # otherwise. See https://github.com/h5py/h5py/issues/289.
+        for key in ['params', 'outputs']:
+            results[key] = [s.encode('utf8') for s in results[key]]
+        save_dict_to_h5grp(grp.create_group(method), results)
+        request_flush(self.dset.file)
+        print('Sensitivity analysis results saved successfully')
+
+    def get_sensitivity(self, method='sobol'):
+        """
+        Return the results of the sensitivity analysis done with method
+        or None if there is none saved in the project.
+        """
+        grp = self.dset.get('sensitivity')
+        if grp is None or method not in grp:
+            return None
+        results = load_dict_from_h5grp(grp[method])
+        for key in ['params', 'outputs']:
+            results[key] = [
+                s.decode('utf8') if isinstance(s, bytes) else s for
+                s in results[key]]
+        if isinstance(results['method'], bytes):
+            results['method'] = results['method'].decode('utf8')
+        return results
 
     # ---- Barometric response function
     def saved_brf(self):
@@ -691,7 +1038,7 @@ class WLDatasetHDF5(WLDatasetBase):
             raise ValueError("The size of the specified 'period' must be 2.")
         grp = self.dset.require_group('brf')
         grp.attrs['period'] = period
-        self.dset.file.flush()
+        request_flush(self.dset.file)
 
     def get_brfperiod(self):
         """
@@ -744,7 +1091,7 @@ class WLDatasetHDF5(WLDatasetBase):
             grp.attrs['detrending'] = ''
             flush = True
         if flush:
-            self.dset.file.flush()
+            request_flush(self.dset.file)
 
         # Cast the data into a pandas dataframe.
         keys = ['Lag', 'A', 'sdA', 'SumA', 'sdSumA', 'B',
@@ -779,21 +1126,21 @@ class WLDatasetHDF5(WLDatasetBase):
 
         # Save the data in the h5py group.
         for column in dataf.columns:
-            grp.create_dataset(
-                column, data=dataf[column].values, dtype='float64')
+            create_compressed_dataset(
+                grp, column, dataf[column].values, dtype='float64')
         grp.attrs['date start'] = date_start.isoformat()
         grp.attrs['date end'] = date_end.isoformat()
         grp.attrs['detrending'] = {
             True: 'Yes', False: 'No', None: ''}[detrending]
 
-        self.dset.file.flush()
+        request_flush(self.dset.file)
         print('done')
 
     def del_brf(self, name):
         """Delete the BRF evaluation saved with the specified name."""
         if name in list(self.dset['brf'].keys()):
             del self.dset['brf'][name]
-            self.dset.file.flush()
+            request_flush(self.dset.file)
             print('BRF %s deleted successfully' % name)
         else:
             print('BRF does not exist')
@@ -850,7 +1197,7 @@ class WLDatasetHDF5(WLDatasetBase):
                     grp.attrs[key] = '__' + str(layout[key]) + '__'
                 else:
                     grp.attrs[key] = layout[key]
-        self.dset.file.flush()
+        request_flush(self.dset.file)
 
     def get_layout(self):
         """Return the layout dict that is saved in the project hdf5 file."""
@@ -915,15 +1262,15 @@ class WXDataFrameHDF5(WXDataFrameBase):
         self.dataset = dataset
 
         # Make older datasets compatible with newer format.
-        if isinstance(dataset['Time'][0], (int, float)):
-            # Time needs to be converted from Excel numeric dates
-            # to ISO date strings (see jnsebgosselin/gwhat#297).
-            print('Saving time as ISO date strings instead of Excel dates...',
-                  end=' ')
-            strtimes = xldates_to_strftimes(dataset['Time'])
-            del dataset['Time']
-            dataset.create_dataset('Time', data=strtimes)
-            dataset.file.flush()
+        if dataset['Time'].attrs.get('units') != TIME_UNITS:
+            # Time needs to be converted from ISO date strings, or from
+            # Excel numeric dates for even older datasets, to int64
+            # nanoseconds, so that the dates don't need to be parsed each
+            # time the dataset is loaded.
+            print('Saving time as int64 nanoseconds instead of '
+                  'date strings...', end=' ')
+            migrate_time_dataset(dataset, 'Time')
+            request_flush(dataset.file)
             print('done')
         if 'Location' not in list(dataset.attrs.keys()):
             # Added in version 0.4.0 (see jnsebgosselin/gwhat#297).
@@ -932,7 +1279,7 @@ class WXDataFrameHDF5(WXDataFrameBase):
                 del dataset.attrs['Province']
             else:
                 dataset.attrs['Location'] = ''
-            dataset.file.flush()
+            request_flush(dataset.file)
         if 'Station ID' not in list(dataset.attrs.keys()):
             # Added in version 0.4.0 (see jnsebgosselin/gwhat#297).
             if 'Climate Identifier' in dataset.attrs.keys():
@@ -941,7 +1288,7 @@ class WXDataFrameHDF5(WXDataFrameBase):
                 del dataset.attrs['Climate Identifier']
             else:
                 dataset.attrs['Station ID'] = ''
-            dataset.file.flush()
+            request_flush(dataset.file)
         for key in ['yearly', 'monthly', 'normals', 'Period']:
             # Removed in version 0.4.0 (see jnsebgosselin/gwhat#297).
             if key in dataset.keys():
@@ -950,9 +1297,12 @@ class WXDataFrameHDF5(WXDataFrameBase):
                        "not needed anymore.").format(key))
         for variable in METEO_VARIABLES:
             key = 'Missing {}'.format(variable)
-            if (key in dataset.keys() and len(dataset[key]) > 0 and
+            if (key not in dataset.keys() or
+                    dataset[key].attrs.get('units') == TIME_UNITS):
+                continue
+            if (len(dataset[key]) > 0 and
                     isinstance(dataset[key][0], (int, float))):
-                print(("Saving missing {} data time as ISO date strings "
+                print(("Saving missing {} data time as int64 nanoseconds "
                        "instead of Excel dates...").format(variable),
                       end=' ')
                 # The missing data were previously saved as a list
@@ -972,9 +1322,17 @@ class WXDataFrameHDF5(WXDataFrameBase):
                 except ValueError:
                     pass
                 else:
-                    strtimes = xldates_to_strftimes(restruct_missing_idx)
-                    dataset.create_dataset(key, data=strtimes)
-                dataset.file.flush()
+                    create_time_dataset(
+                        dataset, key,
+                        xldates_to_datetimeindex(restruct_missing_idx))
+                request_flush(dataset.file)
+                print('done')
+            else:
+                print(("Saving missing {} data time as int64 nanoseconds "
+                       "instead of date strings...").format(variable),
+                      end=' ')
+                migrate_time_dataset(dataset, key)
+                request_flush(dataset.file)
                 print('done')
 
         # Get the metadata.
@@ -985,7 +1343,7 @@ class WXDataFrameHDF5(WXDataFrameBase):
         self.data = pd.DataFrame(
             [],
             columns=METEO_VARIABLES,
-            index=pd.to_datetime(dataset['Time'], infer_datetime_format=True)
+            index=read_time_dataset(dataset['Time'])
             )
         for variable in METEO_VARIABLES:
             self.data[variable] = np.copy(dataset[variable])
@@ -995,8 +1353,8 @@ class WXDataFrameHDF5(WXDataFrameBase):
         for variable in METEO_VARIABLES:
             key = 'Missing {}'.format(variable)
             if key in dataset.keys():
-                self.missing_value_indexes[variable] = pd.to_datetime(
-                    dataset[key][:], infer_datetime_format=True)
+                self.missing_value_indexes[variable] = read_time_dataset(
+                    dataset[key])
 
     @property
     def name(self):
@@ -1047,6 +1405,196 @@ def make_dsetname_valid(dsetname):
     return dsetname
 
 
+def _get_flush_state(h5file):
+    return _FLUSH_STATES.setdefault(
+        h5file.filename, {'depth': 0, 'pending': False, 'deferred': False})
+
+
+def request_flush(h5file):
+    """
+    Flush the hdf5 file, unless a transaction is opened on it or its
+    flushes are deferred, in which case the flush is postponed until the
+    outermost transaction ends or flush_pending is called.
+    """
+    state = _get_flush_state(h5file)
+    if state['depth'] > 0 or state['deferred']:
+        state['pending'] = True
+    else:
+        h5file.flush()
+        state['pending'] = False
+
+
+def flush_pending(h5file):
+    """
+    Flush the hdf5 file if a flush is pending and no transaction is opened
+    on it and return whether the file was flushed.
+    """
+    state = _get_flush_state(h5file)
+    if state['pending'] and state['depth'] == 0:
+        h5file.flush()
+        state['pending'] = False
+        return True
+    return False
+
+
+def set_deferred_flush(h5file, deferred):
+    """
+    Set whether the flushes requested for the hdf5 file are deferred until
+    flush_pending is called. Any pending flush is done when the flushes
+    stop being deferred.
+    """
+    _get_flush_state(h5file)['deferred'] = bool(deferred)
+    if not deferred:
+        flush_pending(h5file)
+
+
+@contextmanager
+def project_transaction(h5file):
+    """
+    A context manager that groups the changes made to the hdf5 file, so
+    that it is flushed only once when the outermost transaction ends
+    instead of after each change.
+    """
+    state = _get_flush_state(h5file)
+    state['depth'] += 1
+    try:
+        yield
+    finally:
+        state['depth'] -= 1
+        if not state['deferred']:
+            flush_pending(h5file)
+
+
+def coalesce_indexes(indexes, max_gap=0):
+    """
+    Return a list of the (start, stop) ranges of the contiguous slabs that
+    contain the sorted indexes, where indexes separated by max_gap
+    positions or less are coalesced in the same slab.
+    """
+    indexes = np.asarray(indexes, dtype=int)
+    if len(indexes) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indexes) > max_gap + 1) + 1
+    starts = indexes[np.r_[0, breaks]]
+    stops = indexes[np.r_[breaks - 1, len(indexes) - 1]] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def get_storage_options():
+    """
+    Return the options used to chunk and compress the numerical arrays
+    that are saved in the project files, as set in the user configs.
+
+    The compression filter is either 'gzip', 'lzf' or None to save the
+    arrays uncompressed. The compression level only applies to 'gzip' and
+    the chunk size is in KiB, where 0 lets h5py guess the chunk shape.
+    """
+    compression = CONF.get('project', 'hdf5_compression')
+    if compression in ('', 'none', 'None'):
+        compression = None
+    if compression not in COMPRESSION_FILTERS:
+        raise ValueError("The compression filter must be one of {}.".format(
+            COMPRESSION_FILTERS))
+    return {'compression': compression,
+            'compression_level': int(
+                CONF.get('project', 'hdf5_compression_level')),
+            'shuffle': bool(CONF.get('project', 'hdf5_shuffle')),
+            'chunk_size': int(CONF.get('project', 'hdf5_chunk_size'))}
+
+
+def get_chunk_shape(shape, itemsize, chunk_size, resizable=False):
+    """
+    Return the shape of the chunks of a dataset of the given shape, so that
+    each chunk holds complete rows and is about chunk_size KiB. The chunks
+    are not limited to the length of the dataset if it is resizable.
+    """
+    if not chunk_size:
+        return True
+    rowsize = itemsize * int(np.prod(shape[1:]))
+    nrows = max(1, chunk_size * 1024 // max(rowsize, 1))
+    if not resizable:
+        nrows = max(1, min(shape[0], nrows))
+    return (nrows,) + tuple(shape[1:])
+
+
+def create_compressed_dataset(h5grp, name, data, dtype=None, maxshape=None,
+                              options=None):
+    """
+    Create a dataset in the hdf5 group that is chunked and compressed
+    according to the storage options of the projects.
+
+    Only the numerical arrays are compressed. Strings, scalars and arrays
+    smaller than MIN_COMPRESSED_NBYTES are saved as is, unless they can be
+    resized, in which case they need to be chunked anyway.
+    """
+    options = get_storage_options() if options is None else options
+    values = np.asarray(data, dtype=dtype)
+
+    kwargs = {'dtype': dtype, 'maxshape': maxshape}
+    is_numeric = values.ndim > 0 and values.dtype.kind in 'biuf'
+    if maxshape is not None:
+        kwargs['chunks'] = True
+    if is_numeric and (maxshape is not None or
+                       values.nbytes >= MIN_COMPRESSED_NBYTES):
+        if options['compression'] is not None:
+            kwargs['chunks'] = get_chunk_shape(
+                values.shape, values.dtype.itemsize, options['chunk_size'],
+                resizable=maxshape is not None)
+            kwargs['compression'] = options['compression']
+            kwargs['shuffle'] = options['shuffle']
+            if options['compression'] == 'gzip':
+                kwargs['compression_opts'] = options['compression_level']
+    return h5grp.create_dataset(name, data=data, **kwargs)
+
+
+def create_time_dataset(h5grp, name, datetimes):
+    """
+    Save the datetimes in a int64 dataset of the hdf5 group as the number
+    of nanoseconds elapsed since the Unix epoch. The 'units' attribute of
+    the dataset is set to TIME_UNITS.
+    """
+    values = pd.DatetimeIndex(datetimes).values.astype('datetime64[ns]')
+    dset = create_compressed_dataset(h5grp, name, values.view('int64'))
+    dset.attrs['units'] = TIME_UNITS
+    dset.attrs['monotonic'] = bool(np.all(values[1:] >= values[:-1]))
+    return dset
+
+
+def read_time_dataset(h5dset):
+    """
+    Return a pandas datetime index with the times saved in the hdf5 dataset.
+
+    The times are saved as int64 nanoseconds since the Unix epoch in the
+    current project format (see create_time_dataset), but they can also be
+    saved as ISO date strings or as Excel numeric dates in older projects.
+    """
+    values = h5dset[...]
+    if h5dset.attrs.get('units') == TIME_UNITS:
+        return pd.DatetimeIndex(values.view('datetime64[ns]'))
+    if len(values) == 0:
+        return pd.DatetimeIndex([])
+    if values.dtype.kind in 'iuf':
+        return xldates_to_datetimeindex(values).round('S')
+
+    # The strings are returned as bytes with h5py >= 3.0.
+    strtimes = values.astype('S').astype('U')
+    try:
+        return pd.to_datetime(strtimes, format="%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return pd.to_datetime(strtimes)
+
+
+def migrate_time_dataset(h5grp, name):
+    """
+    Convert the times saved in a format used in older projects in the
+    dataset name of the hdf5 group to int64 nanoseconds since the Unix
+    epoch (see create_time_dataset).
+    """
+    datetimes = read_time_dataset(h5grp[name])
+    del h5grp[name]
+    create_time_dataset(h5grp, name, datetimes)
+
+
 def save_dict_to_h5grp(h5grp, dic):
     """
     Save the content of a dictionay recursively in a hdf5.
@@ -1057,7 +1605,29 @@ def save_dict_to_h5grp(h5grp, dic):
         if isinstance(item, dict):
             save_dict_to_h5grp(h5grp.require_group(key), item)
         else:
-            h5grp.create_dataset(key, data=item)
+            create_compressed_dataset(h5grp, key, item)
+
+
+def append_dict_to_h5grp(h5grp, dic):
+    """
+    Append the arrays of a dictionary along their first axis to the
+    datasets of the same name in a hdf5 group, creating them if needed.
+    Scalar values are saved as attributes of the group instead.
+    """
+    for key, item in dic.items():
+        item = np.asarray(item)
+        if item.ndim == 0:
+            h5grp.attrs[key] = item
+        elif len(item) == 0:
+            continue
+        elif key in h5grp:
+            dset = h5grp[key]
+            n = dset.shape[0]
+            dset.resize(n + len(item), axis=0)
+            dset[n:] = item
+        else:
+            create_compressed_dataset(
+                h5grp, key, item, maxshape=(None,) + item.shape[1:])
 
 
 def load_dict_from_h5grp(h5grp):
@@ -300,7 +300,7 @@ class WLDatasetBase(Mapping):
         raise NotImplementedError
 
     def __len__(self):
-        return len(self._dataf)
+        return len(self.data)
 
     def __setitem__(self, key, value):
         raise NotImplementedError
@@ -319,14 +319,14 @@ class WLDatasetBase(Mapping):
         Return a numpy array containing the Excel numerical dates
         corresponding to the dates of the dataset.
         """
-        if 'XLDATES' not in self._dataf.columns:
+        if 'XLDATES' not in self.data.columns:
             print('Converting datetimes to xldates...', end=' ')
             timedeltas = (
-                self._dataf.index - xlrd.xldate.xldate_as_datetime(4000, 0))
-            self._dataf['XLDATES'] = (
+                self.data.index - xlrd.xldate.xldate_as_datetime(4000, 0))
+            self.data['XLDATES'] = (
                 timedeltas.total_seconds()/(3600 * 24) + 4000)
             print('done')
-        return self._dataf['XLDATES'].values
+        return self.data['XLDATES'].values
 
     @property
     def dates(self):
@@ -340,6 +340,18 @@ class WLDatasetBase(Mapping):
     def waterlevels(self):
         return self.data['WL'].values
 
+    def get_data_between(self, start=None, end=None):
+        """
+        Return a dataframe with the water level, barometric and earth tide
+        data of the dataset between the start and end dates inclusively.
+        """
+        mask = np.ones(len(self.data), dtype=bool)
+        if start is not None:
+            mask &= self.data.index >= pd.Timestamp(start)
+        if end is not None:
+            mask &= self.data.index <= pd.Timestamp(end)
+        return self.data.loc[mask, COLUMNS[1:]]
+
     # ---- Versionning
     @property
     def has_uncommited_changes(self):
@@ -356,7 +368,9 @@ class WLDatasetBase(Mapping):
         """Undo the last changes made to the water level data."""
         if self.has_uncommited_changes:
             changes = self._undo_stack.pop(-1)
-            self._dataf['WL'][changes.index] = changes
+            self.data.iloc[
+                changes.index, self.data.columns.get_loc('WL')
+                ] = changes.values
 
     def clear_all_changes(self):
         """
@@ -370,16 +384,22 @@ class WLDatasetBase(Mapping):
         """Delete the water level data at the specified indexes."""
         if len(indexes):
             self._add_to_undo_stack(indexes)
-            self._dataf['WL'].iloc[indexes] = np.nan
+            self.data.iloc[indexes, self.data.columns.get_loc('WL')] = np.nan
 
     def _add_to_undo_stack(self, indexes):
         """
         Store the old water level values at the specified indexes in a stack
         before changing or deleting them. This allow to undo or cancel any
         changes made to the water level data before commiting them.
+
+        The old values are stored in a series indexed by the positions of
+        the water levels, so that the positions that were changed are known
+        when commiting the changes.
         """
         if len(indexes):
-            self._undo_stack.append(self._dataf['WL'].iloc[indexes].copy())
+            indexes = np.asarray(indexes, dtype=int)
+            self._undo_stack.append(pd.Series(
+                self.data['WL'].values[indexes], index=indexes))
 
 
 class WLDataset(WLDatasetBase):
@@ -290,6 +290,26 @@ def test_last_opened_datasets(qtbot, projectpath):
     assert datamanager2.get_current_wxdset().name == 'wxdset2'
 
 
+def test_deferred_flush(datamanager, mocker, qtbot):
+    """
+    Test that the changes made to the project through the data manager are
+    flushed to the disk by the idle timer instead of after each change.
+    """
+    flush = mocker.spy(datamanager.projet, 'flush_pending')
+    datamanager.new_wldset_imported('wldset1', WLDataset(WLFILENAME))
+    datamanager.new_wldset_imported('wldset2', WLDataset(WLFILENAME))
+    datamanager.set_current_wldset('wldset1')
+    assert datamanager._flush_timer.isActive()
+
+    qtbot.waitUntil(lambda: flush.call_count > 0, timeout=5000)
+    assert datamanager.projet.flush_pending() is False
+
+    datamanager.set_current_wldset('wldset2')
+    datamanager.close()
+    assert not datamanager._flush_timer.isActive()
+    assert datamanager.projet.flush_pending() is False
+
+
 # ---- Tests ExportWeatherButton
 def test_export_yearly_monthly_daily(datamanager, mocker, qtbot, tmp_path):
     """
@@ -15,13 +15,18 @@ os.environ['GWHAT_PYTEST'] = 'True'
 
 # ---- Third party imports
 import numpy as np
+import pandas as pd
 import pytest
 import h5py
 
 # ---- Local imports
 from gwhat import __rootdir__
 from gwhat.common.utils import save_content_to_file
-from gwhat.projet.reader_projet import ProjetReader
+from gwhat.meteo.weather_reader import WXDataFrame
+from gwhat.projet import reader_projet
+from gwhat.projet.reader_projet import (
+    ProjetReader, append_dict_to_h5grp, load_dict_from_h5grp,
+    save_dict_to_h5grp, get_chunk_shape, coalesce_indexes, TIME_UNITS)
 from gwhat.projet.manager_projet import (
     ProjetManager, QFileDialog, QMessageBox, CONF)
 from gwhat.projet.reader_waterlvl import WLDataset
@@ -30,6 +35,8 @@ from gwhat.utils.math import nan_as_text_tolist
 NAME = "test @ prô'jèt!"
 LAT = 45.40
 LON = 73.15
+WXFILENAME = osp.join(
+    __rootdir__, 'projet', 'tests', 'data', 'sample_weather_datafile.csv')
 
 
 # =============================================================================
@@ -517,6 +524,350 @@ def test_project_backward_compatibility(oldprojectfile):
     assert mrc_data['r_squared'] is None
     assert mrc_data['rmse'] is None
 
+    # Make sure the time saved as date strings was converted to int64
+    # nanoseconds when the dataset was opened.
+    assert wldset.dset['Time'].dtype == np.dtype('int64')
+    assert wldset.dset['Time'].attrs['units'] == TIME_UNITS
+    assert wldset['Time'][:2] == ['2012-11-28T16:45:00', '2012-11-28T17:00:00']
+    assert len(wldset.xldates) == 32925
+
+
+def test_time_storage(project, testfile):
+    """
+    Test that the times of the water level and weather datasets are saved
+    as int64 nanoseconds in the project and that the datasets saved with
+    date strings are converted when they are opened.
+    """
+    wldset = WLDataset(testfile)
+    wxdset = WXDataFrame(WXFILENAME)
+    project.add_wldset('dataset_test', wldset)
+    project.add_wxdset('wxdset_test', wxdset)
+
+    wlgrp = project.db['wldsets/dataset_test']
+    wxgrp = project.db['wxdsets/wxdset_test']
+    for dset in [wlgrp['Time'], wxgrp['Time'], wxgrp['Missing Tavg']]:
+        assert dset.dtype == np.dtype('int64')
+        assert dset.attrs['units'] == TIME_UNITS
+
+    # The times are still exported as ISO date strings.
+    assert project.get_wldset('dataset_test')['Time'] == wldset['Time']
+
+    # Save the times as date strings, as in older projects.
+    for grp, name in [(wlgrp, 'Time'), (wxgrp, 'Time'),
+                      (wxgrp, 'Missing Tavg')]:
+        strtimes = np.array(
+            pd.DatetimeIndex(grp[name][...].view('datetime64[ns]'))
+            .strftime("%Y-%m-%dT%H:%M:%S").values.tolist(),
+            dtype=h5py.special_dtype(vlen=str))
+        del grp[name]
+        grp.create_dataset(name, data=strtimes)
+
+    wldset2 = project.get_wldset('dataset_test')
+    assert wlgrp['Time'].dtype == np.dtype('int64')
+    assert wlgrp['Time'].attrs['units'] == TIME_UNITS
+    assert np.array_equal(wldset2.xldates, wldset.xldates)
+
+    wxdset2 = project.get_wxdset('wxdset_test')
+    assert wxgrp['Time'].dtype == np.dtype('int64')
+    assert wxgrp['Missing Tavg'].dtype == np.dtype('int64')
+    assert wxdset2.data.index.equals(wxdset.data.index)
+    assert wxdset2.missing_value_indexes['Tavg'].equals(
+        wxdset.missing_value_indexes['Tavg'])
+
+
+def test_lazy_wldset(project, testfile):
+    """
+    Test that the data of the water level datasets are read from the
+    project only when needed and that the data within a time window are
+    read without loading the whole data frame.
+    """
+    wldset = WLDataset(testfile)
+    project.add_wldset('dataset_test', wldset)
+
+    hdf5wldset = project.get_wldset('dataset_test')
+    assert len(hdf5wldset) == len(wldset)
+    assert np.array_equal(hdf5wldset.xldates, wldset.xldates)
+    assert np.array_equal(hdf5wldset.waterlevels, wldset.waterlevels)
+    assert np.array_equal(hdf5wldset.dates, wldset.dates)
+
+    # The water levels are read from the project only once.
+    assert hdf5wldset.waterlevels is hdf5wldset.waterlevels
+
+    start, end = wldset.data.index[100], wldset.data.index[250]
+    window = hdf5wldset.get_data_between(start, end)
+    assert window.equals(wldset.get_data_between(start, end))
+    assert len(window) == 151
+    assert len(hdf5wldset.get_data_between(end='1900-01-01')) == 0
+    assert len(hdf5wldset.get_data_between(start=start)) == len(wldset) - 100
+    assert hdf5wldset._dataf is None
+
+    # The data frame is loaded when needed and the changes made to the
+    # water levels are seen by the other accessors until commited.
+    assert hdf5wldset.data.equals(wldset.data[['BP', 'WL', 'ET']])
+    hdf5wldset.delete_waterlevels_at([100, 101])
+    assert np.isnan(hdf5wldset.waterlevels[100])
+    assert np.isnan(hdf5wldset.get_data_between(start, end)['WL'].iloc[0])
+    hdf5wldset.commit()
+    hdf5wldset = project.get_wldset('dataset_test')
+    assert np.isnan(hdf5wldset.waterlevels[[100, 101]]).all()
+
+    # The whole data are filtered when the times are not sorted.
+    hdf5wldset.dset['Time'].attrs['monotonic'] = False
+    window = hdf5wldset.get_data_between(start, end)
+    assert len(window) == 151
+    assert hdf5wldset._dataf is not None
+
+
+def test_project_transaction(project, testfile, mocker):
+    """
+    Test that the project file is flushed only once for the changes made
+    within a transaction and that deferred flushes are done when requested.
+    """
+    project.add_wldset('dataset_test', WLDataset(testfile))
+    wldset = project.get_wldset('dataset_test')
+    flush = mocker.spy(h5py.File, 'flush')
+
+    project.set_last_opened_wldset('dataset_test')
+    assert flush.call_count == 1
+
+    flush.reset_mock()
+    with project.transaction():
+        project.set_last_opened_wldset('dataset_test')
+        with wldset.transaction():
+            wldset.save_brfperiod((41000, 41010))
+            wldset.save_layout({'TIMEmin': 36526, 'legend_on': True})
+        assert flush.call_count == 0
+    assert flush.call_count == 1
+    assert wldset.get_layout()['legend_on'] is True
+
+    # A transaction without changes doesn't flush the file.
+    flush.reset_mock()
+    with project.transaction():
+        project.get_last_opened_wldset()
+    assert flush.call_count == 0
+
+    # The flushes are deferred until they are requested explicitly.
+    project.set_deferred_flush(True)
+    project.set_last_opened_wldset('dataset_test')
+    with project.transaction():
+        wldset.save_brfperiod((41000, 41020))
+    assert flush.call_count == 0
+    assert project.flush_pending() is True
+    assert flush.call_count == 1
+    assert project.flush_pending() is False
+    assert flush.call_count == 1
+
+    project.set_last_opened_wldset('dataset_test')
+    project.set_deferred_flush(False)
+    assert flush.call_count == 2
+
+
+def test_commit_waterlevels(project, testfile, mocker):
+    """
+    Test that only the slabs of water levels that were changed are written
+    when commiting changes and that the commits can be rolled back from
+    the change log of the dataset.
+    """
+    project.add_wldset('dataset_test', WLDataset(testfile))
+    wldset = project.get_wldset('dataset_test')
+    original = wldset.waterlevels.copy()
+    expected = wldset.waterlevels.copy()
+    assert wldset.get_commit_log() == []
+
+    wldset.delete_waterlevels_at([100])
+    wldset.undo()
+    assert wldset.waterlevels[100] == original[100]
+
+    wldset.delete_waterlevels_at([20000, 20001])
+    wldset.delete_waterlevels_at([5, 7, 6])
+    wldset.delete_waterlevels_at([7])
+    coalesce = mocker.spy(reader_projet, 'coalesce_indexes')
+    wldset.commit()
+    assert coalesce.spy_return == [(5, 8), (20000, 20002)]
+
+    expected[[5, 6, 7, 20000, 20001]] = np.nan
+    hdf5wldset = project.get_wldset('dataset_test')
+    assert np.array_equal(hdf5wldset.waterlevels, expected, equal_nan=True)
+
+    # Commit a second series of changes and check the change log.
+    wldset.delete_waterlevels_at([7, 8])
+    wldset.commit()
+    commit_log = wldset.get_commit_log()
+    assert [commit['idnum'] for commit in commit_log] == ['1', '2']
+    assert commit_log[0]['index'].tolist() == [5, 6, 7, 20000, 20001]
+    assert commit_log[0]['old'].tolist() == original[
+        [5, 6, 7, 20000, 20001]].tolist()
+    assert commit_log[1]['index'].tolist() == [8]
+    assert np.isnan(commit_log[1]['new']).all()
+
+    # Roll back all the commits from a dataset whose data frame is not
+    # loaded, to make sure the cached water levels are updated.
+    hdf5wldset = project.get_wldset('dataset_test')
+    assert np.isnan(hdf5wldset.waterlevels[8])
+    hdf5wldset.rollback('1')
+    assert hdf5wldset._dataf is None
+    assert hdf5wldset.get_commit_log() == []
+    assert np.array_equal(hdf5wldset.waterlevels, original)
+    assert np.array_equal(hdf5wldset.dset['WL'][...], original)
+
+    with pytest.raises(ValueError):
+        hdf5wldset.rollback('1')
+
+    assert coalesce_indexes([]) == []
+    assert coalesce_indexes([2, 3, 4, 8, 10]) == [(2, 5), (8, 9), (10, 11)]
+    assert coalesce_indexes([2, 3, 4, 8, 10], max_gap=3) == [(2, 11)]
+
+
+def test_edit_waterlevels_copy_on_write(project, testfile):
+    """
+    Test that deleting, undoing and rolling back changes to the water
+    levels change the data frame of the dataset when the copy-on-write
+    mode of pandas is enabled.
+    """
+    project.add_wldset('dataset_test', WLDataset(testfile))
+    wldset = project.get_wldset('dataset_test')
+    original = wldset.waterlevels.copy()
+    with pd.option_context('mode.copy_on_write', True):
+        wldset.delete_waterlevels_at([5, 6])
+        assert np.isnan(wldset.data['WL'].iloc[[5, 6]]).all()
+        wldset.undo()
+        assert np.array_equal(wldset.data['WL'].values, original)
+
+        wldset.delete_waterlevels_at([5, 6])
+        wldset.commit()
+        assert np.isnan(wldset.data['WL'].iloc[[5, 6]]).all()
+        wldset.rollback('1')
+        assert np.array_equal(wldset.data['WL'].values, original)
+        assert np.array_equal(wldset.waterlevels, original)
+
+
+def test_glue_cache(project, testfile):
+    """
+    Test that GLUE results are retrieved from the project with the key of
+    the inputs that were used to produce them.
+    """
+    project.add_wldset('dataset_test', WLDataset(testfile))
+    wldset = project.get_wldset('dataset_test')
+    for i in range(12):
+        wldset.save_glue({'count': i, 'inputs key': 'key{}'.format(i % 3)})
+    assert wldset.glue_idnums() == [str(i) for i in range(1, 13)]
+    assert wldset.get_glue_at(-1)['count'] == 11
+
+    # The most recent results produced with a key are returned.
+    assert wldset.find_glue('key1') == '11'
+    assert wldset.find_glue('key3') is None
+
+    # Set the results found with a key as the most recent ones.
+    assert wldset.set_glue_as_latest('11') == '13'
+    assert wldset.get_glue_at(-1)['count'] == 10
+    assert wldset.set_glue_as_latest('13') == '13'
+
+    # Delete all but the most recent results.
+    wldset.clear_glue(keep=2)
+    assert wldset.glue_idnums() == ['12', '13']
+    assert wldset.find_glue('key0') is None
+    assert wldset.find_glue('key2') == '12'
+
+
+def test_save_sensitivity(project, testfile):
+    """
+    Test that the results of a sensitivity analysis of the recharge model
+    are saved in and retrieved from the project as expected.
+    """
+    project.add_wldset('dataset_test', WLDataset(testfile))
+    wldset = project.get_wldset('dataset_test')
+    assert wldset.get_sensitivity('sobol') is None
+
+    results = {'method': 'sobol',
+               'params': ['Cro', 'Sy'],
+               'outputs': ['annual recharge', 'RMSE'],
+               'ranges': {'Cro': (0.1, 0.3), 'Sy': (0.05, 0.2)},
+               'nsamples': 8,
+               'nmodels': 32,
+               'indices': {'annual recharge': {'S1': [1, 0], 'ST': [1, 0]},
+                           'RMSE': {'S1': [0.2, 0.7], 'ST': [0.3, 0.8]}}}
+    wldset.save_sensitivity(results)
+    wldset.save_sensitivity(results)
+
+    saved_results = wldset.get_sensitivity('sobol')
+    assert saved_results['method'] == 'sobol'
+    assert saved_results['params'] == ['Cro', 'Sy']
+    assert saved_results['outputs'] == ['annual recharge', 'RMSE']
+    assert saved_results['nmodels'] == 32
+    assert np.array_equal(saved_results['indices']['RMSE']['ST'], [0.3, 0.8])
+    assert wldset.get_sensitivity('morris') is None
+
+
+def test_append_dict_to_h5grp(tmp_path):
+    """
+    Test that the arrays of a dictionary are appended as expected to the
+    datasets of a hdf5 group, as it is done to save GLUE checkpoints.
+    """
+    with h5py.File(osp.join(tmp_path, 'test.h5'), mode='w') as hdf5file:
+        grp = hdf5file.create_group('checkpoint')
+        append_dict_to_h5grp(grp, {'RMSE': np.array([1.5, 2.5]),
+                                   'hydrograph': np.ones((2, 4)),
+                                   'index': np.array([], dtype=int),
+                                   'ndone': 2})
+        assert 'index' not in grp
+        append_dict_to_h5grp(grp, {'RMSE': np.array([3.5]),
+                                   'hydrograph': np.zeros((1, 4)),
+                                   'index': np.array([7]),
+                                   'ndone': 8})
+
+        data = load_dict_from_h5grp(grp)
+        assert data['RMSE'].tolist() == [1.5, 2.5, 3.5]
+        assert data['hydrograph'].tolist() == [[1] * 4, [1] * 4, [0] * 4]
+        assert data['index'].tolist() == [7]
+        assert grp.attrs['ndone'] == 8
+
+
+
+def test_compressed_storage(project, testfile, tmp_path):
+    """
+    Test that the numerical arrays saved in the project are chunked and
+    compressed according to the storage options set in the configs.
+    """
+    CONF.reset_to_defaults()
+    project.add_wldset('dataset_test', WLDataset(testfile))
+    grp = project.db['wldsets/dataset_test']
+    for name in ['Time', 'WL']:
+        assert grp[name].compression == 'gzip'
+        assert grp[name].compression_opts == 1
+        assert grp[name].shuffle is False
+        assert grp[name].chunks == (8192,)
+    assert len(grp['WL']) == 33000
+
+    # Small arrays and strings are not compressed.
+    save_dict_to_h5grp(grp.create_group('dict'), {
+        'values': np.arange(1000, dtype=float),
+        'params': np.array([0.1, 0.2]),
+        'wlinfo': {'Well': 'well'}})
+    assert grp['dict/values'].compression == 'gzip'
+    assert grp['dict/params'].compression is None
+    assert grp['dict/wlinfo/Well'].compression is None
+
+    CONF.set('project', 'hdf5_compression', 'lzf')
+    CONF.set('project', 'hdf5_shuffle', True)
+    with h5py.File(osp.join(tmp_path, 'test.h5'), mode='w') as hdf5file:
+        h5grp = hdf5file.create_group('checkpoint')
+        append_dict_to_h5grp(h5grp, {'hydrograph': np.ones((2, 400))})
+        append_dict_to_h5grp(h5grp, {'hydrograph': np.zeros((1, 400))})
+        assert h5grp['hydrograph'].compression == 'lzf'
+        assert h5grp['hydrograph'].shuffle is True
+        assert h5grp['hydrograph'].chunks == (20, 400)
+        assert h5grp['hydrograph'].shape == (3, 400)
+
+    CONF.set('project', 'hdf5_compression', None)
+    project.add_wldset('dataset_test2', WLDataset(testfile))
+    assert project.db['wldsets/dataset_test2/WL'].compression is None
+    assert project.db['wldsets/dataset_test2/WL'].chunks is None
+    CONF.reset_to_defaults()
+
+    assert get_chunk_shape((10, 4), 8, 64) == (10, 4)
+    assert get_chunk_shape((0, 4), 8, 64, resizable=True) == (2048, 4)
+    assert get_chunk_shape((10, 4), 8, 0) is True
+
 
 if __name__ == "__main__":
     pytest.main(['-x', __file__, '-v', '-rw'])
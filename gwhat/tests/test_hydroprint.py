@@ -12,6 +12,7 @@ import os
 import os.path as osp
 
 # ---- Third Party Libraries Imports
+import numpy as np
 import pytest
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QApplication
@@ -22,6 +23,7 @@ from gwhat.meteo.weather_reader import WXDataFrame
 from gwhat.projet.reader_waterlvl import WLDataset
 from gwhat.HydroPrint2 import (HydroprintGUI, PageSetupWin, QFileDialog,
                                QMessageBox)
+from gwhat.hydrograph4 import filt_data
 from gwhat.projet.manager_data import DataManager
 from gwhat.projet.reader_projet import ProjetReader
 
@@ -321,5 +323,23 @@ def test_pagesetup_ok(pagesetup, qtbot):
     assert not pagesetup.isVisible()
 
 
+
+def test_filt_data():
+    """
+    Test that the water levels of an irregular time series with gaps and
+    missing values are interpolated linearly at the start of each day
+    before computing the moving average of the trend line.
+    """
+    rng = np.random.RandomState(0)
+    time = np.sort(np.r_[0, 60, rng.uniform(0, 60, 500)])
+    time = time[(time < 20) | (time > 30)]
+    waterlvl = 0.1 * time + 2
+    waterlvl[rng.choice(np.arange(1, len(time) - 1), 50)] = np.nan
+
+    tf, wlf = filt_data(time, waterlvl, 5)
+    assert np.array_equal(tf, np.arange(2, 59))
+    assert np.allclose(wlf, 0.1 * tf + 2)
+
+
 if __name__ == "__main__":
     pytest.main(['-x', __file__, '-v', '-rw'])
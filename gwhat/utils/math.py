@@ -50,6 +50,91 @@ def calc_goodness_of_fit(xobs, xpre):
     return std_err, r_value**2, rmse
 
 
+def weighted_quantiles(x, weights, q):
+    """
+    Compute the weighted quantiles of each column of a 2D array.
+
+    The quantiles are interpolated linearly on the cumulative density
+    function of the sorted values of each column, which gives the same
+    results as calling np.interp column by column, but all the columns and
+    all the quantiles are processed at once.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 2D numpy array of shape (n, m) containing n values for each of
+        the m columns.
+    weights : np.ndarray
+        A 1D numpy array of length n containing the weight of each row of x.
+        The weights must be positive and sum to 1.
+    q : array-like
+        The probabilities, between 0 and 1, of the quantiles to compute.
+
+    Returns
+    -------
+    quantiles : np.ndarray
+        A 2D numpy array of shape (m, len(q)) containing the weighted
+        quantiles of each column of x.
+    """
+    # We work on the transpose of x, so that the values of each column
+    # are contiguous in memory when sorting them.
+    xt = np.ascontiguousarray(np.asarray(x, dtype=float).T)
+    weights = np.asarray(weights, dtype=float)
+    m, n = xt.shape
+    if n == 0:
+        return np.full((m, len(q)), np.nan)
+
+    # Sort the values of each column and compute the cumulative density
+    # function of each column from the weights of the sorted values.
+    isort = np.argsort(xt, axis=1)
+    cdf = np.cumsum(weights[isort], axis=1)
+
+    quantiles = np.empty((m, len(q)))
+    rows = np.arange(m)
+    for k, qk in enumerate(q):
+        # Find for each column the index j of the sorted values such
+        # that cdf[j] <= qk < cdf[j + 1].
+        j = np.count_nonzero(cdf <= qk, axis=1) - 1
+        j0 = np.clip(j, 0, n - 1)
+        j1 = np.clip(j + 1, 0, n - 1)
+        x0 = xt[rows, isort[rows, j0]]
+        x1 = xt[rows, isort[rows, j1]]
+        c0 = cdf[rows, j0]
+        c1 = cdf[rows, j1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = (x1 - x0) / (c1 - c0) * (qk - c0) + x0
+
+        # Values outside of the range of the cdf are set to the first or
+        # last sorted value, as in np.interp.
+        mask = (c0 == qk) | (j < 0) | (j >= n - 1)
+        values[mask] = x0[mask]
+        quantiles[:, k] = values
+    return quantiles
+
+
+def weighted_quantiles_blocked(x, weights, q, blocksize=None):
+    """
+    Compute the weighted quantiles of each column of a 2D array by blocks of
+    columns.
+
+    This gives the same results as weighted_quantiles, but limits the size
+    of the temporary arrays, so that they fit in the CPU cache when x is
+    large. If blocksize is None, the number of columns of a block is set
+    so that the temporary arrays of a block use about 4 MB of memory.
+    See weighted_quantiles for a description of the other parameters.
+    """
+    n, m = np.shape(x)
+    if blocksize is None:
+        # The transposed values, the sorted indexes and the cdf of a block
+        # need 3 * 8 bytes for each value of x.
+        blocksize = max(1, 4 * 1024**2 // (24 * max(n, 1)))
+    quantiles = np.empty((m, len(q)))
+    for i in range(0, m, blocksize):
+        quantiles[i:i + blocksize] = weighted_quantiles(
+            x[:, i:i + blocksize], weights, q)
+    return quantiles
+
+
 def clip_time_series(tclip, tp, xp):
     """
     Clip tp and xp on tclip. tclip and tp must be arrays of numerical
@@ -72,6 +157,106 @@ def clip_time_series(tclip, tp, xp):
     return tp, xp
 
 
+RESAMPLING_POLICIES = ['last', 'mean', 'median', 'min', 'max']
+
+
+def resample_time_series(t, x, binwidth=1, policy='last', origin=0):
+    """
+    Resample the time series x on regular time bins of width binwidth.
+
+    The time bins are defined as [origin + k * binwidth,
+    origin + (k + 1) * binwidth), where k goes from the bin that contains
+    the first value of t to the bin that contains the last value of t.
+    The values of x that fall in a same bin are aggregated with one of the
+    following policies :
+
+    'last'
+        The last value of x in the bin, nan values included. When several
+        values have the same time, the last one in x is kept.
+    'mean', 'median', 'min', 'max'
+        The mean, median, minimum or maximum of the values of x in the bin,
+        ignoring nan values.
+
+    The bins that contain no value, or only nan values for the policies
+    that ignore them, are set to nan.
+
+    Parameters
+    ----------
+    t : array-like
+        The times of the values of x. The times do not need to be sorted.
+    x : array-like
+        The values of the time series.
+    binwidth : float
+        The width of the time bins, in the same units as t.
+    policy : str
+        The policy used to aggregate the values that fall in a same bin.
+    origin : float
+        The time at which a bin starts.
+
+    Returns
+    -------
+    tbins : np.ndarray
+        The start time of each bin.
+    xbins : np.ndarray
+        The resampled values of x.
+    """
+    if policy not in RESAMPLING_POLICIES:
+        raise ValueError("policy value must be one of", RESAMPLING_POLICIES)
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x, dtype=float)
+    if len(t) == 0:
+        return np.array([], dtype=float), np.array([], dtype=float)
+
+    # Sort the values in time once, using a stable sort so that values
+    # with the same time are kept in the order in which they appear in x.
+    argsort = np.argsort(t, kind='stable')
+    kbins = np.floor((t[argsort] - origin) / binwidth).astype(np.int64)
+    x = x[argsort]
+
+    kmin = kbins[0]
+    tbins = origin + np.arange(kmin, kbins[-1] + 1) * binwidth
+    xbins = np.full(len(tbins), np.nan)
+
+    # Find the index of the first and last value of each non empty bin.
+    ubins, istart = np.unique(kbins, return_index=True)
+    iend = np.append(istart[1:], len(x)) - 1
+    ubins = ubins - kmin
+
+    if policy == 'last':
+        xbins[ubins] = x[iend]
+    elif policy == 'mean':
+        isnan = np.isnan(x)
+        sums = np.add.reduceat(np.where(isnan, 0, x), istart)
+        counts = np.add.reduceat(~isnan, istart)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xbins[ubins] = np.where(counts > 0, sums / counts, np.nan)
+    elif policy == 'min':
+        xbins[ubins] = np.fmin.reduceat(x, istart)
+    elif policy == 'max':
+        xbins[ubins] = np.fmax.reduceat(x, istart)
+    elif policy == 'median':
+        # Sort the values within each bin, nan values last, and take the
+        # middle value(s) of the valid values of each bin.
+        x = x[np.lexsort((x, kbins))]
+        counts = np.add.reduceat(~np.isnan(x), istart)
+        valid = counts > 0
+        ilow = istart + np.maximum(counts - 1, 0) // 2
+        ihigh = istart + np.maximum(counts, 1) // 2
+        xbins[ubins[valid]] = (x[ilow[valid]] + x[ihigh[valid]]) / 2
+    return tbins, xbins
+
+
+def resample_daily(t, x, policy='last'):
+    """
+    Resample the time series x on a daily basis, where t is in numerical
+    Excel dates or any other time in days. Return the days as integers and
+    the resampled values of x. See resample_time_series for a description
+    of the policies that can be used to aggregate the values of a same day.
+    """
+    td, xd = resample_time_series(t, x, binwidth=1, policy=policy)
+    return td.astype(int), xd
+
+
 def convert_date_to_datetime(years, months, days):
     """
     Produce datetime series from years, months, and days series.
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+# ---- Standard imports
+import os
+
+# ---- Third party imports
+import numpy as np
+import pytest
+
+# ---- Local imports
+from gwhat.utils.math import (
+    weighted_quantiles, weighted_quantiles_blocked, resample_daily,
+    resample_time_series)
+
+
+# ---- Fixtures
+@pytest.fixture
+def weighted_values():
+    """
+    A set of random values with repeated values and their weights.
+    """
+    rng = np.random.default_rng(0)
+    x = rng.random((50, 300))
+    x[:, ::3] = 0
+    x[:25, 1::5] = 0.5
+    weights = 1 / rng.random(50)
+    weights = weights / np.sum(weights)
+    return x, weights
+
+
+# ---- Tests
+@pytest.mark.parametrize('blocksize', [None, 1, 7, 1000])
+def test_weighted_quantiles(weighted_values, blocksize):
+    """
+    Assert that the weighted quantiles are the same as those obtained by
+    interpolating the cumulative density function of each column with
+    np.interp.
+    """
+    x, weights = weighted_values
+    q = [0, 0.05, 0.25, 0.5, 0.75, 0.95, 1]
+
+    expected = np.empty((x.shape[1], len(q)))
+    for i in range(x.shape[1]):
+        isort = np.argsort(x[:, i])
+        cdf = np.cumsum(weights[isort])
+        expected[i, :] = np.interp(q, cdf, x[isort, i])
+
+    if blocksize is None:
+        quantiles = weighted_quantiles(x, weights, q)
+        assert np.array_equal(quantiles, expected)
+    quantiles = weighted_quantiles_blocked(x, weights, q, blocksize)
+    assert np.array_equal(quantiles, expected)
+
+
+def test_weighted_quantiles_single_value():
+    """
+    Assert that the weighted quantiles of columns with a single value are
+    equal to that value.
+    """
+    x = np.array([[1.5, -2, 0]])
+    quantiles = weighted_quantiles(x, [1], [0.05, 0.5, 0.95])
+    assert np.array_equal(quantiles, np.repeat(x.T, 3, axis=1))
+
+
+@pytest.mark.parametrize('policy', ['last', 'mean', 'median', 'min', 'max'])
+def test_resample_daily(policy):
+    """
+    Assert that resampling a time series on a daily basis is working as
+    expected for all the policies.
+    """
+    t = np.array([2.5, 0.1, 0.9, 0.5, 0.3, 2.2, 2.9, 2.1, 4.5, 4.7, 2.4])
+    x = np.array([9, 1, 4, np.nan, 2, 3, np.nan, 7, np.nan, np.nan, 5])
+    expected = {
+        'last': [4, np.nan, np.nan, np.nan, np.nan],
+        'mean': [7/3, np.nan, 6, np.nan, np.nan],
+        'median': [2, np.nan, 6, np.nan, np.nan],
+        'min': [1, np.nan, 3, np.nan, np.nan],
+        'max': [4, np.nan, 9, np.nan, np.nan]}[policy]
+
+    td, xd = resample_daily(t, x, policy)
+    assert td.dtype == int
+    assert np.array_equal(td, [0, 1, 2, 3, 4])
+    assert np.allclose(xd, expected, equal_nan=True)
+
+
+def test_resample_time_series():
+    """
+    Assert that resampling a time series on regular time bins of any width
+    and origin is working as expected.
+    """
+    t = np.array([1, 1.05, 1.1, 1.5, 1.55, 2.05, 3.1])
+    x = np.array([1, 2, 3, 4, 5, 6, 7])
+    tbins, xbins = resample_time_series(
+        t, x, binwidth=0.5, policy='mean', origin=-0.05)
+    assert np.allclose(tbins, [0.95, 1.45, 1.95, 2.45, 2.95])
+    assert np.allclose(xbins, [2, 4.5, 6, np.nan, 7], equal_nan=True)
+
+    tbins, xbins = resample_time_series([], [], policy='last')
+    assert len(tbins) == len(xbins) == 0
+
+    with pytest.raises(ValueError):
+        resample_time_series(t, x, policy='sum')
+
+
+if __name__ == "__main__":
+    pytest.main(['-x', os.path.basename(__file__), '-v', '-rw'])
@@ -6,16 +6,74 @@
 # This file is part of GWHAT (GroundWater Hydrograph Analysis Toolbox).
 # Licensed under the terms of the GNU General Public License.
 
+import os
+import os.path as osp
+import shutil
+import tempfile
+from distutils.ccompiler import new_compiler
+from distutils.errors import CompileError, LinkError
+from distutils.sysconfig import customize_compiler
+
 import numpy
 from numpy.distutils.core import setup, Extension
 from Cython.Build import cythonize
 from gwhat import __version__, __project_url__
 
 
+OPENMP_TEST_CODE = """
+#include <omp.h>
+int main(void) {
+    return omp_get_max_threads() > 0 ? 0 : 1;
+}
+"""
+
+
+def get_openmp_flags():
+    """
+    Return the compile and link flags required to build the extensions
+    with OpenMP support, or empty lists if the compiler does not support
+    OpenMP, so that the extensions are built serially instead.
+
+    Set the GWHAT_DISABLE_OPENMP environment variable to build the
+    extensions without OpenMP.
+    """
+    if os.environ.get('GWHAT_DISABLE_OPENMP'):
+        return [], []
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    if compiler.compiler_type == 'msvc':
+        compile_flags, link_flags = ['/openmp'], []
+    else:
+        compile_flags, link_flags = ['-fopenmp'], ['-fopenmp']
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = osp.join(tmpdir, 'test_openmp.c')
+        with open(filename, 'w') as f:
+            f.write(OPENMP_TEST_CODE)
+        objects = compiler.compile(
+            [filename], output_dir=tmpdir, extra_postargs=compile_flags)
+        compiler.link_executable(
+            objects, osp.join(tmpdir, 'test_openmp'),
+            extra_postargs=link_flags)
+    except (CompileError, LinkError):
+        print("OpenMP is not supported by the compiler. "
+              "The extensions will be built without OpenMP.")
+        return [], []
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return compile_flags, link_flags
+
+
+OPENMP_COMPILE_FLAGS, OPENMP_LINK_FLAGS = get_openmp_flags()
+
 RECHGEXT = Extension(
     name='gwhat.gwrecharge.gwrecharge_calculs',
     sources=['gwhat/gwrecharge/gwrecharge_calculs.pyx'],
-    include_dirs=[numpy.get_include()]
+    include_dirs=[numpy.get_include()],
+    extra_compile_args=OPENMP_COMPILE_FLAGS,
+    extra_link_args=OPENMP_LINK_FLAGS
     )
 
 setup(name='GWHAT',